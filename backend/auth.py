@@ -0,0 +1,144 @@
+"""
+Password hashing and session tokens.
+
+Passwords are stored as bcrypt hashes. bcrypt is deliberately slow
+(BCRYPT_ROUNDS, default 12, is a few hundred milliseconds of CPU), so
+hashing runs on its own small pool of HASH_WORKERS threads rather than
+on the event loop or the threadpool the sync routes share: a burst of
+logins queues up behind that pool instead of starving trades of workers
+and the event loop. bcrypt releases the GIL while it works, so the
+threads hash in parallel.
+
+Accounts created before hashing still hold their plaintext password.
+Those are compared in constant time and `needs_rehash` tells the caller
+to store a proper hash on the next successful login.
+
+`/login` then issues a signed token (an HS256 JWT: user id, username and
+expiry, signed with AUTH_SECRET). Requests send it as
+`Authorization: Bearer <token>` and any worker can check it with one
+HMAC, no database lookup. Set the same AUTH_SECRET on every worker; without
+one each process makes up its own and tokens don't outlive a restart.
+"""
+import asyncio
+import base64
+import hashlib
+import hmac
+import json
+import os
+import secrets
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import bcrypt
+
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+HASH_WORKERS = int(os.getenv("HASH_WORKERS", str(min(4, os.cpu_count() or 1))))
+
+_hash_pool = ThreadPoolExecutor(max_workers=HASH_WORKERS, thread_name_prefix="password-hash")
+
+# bcrypt only looks at the first 72 bytes of a password
+_MAX_PASSWORD_BYTES = 72
+
+
+def _encode(password: str) -> bytes:
+    return password.encode("utf-8")[:_MAX_PASSWORD_BYTES]
+
+
+def is_hashed(stored: str) -> bool:
+    return bool(stored) and stored.startswith(("$2a$", "$2b$", "$2y$"))
+
+
+def hash_password(password: str) -> str:
+    return bcrypt.hashpw(_encode(password), bcrypt.gensalt(rounds=BCRYPT_ROUNDS)).decode("ascii")
+
+
+def verify_password(password: str, stored: str) -> bool:
+    """Check a password against a stored bcrypt hash (or a legacy plaintext one)"""
+    if not stored:
+        return False
+    if is_hashed(stored):
+        return bcrypt.checkpw(_encode(password), stored.encode("ascii"))
+    return hmac.compare_digest(password.encode("utf-8"), stored.encode("utf-8"))
+
+
+def needs_rehash(stored: str) -> bool:
+    """True for plaintext passwords and hashes made with a different cost"""
+    if not is_hashed(stored):
+        return True
+    return int(stored.split("$")[2]) != BCRYPT_ROUNDS
+
+
+async def hash_password_async(password: str) -> str:
+    """hash_password() on the hashing pool"""
+    return await asyncio.get_running_loop().run_in_executor(_hash_pool, hash_password, password)
+
+
+async def verify_password_async(password: str, stored: str) -> bool:
+    """verify_password() on the hashing pool"""
+    return await asyncio.get_running_loop().run_in_executor(_hash_pool, verify_password, password, stored)
+
+
+def normalize_email(email: str) -> str:
+    return email.strip().lower()
+
+
+def normalize_login(identifier: str):
+    """("email", normalized) or ("username", stripped) for a login name"""
+    identifier = identifier.strip()
+    if "@" in identifier:
+        return "email", normalize_email(identifier)
+    return "username", identifier
+
+
+# --- Session tokens ---
+AUTH_SECRET = os.getenv("AUTH_SECRET") or secrets.token_urlsafe(32)
+TOKEN_TTL_SECONDS = int(os.getenv("TOKEN_TTL_SECONDS", str(12 * 3600)))
+
+
+class InvalidToken(ValueError):
+    pass
+
+
+def _b64encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode("ascii")
+
+
+def _b64decode(text: str) -> bytes:
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+
+# Only tokens with exactly this header are accepted (no "alg" switching)
+_TOKEN_HEADER = _b64encode(b'{"alg":"HS256","typ":"JWT"}')
+
+
+def _sign(message: str) -> str:
+    return _b64encode(hmac.new(AUTH_SECRET.encode("utf-8"), message.encode("ascii"), hashlib.sha256).digest())
+
+
+def issue_token(user_id: int, username: str, ttl: int = None) -> str:
+    now = int(time.time())
+    claims = {"sub": str(user_id), "name": username, "iat": now, "exp": now + (ttl or TOKEN_TTL_SECONDS)}
+    message = _TOKEN_HEADER + "." + _b64encode(json.dumps(claims, separators=(",", ":")).encode("utf-8"))
+    return message + "." + _sign(message)
+
+
+def decode_token(token: str) -> dict:
+    """The claims of a valid, unexpired token; raises InvalidToken otherwise"""
+    # Tokens are base64url; anything else would fail encoding before the signature check
+    if not token.isascii():
+        raise InvalidToken("Malformed token")
+    parts = token.split(".")
+    if len(parts) != 3 or parts[0] != _TOKEN_HEADER:
+        raise InvalidToken("Malformed token")
+    header, payload, signature = parts
+    if not hmac.compare_digest(signature, _sign(header + "." + payload)):
+        raise InvalidToken("Invalid token signature")
+    try:
+        claims = json.loads(_b64decode(payload))
+        user_id, expires = int(claims["sub"]), claims["exp"]
+    except (ValueError, KeyError, TypeError):
+        raise InvalidToken("Malformed token")
+    if expires < time.time():
+        raise InvalidToken("Token expired")
+    claims["user_id"] = user_id
+    return claims
@@ -0,0 +1,174 @@
+"""
+Execute many orders in one request (POST /trades/batch).
+
+A batch may cover one user or many. A caller can only include orders for
+their own account unless their user id is in BATCH_OPERATOR_IDS, which
+lets them batch for every account.
+
+Orders run in sequence against an in-memory copy of the balances and
+positions involved (one query each), so every order sees the fills and
+market impact of the ones before it. A chunk of orders is then written
+as one UPDATE per user and per position plus a single multi-row INSERT
+of its transactions, and committed once.
+
+The writes are guarded like /trade: a balance must cover the lowest point
+it reaches during the chunk, and a position must hold the most shares the
+chunk sells ahead of its buys. That only stops a chunk from overdrawing
+either: if another request spent the money or sold the shares meanwhile
+the guard doesn't match and the caller rolls the chunk back, but a change
+that still leaves enough goes through. So the writes read the resulting
+balances and positions back (UPDATE ... RETURNING), and those, not the
+simulated ones, are what gets reported and published (apply_written).
+"""
+from collections import namedtuple
+
+from sqlalchemy import insert, update
+from sqlalchemy.orm import Session
+
+import models, positions
+
+Fill = namedtuple("Fill", "index user_id ticker quantity price type")
+
+# Rejection detail for a limit order whose fill price would be worse than its limit
+PAST_LIMIT = "Fill price would be past the limit price"
+
+
+class BatchState:
+    """Balances, positions and simulated price anchors for the orders in a batch"""
+
+    def __init__(self, balances: dict, holdings: dict, anchors: dict = None):
+        self.balances = balances   # {user_id: wallet_balance}
+        self.holdings = holdings   # {(user_id, ticker): [quantity, cost_basis, shares_bought]}
+        self.anchors = anchors or {}  # {ticker: anchor after the fills so far}
+
+    @classmethod
+    def load(cls, db: Session, user_ids, tickers):
+        """Bulk-load everything the orders touch"""
+        balances = dict(db.query(models.User.id, models.User.wallet_balance).filter(models.User.id.in_(user_ids)))
+        rows = db.execute(positions.holdings_query(user_ids, tickers, open_only=False))
+        holdings = {(uid, ticker): [qty, cost, shares] for uid, ticker, qty, cost, shares in rows}
+        return cls(balances, holdings)
+
+    def copy(self):
+        return BatchState(dict(self.balances), {key: list(row) for key, row in self.holdings.items()}, dict(self.anchors))
+
+
+def run_orders(state: BatchState, orders, simulate_impact, limits: dict = None, listed=None):
+    """Fill `orders` ([(index, TransactionCreate)]) in sequence, updating `state`.
+
+    simulate_impact(ticker, quantity, type, anchor) -> (price, anchor) prices
+    each fill on top of the previous one. `limits` ({index: price}) caps
+    what a BUY pays / floors what a SELL gets. With `listed` (a container of
+    tickers), orders for any other ticker are rejected. Returns (fills, results)
+    where results has one dict per order in schemas.BatchTradeResult's shape.
+    """
+    fills, results = [], []
+    for index, order in orders:
+        ticker = order.ticker.upper()
+        result = {"index": index, "user_id": order.user_id, "ticker": ticker, "quantity": order.quantity}
+        results.append(result)
+
+        if order.quantity == 0:
+            result.update(status="rejected", detail="Quantity cannot be zero")
+            continue
+        if listed is not None and ticker not in listed:
+            result.update(status="rejected", detail=f"Unknown ticker: {ticker}")
+            continue
+        if order.user_id not in state.balances:
+            result.update(status="rejected", detail="User not found")
+            continue
+
+        transaction_type = "BUY" if order.quantity > 0 else "SELL"
+        price, anchor = simulate_impact(ticker, abs(order.quantity), transaction_type, state.anchors.get(ticker))
+        total_cost = price * order.quantity
+        holding = state.holdings.get((order.user_id, ticker), [0, 0.0, 0])
+
+        limit = limits.get(index) if limits else None
+        if limit is not None and (price > limit if transaction_type == "BUY" else price < limit):
+            result.update(status="rejected", detail=PAST_LIMIT)
+            continue
+
+        if transaction_type == "BUY" and state.balances[order.user_id] < total_cost:
+            result.update(status="rejected", detail=f"Insufficient funds. Cost: ${total_cost:.2f}, Balance: ${state.balances[order.user_id]:.2f}")
+            continue
+        if transaction_type == "SELL" and holding[0] < -order.quantity:
+            result.update(status="rejected", detail=f"Insufficient shares. You own {holding[0]} shares of {ticker}, but attempting to sell {-order.quantity} shares")
+            continue
+
+        # Filled: this order's impact is what the next one on the ticker trades against
+        state.anchors[ticker] = anchor
+        state.balances[order.user_id] -= total_cost
+        holding[0] += order.quantity
+        if transaction_type == "BUY":
+            holding[1] += total_cost
+            holding[2] += order.quantity
+        state.holdings[(order.user_id, ticker)] = holding
+
+        fills.append(Fill(index, order.user_id, ticker, order.quantity, price, transaction_type))
+        result.update(status="filled", price=price, new_balance=round(state.balances[order.user_id], 2))
+    return fills, results
+
+
+def write_fills(db: Session, fills):
+    """Write a chunk of fills (caller commits).
+
+    Returns the balances and positions of the users and tickers involved as
+    written (a BatchState), or None if a guard didn't match.
+    """
+    # Net change and lowest running total, per balance and per position
+    balances = {}
+    holdings = {}
+    for fill in fills:
+        balance = balances.setdefault(fill.user_id, [0.0, 0.0])
+        balance[0] -= fill.price * fill.quantity
+        balance[1] = min(balance[1], balance[0])
+
+        holding = holdings.setdefault((fill.user_id, fill.ticker), [0, 0.0, 0, 0])
+        holding[0] += fill.quantity
+        if fill.type == "BUY":
+            holding[1] += fill.price * fill.quantity
+            holding[2] += fill.quantity
+        holding[3] = min(holding[3], holding[0])
+
+    written = BatchState({}, {})
+    for user_id, (amount, lowest) in balances.items():
+        row = db.execute(
+            update(models.User)
+            .where(models.User.id == user_id, models.User.wallet_balance >= -lowest)
+            .values(wallet_balance=models.User.wallet_balance + amount)
+            .returning(models.User.wallet_balance)
+            .execution_options(synchronize_session=False)
+        ).first()
+        if row is None:
+            return None
+        written.balances[user_id] = row[0]
+
+    for (user_id, ticker), (quantity, cost, shares_bought, lowest) in holdings.items():
+        row = positions.apply_delta(db, user_id, ticker, quantity, cost, shares_bought, min_quantity=-lowest)
+        if row is None:
+            return None
+        written.holdings[(user_id, ticker)] = list(row)
+
+    db.execute(insert(models.Transaction), [
+        {"user_id": fill.user_id, "ticker": fill.ticker, "quantity": fill.quantity,
+         "price_per_share": fill.price, "type": fill.type}
+        for fill in fills
+    ])
+    return written
+
+
+def apply_written(state: BatchState, written: BatchState, results):
+    """Replace the simulated balances and positions in `state` with the written ones.
+
+    A trade another request made for the same user meanwhile shifts every
+    balance the chunk went through by the same amount, so each filled
+    result's new_balance is shifted by it too.
+    """
+    for user_id, balance in written.balances.items():
+        drift = balance - state.balances[user_id]
+        state.balances[user_id] = balance
+        if drift:
+            for result in results:
+                if result["user_id"] == user_id and result["status"] == "filled":
+                    result["new_balance"] = round(result["new_balance"] + drift, 2)
+    state.holdings.update(written.holdings)
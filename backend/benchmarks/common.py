@@ -0,0 +1,98 @@
+"""
+Shared helpers for the benchmark scripts.
+
+Benchmarks run against a scratch SQLite file unless DATABASE_URL is set
+(e.g. to a local Postgres). Import this module before `main` so the app
+binds to the benchmark database instead of the configured one.
+"""
+import os
+import sys
+import tempfile
+import time
+import random
+from datetime import datetime, timedelta
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+os.environ.setdefault("DATABASE_URL", "sqlite:///" + os.path.join(tempfile.gettempdir(), "tradex_bench.db"))
+
+import numpy as np
+from sqlalchemy import event
+
+import database, models, positions
+
+
+def reset_database():
+    """Drop and recreate every table in the benchmark database"""
+    models.Base.metadata.drop_all(bind=database.engine)
+    models.Base.metadata.create_all(bind=database.engine)
+
+
+def seed_user(db, username: str, num_trades: int, tickers, seed: int = 0) -> int:
+    """Create a user with `num_trades` random BUY/SELL transactions. Returns the user id."""
+    rng = random.Random(seed)
+    user = models.User(username=username, email=f"{username}@bench.local", hashed_password="bench")
+    db.add(user)
+    db.flush()
+
+    held = {}
+    start = datetime.utcnow() - timedelta(days=365)
+    rows = []
+    for i in range(num_trades):
+        ticker = rng.choice(tickers)
+        quantity = rng.randint(1, 20)
+        # Sell part of the position every few trades so the log has both sides
+        if held.get(ticker, 0) >= quantity and rng.random() < 0.3:
+            quantity = -quantity
+        held[ticker] = held.get(ticker, 0) + quantity
+        rows.append({
+            "user_id": user.id,
+            "ticker": ticker,
+            "quantity": quantity,
+            "price_per_share": round(rng.uniform(50, 500), 2),
+            "type": "BUY" if quantity > 0 else "SELL",
+            "timestamp": start + timedelta(minutes=i),
+        })
+
+    db.bulk_insert_mappings(models.Transaction, rows)
+    db.commit()
+    positions.rebuild_positions(db, user.id)
+    return user.id
+
+
+class QueryCounter:
+    """Count SQL statements executed on `database.engine` while active"""
+
+    def __init__(self, engine=None):
+        self.engine = engine or database.engine
+        self.count = 0
+
+    def _on_execute(self, conn, cursor, statement, parameters, context, executemany):
+        self.count += 1
+
+    def __enter__(self):
+        event.listen(self.engine, "before_cursor_execute", self._on_execute)
+        return self
+
+    def __exit__(self, *exc):
+        event.remove(self.engine, "before_cursor_execute", self._on_execute)
+
+
+def timed(fn, *args, **kwargs):
+    """Run fn and return (result, elapsed milliseconds)"""
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, (time.perf_counter() - start) * 1000
+
+
+def latency_summary(samples_ms) -> dict:
+    """p50/p95/p99/mean of a list of latencies in milliseconds"""
+    samples = np.asarray(samples_ms, dtype=float)
+    return {
+        "p50_ms": round(float(np.percentile(samples, 50)), 3),
+        "p95_ms": round(float(np.percentile(samples, 95)), 3),
+        "p99_ms": round(float(np.percentile(samples, 99)), 3),
+        "mean_ms": round(float(samples.mean()), 3),
+        "samples": int(len(samples)),
+    }
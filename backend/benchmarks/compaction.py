@@ -0,0 +1,106 @@
+"""
+Cost of recomputing positions from the transaction log as history grows,
+with and without compaction (see compaction.py).
+
+    python benchmarks/compaction.py --years 1 2 4 --trades-per-month 20000 --users 500
+
+For each history length, seeds that many years of trades at a steady
+rate, then measures positions.aggregate_transactions (what
+`positions.py --verify/rebuild` run) for one user and for everyone.
+It does this on the full log, then again after compacting all but the
+last --keep-months months and archiving them. Prints p50/p99 per case as JSON.
+"""
+import argparse
+import json
+import random
+import tempfile
+from datetime import datetime, timedelta
+
+import common
+
+import numpy as np
+from sqlalchemy import insert
+
+import database, models, positions, compaction, main
+
+
+def seed(years: int, per_month: int, num_users: int, tickers, chunk: int = 50000):
+    """Users plus `years` of trades spread evenly up to now"""
+    rng = np.random.default_rng(0)
+    with database.engine.begin() as conn:
+        conn.execute(insert(models.User), [
+            {"id": i + 1, "username": f"bench_{i}", "email": f"bench_{i}@bench.local", "hashed_password": "bench"}
+            for i in range(num_users)
+        ])
+    total = years * 12 * per_month
+    span = years * 365 * 24 * 60
+    start = datetime.utcnow() - timedelta(minutes=span)
+    for offset in range(0, total, chunk):
+        count = min(chunk, total - offset)
+        users = rng.integers(1, num_users + 1, count)
+        picks = rng.integers(0, len(tickers), count)
+        quantity = rng.integers(1, 20, count)
+        prices = np.round(rng.uniform(50, 500, count), 2)
+        minutes = np.linspace(span * offset / total, span * (offset + count) / total, count, endpoint=False)
+        with database.engine.begin() as conn:
+            conn.execute(insert(models.Transaction), [
+                {"user_id": int(u), "ticker": tickers[t], "quantity": int(q), "price_per_share": float(p),
+                 "type": "BUY", "timestamp": start + timedelta(minutes=float(m))}
+                for u, t, q, p, m in zip(users, picks, quantity, prices, minutes)
+            ])
+
+
+def measure(num_users: int, samples: int) -> dict:
+    rng = random.Random(1)
+    db = database.SessionLocal()
+    try:
+        one = [common.timed(positions.aggregate_transactions, db, rng.randint(1, num_users))[1] for _ in range(samples)]
+        everyone = [common.timed(positions.aggregate_transactions, db)[1] for _ in range(max(3, samples // 20))]
+    finally:
+        db.close()
+    return {"one_user": common.latency_summary(one), "all_users": common.latency_summary(everyone)}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--years", type=int, nargs="+", default=[1, 2, 4], help="history lengths to compare")
+    parser.add_argument("--trades-per-month", type=int, default=20000)
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--keep-months", type=int, default=3, help="months left in the log after compaction")
+    parser.add_argument("--samples", type=int, default=100, help="one-user calls per case")
+    args = parser.parse_args()
+
+    tickers = main.instruments.tickers
+    results = []
+    for years in args.years:
+        common.reset_database()
+        seed(years, args.trades_per_month, args.users, tickers)
+        full = measure(args.users, args.samples)
+
+        db = database.SessionLocal()
+        try:
+            positions.rebuild_positions(db)
+            boundary = compaction.add_months(compaction.month_start(datetime.utcnow()), -args.keep_months)
+            folded = compaction.compact(db, boundary)
+            with tempfile.TemporaryDirectory() as directory:
+                archived = sum(count for _, count, _ in compaction.archive(db, directory))
+            mismatches = len(positions.verify_positions(db))
+        finally:
+            db.close()
+        results.append({
+            "years": years,
+            "trades": years * 12 * args.trades_per_month,
+            "full_log": full,
+            "compacted": measure(args.users, args.samples),
+            "folded": folded,
+            "archived": archived,
+            "verify_mismatches": mismatches,
+        })
+
+    print(json.dumps({
+        "benchmark": "compaction",
+        "database": database.engine.url.render_as_string(hide_password=True),
+        "users": args.users,
+        "keep_months": args.keep_months,
+        "results": results,
+    }, indent=2))
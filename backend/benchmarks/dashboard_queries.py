@@ -0,0 +1,139 @@
+"""
+Compare one Dashboard refresh done the old way (seven GETs) with the
+single /dashboard/{user_id} call.
+
+    python benchmarks/dashboard_queries.py --trades 5000 --rounds 20
+
+The old way is the read path as it was before /dashboard, the positions
+table and the response cache: every portfolio view rebuilt the holdings
+by scanning the user's whole transaction log. The app no longer has that
+code, so a frozen copy of its queries lives below (its made-up risk and
+day-change numbers left out, as they never touched the database).
+
+Prints a JSON report with SQL statements, requests and wall time per refresh.
+"""
+import argparse
+import json
+
+import common
+
+import database, main, models
+
+
+# --- The pre-/dashboard read path, frozen ---
+
+def legacy_holdings(db, user_id: int) -> dict:
+    """{ticker: [quantity, cost of buys, shares bought]} from a scan of the user's transactions"""
+    held = {}
+    for t in db.query(models.Transaction).filter(models.Transaction.user_id == user_id).all():
+        row = held.setdefault(t.ticker, [0, 0.0, 0])
+        row[0] += t.quantity
+        if t.type == "BUY" and t.quantity > 0:
+            row[1] += t.price_per_share * t.quantity
+            row[2] += t.quantity
+    return held
+
+
+def legacy_portfolio(db, user_id: int) -> list:
+    """GET /portfolio/{id}; risk metrics, allocation and sectors each started with the same call"""
+    items = []
+    for ticker, (quantity, cost, shares) in legacy_holdings(db, user_id).items():
+        if quantity > 0:
+            price = main.get_current_price(ticker)
+            average_cost = cost / shares if shares else price * 0.9
+            items.append({
+                "ticker": ticker, "company_name": main.instruments.name(ticker), "quantity": quantity,
+                "total_value": round(quantity * price, 2), "total_return": round(quantity * (price - average_cost), 2),
+            })
+    items.sort(key=lambda item: item["total_value"], reverse=True)
+    return items
+
+
+def legacy_summary(db, user_id: int) -> dict:
+    """GET /portfolio/{id}/summary: the user row, then its own scan of the log"""
+    user = db.query(models.User).filter(models.User.id == user_id).first()
+    held = legacy_holdings(db, user_id)
+    total_value = sum(quantity * main.get_current_price(ticker) for ticker, (quantity, _, _) in held.items() if quantity > 0)
+    return {"total_value": round(total_value, 2), "cash_available": round(user.wallet_balance, 2)}
+
+
+def legacy_history(db, user_id: int, limit: int) -> list:
+    return db.query(models.Transaction).filter(
+        models.Transaction.user_id == user_id
+    ).order_by(models.Transaction.timestamp.desc()).limit(limit).all()
+
+
+def legacy_market() -> list:
+    return [(ticker, main.get_current_price(ticker)) for ticker in main.instruments.tickers]
+
+
+def legacy_refresh(user_id: int):
+    """The seven requests Dashboard.jsx used to send, each with its own session"""
+    calls = [
+        lambda db: legacy_summary(db, user_id),
+        lambda db: legacy_portfolio(db, user_id),
+        lambda db: legacy_portfolio(db, user_id),   # risk metrics
+        lambda db: legacy_history(db, user_id, 5),
+        lambda db: legacy_portfolio(db, user_id),   # allocation
+        lambda db: legacy_portfolio(db, user_id),   # sectors
+        lambda db: legacy_market(),
+    ]
+    for call in calls:
+        db = database.SessionLocal()
+        try:
+            call(db)
+        finally:
+            db.close()
+    return len(calls)
+
+
+def dashboard_refresh(user_id: int):
+    db = database.SessionLocal()
+    try:
+        main.get_dashboard(user_id, db)
+    finally:
+        db.close()
+    return 1
+
+
+def measure(refresh, user_id: int, rounds: int):
+    with common.QueryCounter() as counter:
+        requests, elapsed = 0, 0.0
+        for _ in range(rounds):
+            # Every refresh goes to the database, not to the previous round's cached responses
+            main.response_cache.entries.clear()
+            count, ms = common.timed(refresh, user_id)
+            requests += count
+            elapsed += ms
+    return {
+        "requests_per_refresh": requests / rounds,
+        "queries_per_refresh": counter.count / rounds,
+        "ms_per_refresh": round(elapsed / rounds, 3),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--trades", type=int, default=2000, help="transactions to seed for the user")
+    parser.add_argument("--rounds", type=int, default=20, help="refreshes to average over")
+    args = parser.parse_args()
+
+    common.reset_database()
+    db = database.SessionLocal()
+    try:
+        user_id = common.seed_user(db, "bench_dashboard", args.trades, main.instruments.tickers)
+    finally:
+        db.close()
+
+    before = measure(legacy_refresh, user_id, args.rounds)
+    after = measure(dashboard_refresh, user_id, args.rounds)
+    print(json.dumps({
+        "benchmark": "dashboard_queries",
+        "database": database.engine.url.render_as_string(hide_password=True),
+        "trades": args.trades,
+        "rounds": args.rounds,
+        "legacy_fanout": before,
+        "dashboard_endpoint": after,
+        "query_reduction": round(before["queries_per_refresh"] / after["queries_per_refresh"], 2),
+        "speedup": round(before["ms_per_refresh"] / after["ms_per_refresh"], 2),
+    }, indent=2))
@@ -0,0 +1,228 @@
+"""
+Load test: drive the API with concurrent clients and report throughput,
+latency percentiles and SQL statements per request.
+
+    python benchmarks/load_test.py --users 50 --transactions 20000 --concurrency 16 --requests 1000
+    python benchmarks/load_test.py --scenarios trade dashboard --output results.json
+    python benchmarks/load_test.py --url http://127.0.0.1:8000 --concurrency 64
+
+Seeds N users and M transactions between them, then runs each scenario
+for `--requests` requests from `--concurrency` concurrent clients:
+
+    trade             POST /trade (random small buys and sells)
+    portfolio         GET /portfolio/{id}
+    summary           GET /portfolio/{id}/summary
+    market            GET /market/prices
+    dashboard         GET /dashboard/{id}
+    dashboard_fanout  the seven GETs the dashboard used to make, all at once
+
+By default requests go through the app in-process (ASGI, no server; sync
+routes still run on FastAPI's threadpool), which is also what lets it
+count SQL statements. With --url it drives a running server instead; point
+DATABASE_URL at that server's database so the seeded users exist there
+(queries per request are then not measured).
+
+Reads are served from the response cache after the first hit, as in
+production; run with RESPONSE_CACHE_TTL=0 to measure them uncached.
+
+Prints one JSON report (also written to --output) with the commit it ran
+on, so runs can be compared across commits.
+"""
+import argparse
+import asyncio
+import json
+import random
+import subprocess
+import time
+from collections import Counter
+
+import common
+
+import httpx
+
+import auth, database, main, models
+
+SCENARIOS = ["trade", "portfolio", "summary", "market", "dashboard", "dashboard_fanout"]
+
+
+def seed(num_users: int, num_transactions: int, rng_seed: int) -> list:
+    """Create the users and their trade history. Returns the user ids."""
+    common.reset_database()
+    tickers = main.instruments.tickers
+    per_user = max(1, num_transactions // num_users)
+    db = database.SessionLocal()
+    try:
+        user_ids = [common.seed_user(db, f"load_{i}", per_user, tickers, seed=rng_seed + i) for i in range(num_users)]
+        # Enough cash that trades measure the trade path, not insufficient-funds rejections
+        db.query(models.User).update({models.User.wallet_balance: 1e9})
+        db.commit()
+    finally:
+        db.close()
+    return user_ids
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=common.BACKEND_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Session:
+    """One simulated user: their id and auth header"""
+
+    def __init__(self, user_id: int, token: str):
+        self.user_id = user_id
+        self.headers = {"Authorization": f"Bearer {token}"}
+
+
+async def login_all(client: httpx.AsyncClient, user_ids: list) -> list:
+    """Log the seeded users in over HTTP (their password is "bench")"""
+    sessions = []
+    for i, user_id in enumerate(user_ids):
+        response = await client.post("/login", json={"username": f"load_{i}", "password": "bench"})
+        response.raise_for_status()
+        sessions.append(Session(user_id, response.json()["access_token"]))
+    return sessions
+
+
+def request_for(scenario: str, client: httpx.AsyncClient, session: Session, rng: random.Random):
+    """The request(s) one iteration of a scenario makes, as a list of awaitables"""
+    uid, headers = session.user_id, session.headers
+    if scenario == "trade":
+        quantity = rng.choice([1, 1, -1]) * rng.randint(1, 5)
+        return [client.post("/trade", headers=headers, json={
+            "user_id": uid, "ticker": rng.choice(main.instruments.tickers), "quantity": quantity
+        })]
+    if scenario == "portfolio":
+        return [client.get(f"/portfolio/{uid}", headers=headers)]
+    if scenario == "summary":
+        return [client.get(f"/portfolio/{uid}/summary", headers=headers)]
+    if scenario == "market":
+        return [client.get("/market/prices")]
+    if scenario == "dashboard":
+        return [client.get(f"/dashboard/{uid}?history_limit=5", headers=headers)]
+    if scenario == "dashboard_fanout":
+        return [client.get(path, headers=headers) for path in (
+            f"/portfolio/{uid}/summary", f"/portfolio/{uid}", f"/portfolio/{uid}/risk-metrics",
+            f"/trades/{uid}/history?limit=5", f"/portfolio/{uid}/allocation",
+            f"/portfolio/{uid}/sectors", "/market/prices",
+        )]
+    raise ValueError(f"Unknown scenario {scenario!r}")
+
+
+def outcome(scenario: str, status: int) -> str:
+    if status < 400:
+        return "ok"
+    # Insufficient funds/shares is a normal answer for a trade, not a failure
+    if scenario == "trade" and status == 400:
+        return "rejected"
+    return "errors"
+
+
+async def run_scenario(client, scenario: str, sessions: list, total: int, concurrency: int, rng_seed: int, count_queries: bool) -> dict:
+    rng = random.Random(rng_seed)
+    plan = [rng.choice(sessions) for _ in range(total)]
+    latencies, outcomes = [], Counter()
+    next_index = iter(range(total))
+
+    async def client_loop():
+        for i in next_index:
+            start = time.perf_counter()
+            try:
+                responses = await asyncio.gather(*request_for(scenario, client, plan[i], rng))
+                for response in responses:
+                    outcomes[outcome(scenario, response.status_code)] += 1
+            except httpx.HTTPError:
+                outcomes["errors"] += 1
+            latencies.append((time.perf_counter() - start) * 1000)
+
+    counters = [common.QueryCounter(engine) for engine in query_engines()] if count_queries else []
+    for counter in counters:
+        counter.__enter__()
+    try:
+        started = time.perf_counter()
+        await asyncio.gather(*[client_loop() for _ in range(concurrency)])
+        elapsed = time.perf_counter() - started
+    finally:
+        for counter in counters:
+            counter.__exit__(None, None, None)
+
+    requests = sum(outcomes.values())
+    report = {
+        "iterations": total,
+        "requests": requests,
+        "ok": outcomes["ok"],
+        "rejected": outcomes["rejected"],
+        "errors": outcomes["errors"],
+        "throughput_rps": round(requests / elapsed, 1),
+        "iterations_per_second": round(total / elapsed, 1),
+    }
+    report.update(common.latency_summary(latencies))
+    report["queries_per_request"] = round(sum(c.count for c in counters) / requests, 2) if counters and requests else None
+    return report
+
+
+def query_engines() -> list:
+    """Every engine a request can query through, read replicas included"""
+    engines = [database.engine] + list(database.read_engines)
+    if database.ASYNC_MODE:
+        engines.append(database.async_engine.sync_engine)
+        engines.extend(engine.sync_engine for engine in database.async_read_engines)
+    return engines
+
+
+async def main_async(args) -> dict:
+    user_ids = seed(args.users, args.transactions, args.seed)
+
+    if args.url:
+        transport, base_url = None, args.url
+    else:
+        transport, base_url = httpx.ASGITransport(app=main.app), "http://load-test"
+    limits = httpx.Limits(max_connections=args.concurrency * 7, max_keepalive_connections=args.concurrency * 7)
+    async with httpx.AsyncClient(transport=transport, base_url=base_url, limits=limits, timeout=60) as client:
+        if args.url:
+            sessions = await login_all(client, user_ids)
+        else:
+            # In-process: sign the tokens directly instead of paying for bcrypt on each seeded user
+            sessions = [Session(uid, auth.issue_token(uid, f"load_{i}")) for i, uid in enumerate(user_ids)]
+
+        scenarios = {}
+        for index, scenario in enumerate(args.scenarios):
+            scenarios[scenario] = await run_scenario(
+                client, scenario, sessions, args.requests, args.concurrency, args.seed + index, count_queries=not args.url
+            )
+
+    return {
+        "benchmark": "load_test",
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "target": args.url or "in-process",
+        "database": database.engine.url.render_as_string(hide_password=True),
+        "async_mode": database.ASYNC_MODE,
+        "users": args.users,
+        "transactions": args.transactions,
+        "concurrency": args.concurrency,
+        "scenarios": scenarios,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=50, help="users to seed")
+    parser.add_argument("--transactions", type=int, default=20000, help="transactions to seed, split across the users")
+    parser.add_argument("--concurrency", type=int, default=16, help="concurrent clients")
+    parser.add_argument("--requests", type=int, default=1000, help="iterations per scenario")
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=SCENARIOS)
+    parser.add_argument("--url", default=None, help="drive a running server instead of the app in-process")
+    parser.add_argument("--output", default=None, help="also write the JSON report to this file")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    report = asyncio.run(main_async(args))
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
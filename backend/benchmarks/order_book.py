@@ -0,0 +1,64 @@
+"""
+Cost of matching resting limit/stop orders on each price tick, by book size.
+
+    python benchmarks/order_book.py --sizes 1000 10000 100000 --ticks 500
+
+Fills the in-memory books with random orders around the current prices,
+then times OrderBooks.triggered() over a random walk of ticks. Orders that
+a tick crosses are put back at a fresh price so the book stays the same
+size. Prints p50/p99 tick time per size as JSON: with heaps it should grow
+with the orders crossed, not with the orders resting.
+"""
+import argparse
+import json
+import random
+
+import common
+
+from order_book import OrderBooks, RestingOrder
+
+TICKERS = ["AAPL", "MSFT", "NVDA", "GOOGL", "AMZN", "META", "TSLA", "JPM", "V", "MA"]
+
+
+def random_order(rng: random.Random, order_id: int, prices: dict) -> RestingOrder:
+    ticker = rng.choice(TICKERS)
+    # Mostly away from the market, so a tick crosses only a few
+    price = round(prices[ticker] * rng.uniform(0.8, 1.2), 2)
+    return RestingOrder(order_id, rng.randint(1, 1000), ticker, rng.choice([1, -1]) * rng.randint(1, 50),
+                        rng.choice(["LIMIT", "STOP"]), price)
+
+
+def measure(size: int, ticks: int, seed: int) -> dict:
+    rng = random.Random(seed)
+    prices = {ticker: rng.uniform(50, 500) for ticker in TICKERS}
+    books = OrderBooks()
+    next_id = 0
+    for _ in range(size):
+        next_id += 1
+        books.add(random_order(rng, next_id, prices))
+
+    samples, crossed = [], 0
+    for _ in range(ticks):
+        prices = {ticker: price * rng.uniform(0.995, 1.005) for ticker, price in prices.items()}
+        triggered, elapsed_ms = common.timed(books.triggered, prices)
+        samples.append(elapsed_ms)
+        crossed += len(triggered)
+        for _ in triggered:
+            next_id += 1
+            books.add(random_order(rng, next_id, prices))
+
+    return dict(common.latency_summary(samples), resting=len(books), crossed_per_tick=round(crossed / ticks, 1))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000], help="resting orders per run")
+    parser.add_argument("--ticks", type=int, default=500, help="ticks to time per run")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    print(json.dumps({
+        "benchmark": "order_book",
+        "ticks": args.ticks,
+        "results": {str(size): measure(size, args.ticks, args.seed) for size in args.sizes},
+    }, indent=2))
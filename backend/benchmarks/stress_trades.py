@@ -0,0 +1,118 @@
+"""
+Fire many concurrent /trade calls and check the books still balance.
+
+    python benchmarks/stress_trades.py --users 5 --trades 2000 --workers 32
+
+Each worker thread runs trade_stock with its own session, the same way
+FastAPI's threadpool does. Afterwards we assert that:
+
+  * no balance went negative (no double-spend)
+  * no position went negative (no oversell)
+  * every balance equals the starting cash minus the net cost of its trades
+  * the positions table matches the transaction log
+
+Exits non-zero if any invariant is violated, if a trade fails with anything
+but a 400 (insufficient funds or shares), or if no trade filled at all.
+"""
+import argparse
+import json
+import random
+from concurrent.futures import ThreadPoolExecutor
+
+import common
+
+from fastapi import HTTPException
+
+import database, models, positions, schemas, main
+
+STARTING_BALANCE = 10000.0
+
+
+def run_trade(user_id: int, ticker: str, quantity: int):
+    db = database.SessionLocal()
+    try:
+        main.trade_stock(schemas.TransactionCreate(user_id=user_id, ticker=ticker, quantity=quantity), db, caller_id=user_id)
+        return "filled"
+    except HTTPException as e:
+        # Insufficient funds/shares is the only refusal these orders should get
+        return "rejected" if e.status_code == 400 else f"error: HTTP {e.status_code}: {e.detail}"
+    except Exception as e:
+        return f"error: {type(e).__name__}: {e}"
+    finally:
+        db.close()
+
+
+def check_invariants(db):
+    violations = []
+
+    for user in db.query(models.User):
+        if user.wallet_balance < -0.01:
+            violations.append(f"user {user.id} balance is negative: {user.wallet_balance:.2f}")
+
+        spent = sum(t.quantity * t.price_per_share for t in user.transactions)
+        expected = STARTING_BALANCE - spent
+        if abs(user.wallet_balance - expected) > 0.01:
+            violations.append(f"user {user.id} balance {user.wallet_balance:.2f} != expected {expected:.2f}")
+
+    for position in db.query(models.Position).filter(models.Position.quantity < 0):
+        violations.append(f"user {position.user_id} holds {position.quantity} {position.ticker}")
+
+    for uid, ticker, have, want in positions.verify_positions(db):
+        violations.append(f"user {uid} {ticker} position {have} != transaction log {want}")
+
+    return violations
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=5)
+    parser.add_argument("--trades", type=int, default=2000)
+    parser.add_argument("--workers", type=int, default=32)
+    parser.add_argument("--tickers", type=int, default=3, help="fewer tickers means more contention")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    common.reset_database()
+    db = database.SessionLocal()
+    users = []
+    for i in range(args.users):
+        user = models.User(username=f"stress_{i}", email=f"stress_{i}@bench.local",
+                           hashed_password="bench", wallet_balance=STARTING_BALANCE)
+        db.add(user)
+        db.flush()
+        users.append(user.id)
+    db.commit()
+    db.close()
+
+    # Big orders against a small balance, and sells that often exceed holdings,
+    # so the funds and ownership checks are constantly racing each other
+    rng = random.Random(args.seed)
+    tickers = main.instruments.tickers[:args.tickers]
+    orders = [
+        (rng.choice(users), rng.choice(tickers), rng.choice([1, 1, -1]) * rng.randint(1, 15))
+        for _ in range(args.trades)
+    ]
+
+    with ThreadPoolExecutor(max_workers=args.workers) as pool:
+        outcomes, elapsed_ms = common.timed(lambda: list(pool.map(lambda o: run_trade(*o), orders)))
+
+    db = database.SessionLocal()
+    try:
+        violations = check_invariants(db)
+    finally:
+        db.close()
+
+    errors = [o for o in outcomes if o.startswith("error")]
+    print(json.dumps({
+        "benchmark": "stress_trades",
+        "database": database.engine.url.render_as_string(hide_password=True),
+        "workers": args.workers,
+        "orders": len(orders),
+        "filled": outcomes.count("filled"),
+        "rejected": outcomes.count("rejected"),
+        "errors": len(errors),
+        "sample_errors": sorted(set(errors))[:5],
+        "trades_per_second": round(len(orders) / (elapsed_ms / 1000), 1),
+        "violations": violations,
+    }, indent=2))
+    raise SystemExit(1 if violations or errors or not outcomes.count("filled") else 0)
@@ -0,0 +1,118 @@
+"""
+Latency of the transaction-log hot paths with and without the composite
+indexes from migrations/0002_transaction_indexes.py.
+
+    python benchmarks/transaction_indexes.py --transactions 2000000 --users 2000
+
+Seeds the log in bulk, drops the two indexes and measures each path for
+random users, then applies the migration through migrate.py and measures
+again. Prints p50/p99 per path as JSON.
+"""
+import argparse
+import json
+import random
+from datetime import datetime, timedelta
+
+import common
+
+import numpy as np
+from sqlalchemy import delete, func, insert, text
+
+import database, models, positions, migrate, main
+
+INDEXES = ["ix_transactions_user_ticker", "ix_transactions_user_timestamp"]
+
+
+def seed(num_transactions: int, num_users: int, tickers, chunk: int = 50000):
+    """Bulk-insert users and a random transaction log spread across them"""
+    rng = np.random.default_rng(0)
+    with database.engine.begin() as conn:
+        conn.execute(insert(models.User), [
+            {"id": i + 1, "username": f"bench_{i}", "email": f"bench_{i}@bench.local", "hashed_password": "bench"}
+            for i in range(num_users)
+        ])
+    start = datetime.utcnow() - timedelta(days=365)
+    for offset in range(0, num_transactions, chunk):
+        count = min(chunk, num_transactions - offset)
+        users = rng.integers(1, num_users + 1, count)
+        picks = rng.integers(0, len(tickers), count)
+        quantity = rng.integers(1, 20, count)
+        prices = np.round(rng.uniform(50, 500, count), 2)
+        minutes = rng.integers(0, 365 * 24 * 60, count)
+        with database.engine.begin() as conn:
+            conn.execute(insert(models.Transaction), [
+                {"user_id": int(u), "ticker": tickers[t], "quantity": int(q), "price_per_share": float(p),
+                 "type": "BUY", "timestamp": start + timedelta(minutes=int(m))}
+                for u, t, q, p, m in zip(users, picks, quantity, prices, minutes)
+            ])
+
+
+def hot_paths(tickers):
+    """name -> fn(db, user_id, rng) for every query that filters the log by user"""
+    return {
+        "GET /trades/{id}/history": lambda db, uid, rng: main.get_trade_history(uid, db, limit=20),
+        "GET /dashboard/{id}": lambda db, uid, rng: main.get_dashboard(uid, db),
+        "positions --verify --user": lambda db, uid, rng: positions.aggregate_transactions(db, uid),
+        "shares held (user, ticker)": lambda db, uid, rng: db.query(func.sum(models.Transaction.quantity)).filter(
+            models.Transaction.user_id == uid, models.Transaction.ticker == rng.choice(tickers)
+        ).scalar(),
+    }
+
+
+def measure(paths, num_users: int, samples: int):
+    rng = random.Random(1)
+    report = {}
+    db = database.SessionLocal()
+    try:
+        for name, fn in paths.items():
+            latencies = []
+            for _ in range(samples):
+                # Time the queries, not a response cached by an earlier sample or phase
+                main.response_cache.entries.clear()
+                _, ms = common.timed(fn, db, rng.randint(1, num_users), rng)
+                latencies.append(ms)
+            report[name] = common.latency_summary(latencies)
+    finally:
+        db.close()
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--transactions", type=int, default=2000000, help="rows to seed in the transaction log")
+    parser.add_argument("--users", type=int, default=2000, help="users to spread them across")
+    parser.add_argument("--samples", type=int, default=200, help="calls per path and phase")
+    args = parser.parse_args()
+
+    tickers = main.instruments.tickers
+    common.reset_database()
+    seed(args.transactions, args.users, tickers)
+    db = database.SessionLocal()
+    try:
+        positions.rebuild_positions(db)
+    finally:
+        db.close()
+
+    # Before: the table as it was, indexed on id only
+    with database.engine.begin() as conn:
+        for name in INDEXES:
+            conn.execute(text(f"DROP INDEX IF EXISTS {name}"))
+        migrate.schema_migrations.create(conn, checkfirst=True)
+        conn.execute(delete(migrate.schema_migrations).where(migrate.schema_migrations.c.version == "0002_transaction_indexes"))
+    paths = hot_paths(tickers)
+    before = measure(paths, args.users, args.samples)
+
+    # After: apply the migration the way a deployment would
+    applied = migrate.run(verbose=False)
+    after = measure(paths, args.users, args.samples)
+
+    print(json.dumps({
+        "benchmark": "transaction_indexes",
+        "database": database.engine.url.render_as_string(hide_password=True),
+        "transactions": args.transactions,
+        "users": args.users,
+        "migrations_applied": applied,
+        "before": before,
+        "after": after,
+        "p50_speedup": {name: round(before[name]["p50_ms"] / after[name]["p50_ms"], 1) for name in paths},
+    }, indent=2))
@@ -0,0 +1,123 @@
+"""
+In-process cache for read endpoints.
+
+Entries are keyed by version numbers rather than invalidated one by one:
+
+    market data   (name, market version)        -> changes every tick / trade
+    user data     (name, user_id, user version) -> changes on the user's trades
+
+`invalidate_user` just bumps the user's version, so every cached result
+for them becomes unreachable at once and ages out through LRU/TTL
+eviction. The TTL also bounds staleness when several workers serve the
+same user (a trade only bumps the version in the worker that ran it).
+
+Each entry stores a content hash used as its ETag, so a poll with a
+matching If-None-Match can be answered 304 without recomputing anything,
+and the ETag means the same thing on every worker.
+"""
+import hashlib
+import itertools
+import json
+import threading
+import time
+from collections import OrderedDict
+
+from fastapi.encoders import jsonable_encoder
+
+
+class TTLCache:
+    """LRU cache whose entries also expire `ttl` seconds after being stored"""
+
+    def __init__(self, maxsize: int = 10000, ttl: float = 30.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._data = OrderedDict()
+
+    def get(self, key):
+        """The cached value, or None if missing or expired"""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            value, expires = entry
+            if expires < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + self.ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+def etag_for(value) -> str:
+    """Weak ETag from the JSON form of a response body"""
+    body = json.dumps(jsonable_encoder(value), sort_keys=True, separators=(",", ":"))
+    return 'W/"' + hashlib.blake2b(body.encode(), digest_size=8).hexdigest() + '"'
+
+
+class ResponseCache:
+    """Versioned, TTL/LRU-bounded cache of endpoint results and their ETags"""
+
+    def __init__(self, maxsize: int = 10000, ttl: float = 30.0):
+        self.entries = TTLCache(maxsize, ttl)
+        self._versions = {}
+        self._counter = itertools.count(1)
+
+    def user_version(self, user_id: int) -> int:
+        return self._versions.get(user_id, 0)
+
+    def invalidate_user(self, user_id: int):
+        """Forget everything cached for a user (call after their trade commits)"""
+        # A global counter, so a version never repeats for a user
+        self._versions[user_id] = next(self._counter)
+
+    def user_key(self, name: str, user_id: int, *extra):
+        return (name, user_id, self.user_version(user_id)) + extra
+
+    def get(self, key):
+        """(value, etag) or None"""
+        return self.entries.get(key)
+
+    def set(self, key, value):
+        """Cache a value and return (value, etag)"""
+        entry = (value, etag_for(value))
+        self.entries.set(key, entry)
+        return entry
+
+    def get_or_compute(self, key, compute):
+        return self.get(key) or self.set(key, compute())
+
+    async def get_or_compute_async(self, key, compute):
+        """get_or_compute() for an async compute function"""
+        return self.get(key) or self.set(key, await compute())
+
+    def remember(self, key, compute):
+        """Cache a plain value without an ETag (e.g. the rows a response is built from)"""
+        value = self.entries.get(key)
+        if value is None:
+            value = compute()
+            if value is not None:
+                self.entries.set(key, value)
+        return value
+
+    async def remember_async(self, key, compute):
+        """remember() for an async compute function"""
+        value = self.entries.get(key)
+        if value is None:
+            value = await compute()
+            if value is not None:
+                self.entries.set(key, value)
+        return value
@@ -0,0 +1,262 @@
+"""
+Keeps the transaction log bounded: closed months are folded into
+per-user opening positions, then can be archived to compressed files
+and dropped from the database.
+
+    python compaction.py                   # compact every month older than COMPACT_KEEP_MONTHS (default 3)
+    python compaction.py --keep-months 12
+    python compaction.py --archive         # then move compacted months to ARCHIVE_DIR and drop them
+    python compaction.py --status          # show what is retained, change nothing
+
+On PostgreSQL `transactions` is partitioned by month on `timestamp`
+(migrations/0004_partition_transactions.py): queries with a time range
+only scan the months in it, and archiving a month drops its partition
+instead of deleting rows. Every run creates the partitions for the next
+PARTITION_MONTHS_AHEAD months (default 3); a DEFAULT partition catches
+trades past them until they exist. On SQLite, or a table that hasn't
+been migrated, the same months are timestamp ranges of the one table.
+
+Compacting moves the log's start to a month boundary: every trade before
+it is folded into `position_snapshots` (the previous snapshot plus the
+trades since, one row per user and ticker) and the boundary is recorded
+in `compaction_checkpoint`. positions.transaction_totals then reads the
+snapshot plus the retained months, so rebuilding or verifying positions
+costs the same after years of trading as after one quarter. Each
+snapshot row also keeps the net cash its trades took, so `equity.py`
+backfills can start from the checkpoint (cash and holdings as of then)
+instead of the first trade; they can no longer fill in points before it.
+
+Archive files are gzip NDJSON, one per month
+(transactions_YYYY_MM.ndjson.gz), with every column of every trade.
+Only compacted months are archived, and a month's file is complete on
+disk before the month is dropped. Trade history and export cover the
+months still in the database.
+"""
+import argparse
+import gzip
+import json
+import os
+import re
+from datetime import datetime
+
+from sqlalchemy import delete, func, insert, or_, select, text
+from sqlalchemy.orm import Session
+
+import models, database, positions
+
+KEEP_MONTHS = int(os.getenv("COMPACT_KEEP_MONTHS", "3"))
+MONTHS_AHEAD = int(os.getenv("PARTITION_MONTHS_AHEAD", "3"))
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "archive"))
+
+DEFAULT_PARTITION = "transactions_default"
+PARTITION_PATTERN = re.compile(r"^transactions_p(\d{4})_(\d{2})$")
+
+ARCHIVE_COLUMNS = (
+    models.Transaction.id, models.Transaction.user_id, models.Transaction.ticker, models.Transaction.quantity,
+    models.Transaction.price_per_share, models.Transaction.type, models.Transaction.timestamp
+)
+
+
+def month_start(moment: datetime) -> datetime:
+    return datetime(moment.year, moment.month, 1)
+
+
+def add_months(month: datetime, count: int) -> datetime:
+    index = month.year * 12 + month.month - 1 + count
+    return datetime(index // 12, index % 12 + 1, 1)
+
+
+def months_between(first: datetime, end: datetime):
+    """Month starts from first's month up to (not including) end"""
+    month = month_start(first)
+    while month < end:
+        yield month
+        month = add_months(month, 1)
+
+
+def partition_name(month: datetime) -> str:
+    return f"transactions_p{month:%Y_%m}"
+
+
+# --- Partitions (PostgreSQL) ---
+
+def is_partitioned(db) -> bool:
+    """Whether `transactions` is a partitioned table (only ever on PostgreSQL)"""
+    dialect = db.get_bind().dialect if isinstance(db, Session) else db.dialect
+    if dialect.name != "postgresql":
+        return False
+    return db.execute(text(
+        "SELECT 1 FROM pg_partitioned_table pt JOIN pg_class c ON c.oid = pt.partrelid WHERE c.relname = 'transactions'"
+    )).first() is not None
+
+
+def partition_months(db) -> list:
+    """Month starts of the existing monthly partitions, oldest first"""
+    names = db.execute(text(
+        "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+        "JOIN pg_class p ON p.oid = i.inhparent WHERE p.relname = 'transactions'"
+    )).scalars()
+    found = (PARTITION_PATTERN.match(name) for name in names)
+    return sorted(datetime(int(m.group(1)), int(m.group(2)), 1) for m in found if m)
+
+
+def ensure_partitions(db, first: datetime, last: datetime) -> list:
+    """Create the monthly partitions from `first` through `last` that don't exist yet. Returns their names.
+
+    Trades the DEFAULT partition caught for such a month are moved into the
+    new partition (PostgreSQL refuses to create it over them otherwise).
+    """
+    created = []
+    for month in months_between(first, add_months(month_start(last), 1)):
+        name = partition_name(month)
+        if db.execute(text("SELECT to_regclass(:name)"), {"name": name}).scalar() is not None:
+            continue
+        bounds = f"FROM ('{month:%Y-%m-%d}') TO ('{add_months(month, 1):%Y-%m-%d}')"
+        in_month = {"start": month, "end": add_months(month, 1)}
+        stray = db.execute(text(
+            f'SELECT 1 FROM {DEFAULT_PARTITION} WHERE "timestamp" >= :start AND "timestamp" < :end LIMIT 1'
+        ), in_month).first()
+        if stray is None:
+            db.execute(text(f"CREATE TABLE {name} PARTITION OF transactions FOR VALUES {bounds}"))
+        else:
+            db.execute(text(f"ALTER TABLE transactions DETACH PARTITION {DEFAULT_PARTITION}"))
+            db.execute(text(f"CREATE TABLE {name} PARTITION OF transactions FOR VALUES {bounds}"))
+            db.execute(text(
+                f'INSERT INTO transactions SELECT * FROM {DEFAULT_PARTITION} WHERE "timestamp" >= :start AND "timestamp" < :end'
+            ), in_month)
+            db.execute(text(f'DELETE FROM {DEFAULT_PARTITION} WHERE "timestamp" >= :start AND "timestamp" < :end'), in_month)
+            db.execute(text(f"ALTER TABLE transactions ATTACH PARTITION {DEFAULT_PARTITION} DEFAULT"))
+        created.append(name)
+    return created
+
+
+# --- Compaction ---
+
+def compact(db: Session, before: datetime) -> int:
+    """Fold every trade before `before` (a month start) into position_snapshots and start the log there.
+
+    Returns how many trades were folded (0 if the log already starts there or later).
+    """
+    since = positions.log_start(db)
+    if since is not None and before <= since:
+        return 0
+
+    in_period = or_(models.Transaction.timestamp < before, models.Transaction.timestamp.is_(None))
+    if since is not None:
+        in_period = in_period & (models.Transaction.timestamp >= since)
+    folded = db.query(func.count(models.Transaction.id)).filter(in_period).scalar()
+
+    # Previous snapshot + this period's trades, aggregated on the database side
+    totals = db.execute(positions.transaction_totals(since=since, before=before)).all()
+    net_costs = dict(((uid, ticker), cost) for uid, ticker, cost in db.query(
+        models.PositionSnapshot.user_id, models.PositionSnapshot.ticker, models.PositionSnapshot.net_cost
+    ))
+    for uid, ticker, cost in db.query(
+        models.Transaction.user_id, models.Transaction.ticker,
+        func.sum(models.Transaction.quantity * models.Transaction.price_per_share)
+    ).filter(in_period).group_by(models.Transaction.user_id, models.Transaction.ticker):
+        net_costs[(uid, ticker)] = net_costs.get((uid, ticker), 0.0) + float(cost or 0.0)
+
+    db.execute(delete(models.PositionSnapshot))
+    if totals:
+        db.execute(insert(models.PositionSnapshot), [
+            {"user_id": uid, "ticker": ticker, "quantity": int(qty or 0), "cost_basis": float(cost or 0.0),
+             "shares_bought": int(shares or 0), "net_cost": net_costs.get((uid, ticker), 0.0)}
+            for uid, ticker, qty, cost, shares in totals
+        ])
+    db.merge(models.CompactionCheckpoint(id=1, compacted_before=before))
+    db.commit()
+    return folded
+
+
+# --- Archiving ---
+
+def archive_month(db: Session, month: datetime, directory: str = ARCHIVE_DIR, partitioned: bool = False):
+    """Write one compacted month to a gzip NDJSON file, then drop it. Returns (trades, path or None)."""
+    end = add_months(month, 1)
+    in_month = (models.Transaction.timestamp >= month) & (models.Transaction.timestamp < end)
+    rows = db.execute(
+        select(*ARCHIVE_COLUMNS).where(in_month).order_by(models.Transaction.id).execution_options(yield_per=5000)
+    )
+
+    count, path = 0, os.path.join(directory, f"transactions_{month:%Y_%m}.ndjson.gz")
+    partial = path + ".partial"
+    with open(partial, "wb") as raw:
+        with gzip.GzipFile(fileobj=raw, mode="wb") as f:
+            for row in rows:
+                record = row._asdict()
+                record["timestamp"] = row.timestamp.isoformat()
+                f.write((json.dumps(record) + "\n").encode())
+                count += 1
+        raw.flush()
+        os.fsync(raw.fileno())
+    if count:
+        os.replace(partial, path)
+    else:
+        os.remove(partial)
+        path = None
+
+    if partitioned and db.execute(text("SELECT to_regclass(:name)"), {"name": partition_name(month)}).scalar():
+        db.execute(text(f"ALTER TABLE transactions DETACH PARTITION {partition_name(month)}"))
+        db.execute(text(f"DROP TABLE {partition_name(month)}"))
+    # Unpartitioned tables, and anything the DEFAULT partition caught for this month
+    db.execute(delete(models.Transaction).where(in_month).execution_options(synchronize_session=False))
+    db.commit()
+    return count, path
+
+
+def archive(db: Session, directory: str = ARCHIVE_DIR) -> list:
+    """Archive and drop every month before the compaction checkpoint. Returns [(month, trades, path)]."""
+    boundary = positions.log_start(db)
+    if boundary is None:
+        return []
+    partitioned = is_partitioned(db)
+
+    oldest = db.query(func.min(models.Transaction.timestamp)).filter(models.Transaction.timestamp < boundary).scalar()
+    candidates = [oldest] if oldest else []
+    if partitioned:
+        candidates += partition_months(db)[:1]
+    if not candidates:
+        return []
+
+    os.makedirs(directory, exist_ok=True)
+    return [(month,) + archive_month(db, month, directory, partitioned)
+            for month in months_between(min(candidates), boundary)]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compact and archive the transaction log")
+    parser.add_argument("--keep-months", type=int, default=KEEP_MONTHS, help="whole months to keep in the log besides the current one")
+    parser.add_argument("--archive", action="store_true", help="archive and drop compacted months")
+    parser.add_argument("--dir", default=ARCHIVE_DIR, help="archive directory (default ARCHIVE_DIR)")
+    parser.add_argument("--status", action="store_true", help="show the retained log, change nothing")
+    args = parser.parse_args()
+
+    db = database.SessionLocal()
+    try:
+        if args.status:
+            oldest = db.query(func.min(models.Transaction.timestamp)).scalar()
+            print(f"Log starts: {positions.log_start(db) or 'never compacted'}; oldest trade in the database: {oldest}")
+            print(f"{db.query(func.count(models.Transaction.id)).scalar()} trades, "
+                  f"{db.query(func.count(models.PositionSnapshot.id)).scalar()} snapshot rows")
+            if is_partitioned(db):
+                months = partition_months(db)
+                print(f"{len(months)} monthly partitions" + (f", {months[0]:%Y-%m} to {months[-1]:%Y-%m}" if months else ""))
+            raise SystemExit(0)
+
+        this_month = month_start(datetime.utcnow())
+        if is_partitioned(db):
+            created = ensure_partitions(db, this_month, add_months(this_month, MONTHS_AHEAD))
+            db.commit()
+            if created:
+                print(f"Created partitions: {', '.join(created)}")
+
+        boundary = add_months(this_month, -args.keep_months)
+        folded = compact(db, boundary)
+        print(f"Compacted {folded} trades; the log now starts at {positions.log_start(db) or boundary:%Y-%m-%d}.")
+
+        if args.archive:
+            for month, count, path in archive(db, args.dir):
+                print(f"{month:%Y-%m}: {count} trades" + (f" -> {path}" if path else ""))
+    finally:
+        db.close()
@@ -0,0 +1,282 @@
+"""
+Equity curve per user: periodic snapshots of cash plus marked holdings.
+
+While the server runs, `EquityRecorder` writes a snapshot for every user
+each EQUITY_SNAPSHOT_SECONDS, marked at the closes of the bar that just
+finished. That's one positions query and one multi-row INSERT for all
+users, so the curve grows incrementally instead of being rebuilt from
+the transaction log on every request.
+
+History from before the recorder ran can be backfilled by replaying
+the transaction log against the stored price bars. Once compaction.py
+has folded old months away, a backfill starts each user from their
+position snapshot and the cash recorded with it at the compaction
+checkpoint, so it can only fill in points from the checkpoint on:
+
+    python equity.py                  # backfill every user (hourly points)
+    python equity.py --interval 300   # finer points
+    python equity.py --user 7         # limit to one user
+
+Snapshots sit on a fixed grid (multiples of the interval), and existing
+ones are never overwritten, so backfills and several workers can all
+write without duplicating points.
+"""
+import argparse
+import itertools
+import math
+import time
+from datetime import timezone
+
+import numpy as np
+from sqlalchemy import func
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+import models, database, positions
+
+# Every account opens with this much cash (models.User.wallet_balance default)
+STARTING_BALANCE = 10000.0
+
+# Dialects that can skip existing snapshots in the INSERT itself
+_INSERTS = {"postgresql": postgresql.insert, "sqlite": sqlite.insert}
+
+
+def to_unix(dt) -> float:
+    """Datetime to Unix seconds (naive ones are UTC, which is how the models store times)"""
+    return dt.timestamp() if dt.tzinfo else dt.replace(tzinfo=timezone.utc).timestamp()
+
+
+def save_snapshots(db: Session, rows: list):
+    """Insert snapshot dicts, skipping (user_id, ts) pairs that already exist (commits)"""
+    if not rows:
+        return
+    insert = _INSERTS.get(db.get_bind().dialect.name)
+    try:
+        if insert is not None:
+            db.execute(insert(models.EquitySnapshot).on_conflict_do_nothing(index_elements=["user_id", "ts"]), rows)
+        else:
+            db.bulk_insert_mappings(models.EquitySnapshot, rows)
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+
+
+def snapshot_all(db: Session, ts: int, prices: dict) -> int:
+    """Write one snapshot per user at `ts`, marking holdings at `prices`. Returns rows written."""
+    users = db.query(models.User.id, models.User.wallet_balance).all()
+    if not users:
+        return 0
+    user_ids = np.array([uid for uid, _ in users])
+    cash = np.array([balance or 0.0 for _, balance in users], dtype=float)
+
+    holdings = [(uid, ticker, qty) for uid, ticker, qty, _, _ in db.execute(positions.holdings_query())]
+    value = np.zeros(len(users))
+    if holdings:
+        # Mark every holding at once and sum per user
+        row_of = {uid: i for i, uid in enumerate(user_ids.tolist())}
+        rows = np.array([row_of.get(uid, -1) for uid, _, _ in holdings])
+        marked = np.array([qty * prices.get(ticker, 0.0) for _, ticker, qty in holdings], dtype=float)
+        known = rows >= 0
+        value = np.bincount(rows[known], weights=marked[known], minlength=len(users))
+
+    equity = cash + value
+    save_snapshots(db, [
+        {"user_id": int(uid), "ts": int(ts), "cash": round(float(c), 2), "equity": round(float(e), 2)}
+        for uid, c, e in zip(user_ids, cash, equity)
+    ])
+    return len(users)
+
+
+class EquityRecorder:
+    """Snapshots every user once per `interval` seconds, driven by finished price bars"""
+
+    def __init__(self, interval: float = 300.0, session_factory=None):
+        self.interval = interval
+        self.session_factory = session_factory or database.SessionLocal
+        self._last_slot = None
+
+    def on_bar(self, bar, bar_seconds: float):
+        """Call with each finished bar (from a worker thread; it hits the database)"""
+        bar_end = to_unix(bar.bar_time) + bar_seconds
+        slot = int(bar_end // self.interval)
+        if slot == self._last_slot:
+            return
+        self._last_slot = slot
+
+        prices = dict(zip(bar.tickers, np.asarray(bar.close, dtype=float).tolist()))
+        db = self.session_factory()
+        try:
+            snapshot_all(db, slot * int(self.interval), prices)
+        finally:
+            db.close()
+
+
+def backfill(db: Session, user_id: int = None, interval: int = 3600, now: float = None) -> int:
+    """Rebuild snapshots from the transaction log and stored bars. Returns rows written.
+
+    Holdings at each grid point are cumulative sums over the user's trades
+    (found with searchsorted, not a replay loop), marked at the latest bar
+    close before the point, or at the last trade price if there's no bar.
+
+    If the log has been compacted, trades before the checkpoint aren't
+    replayed (some may be archived): users start there from their position
+    snapshot, and no points are written before it.
+    """
+    now = now or time.time()
+    since = positions.log_start(db)
+    query = db.query(
+        models.Transaction.user_id, models.Transaction.ticker, models.Transaction.quantity,
+        models.Transaction.price_per_share, models.Transaction.timestamp
+    ).order_by(models.Transaction.user_id, models.Transaction.timestamp, models.Transaction.id)
+    if user_id is not None:
+        query = query.filter(models.Transaction.user_id == user_id)
+    if since is not None:
+        query = query.filter(models.Transaction.timestamp >= since)
+    trades = query.all()
+    openings = opening_positions(db, user_id) if since is not None else {}
+    if not trades and not openings:
+        return 0
+
+    # Close series per ticker, for marking
+    closes = {}
+    for ticker, bar_time, close in db.query(models.PriceBar.ticker, models.PriceBar.bar_time, models.PriceBar.close).filter(
+        models.PriceBar.ticker.in_(sorted({t[1] for t in trades} | {
+            ticker for _, held in openings.values() for ticker, _, _ in held
+        }))
+    ).order_by(models.PriceBar.bar_time).yield_per(10000):
+        closes.setdefault(ticker, ([], []))
+        closes[ticker][0].append(to_unix(bar_time))
+        closes[ticker][1].append(close)
+    closes = {ticker: (np.array(times), np.array(values)) for ticker, (times, values) in closes.items()}
+
+    by_user = {uid: list(rows) for uid, rows in itertools.groupby(trades, key=lambda t: t[0])}
+    written = 0
+    for uid in sorted(set(by_user) | set(openings)):
+        written += _backfill_user(db, uid, by_user.get(uid, []), closes, interval, now, openings.get(uid), since)
+    return written
+
+
+def opening_positions(db: Session, user_id: int = None) -> dict:
+    """{user_id: (cash, [(ticker, quantity, average cost)])} at the compaction checkpoint, from position_snapshots"""
+    query = db.query(
+        models.PositionSnapshot.user_id, models.PositionSnapshot.ticker, models.PositionSnapshot.quantity,
+        models.PositionSnapshot.cost_basis, models.PositionSnapshot.shares_bought, models.PositionSnapshot.net_cost
+    )
+    if user_id is not None:
+        query = query.filter(models.PositionSnapshot.user_id == user_id)
+    openings = {}
+    for uid, ticker, quantity, cost_basis, shares_bought, net_cost in query:
+        cash, held = openings.setdefault(uid, [STARTING_BALANCE, []])
+        openings[uid][0] = cash - net_cost
+        held.append((ticker, quantity, cost_basis / shares_bought if shares_bought else 0.0))
+    return {uid: tuple(opening) for uid, opening in openings.items()}
+
+
+def _backfill_user(db: Session, user_id: int, trades: list, closes: dict, interval: int, now: float,
+                   opening=None, opened_at=None) -> int:
+    starting_cash = STARTING_BALANCE
+    if opening is not None:
+        # The snapshot's holdings enter as trades at the checkpoint, at their average
+        # cost (the fallback mark), with the cash set to what it was there
+        cash, held = opening
+        trades = [(user_id, ticker, quantity, mark, opened_at) for ticker, quantity, mark in held] + trades
+        starting_cash = cash + sum(quantity * mark for _, quantity, mark in held)
+
+    tickers = np.array([t[1] for t in trades])
+    quantity = np.array([t[2] for t in trades], dtype=float)
+    price = np.array([t[3] for t in trades], dtype=float)
+    times = np.array([to_unix(t[4]) for t in trades])
+
+    grid = np.arange(math.ceil(times[0] / interval) * interval, now, interval, dtype=np.int64)
+    if not len(grid):
+        return 0
+    # How many trades happened at or before each grid point
+    done = np.searchsorted(times, grid, side="right")
+
+    cash = starting_cash - np.concatenate([[0.0], np.cumsum(quantity * price)])[done]
+    value = np.zeros(len(grid))
+    for ticker in np.unique(tickers):
+        mask = tickers == ticker
+        held = np.concatenate([[0.0], np.cumsum(np.where(mask, quantity, 0.0))])[done]
+
+        # Fallback mark: the user's own last trade price in this ticker
+        trade_times, trade_prices = times[mask], price[mask]
+        last_trade = np.searchsorted(trade_times, grid, side="right") - 1
+        mark = np.where(last_trade >= 0, trade_prices[np.maximum(last_trade, 0)], 0.0)
+
+        if ticker in closes:
+            bar_times, bar_closes = closes[ticker]
+            last_bar = np.searchsorted(bar_times, grid, side="right") - 1
+            mark = np.where(last_bar >= 0, bar_closes[np.maximum(last_bar, 0)], mark)
+        value += held * mark
+
+    equity = cash + value
+    save_snapshots(db, [
+        {"user_id": user_id, "ts": int(ts), "cash": round(float(c), 2), "equity": round(float(e), 2)}
+        for ts, c, e in zip(grid, cash, equity)
+    ])
+    return len(grid)
+
+
+def lttb(x: np.ndarray, y: np.ndarray, threshold: int) -> np.ndarray:
+    """Largest-Triangle-Three-Buckets: indices of `threshold` points that keep the curve's shape"""
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+
+    every = (n - 2) / (threshold - 2)
+    selected = np.empty(threshold, dtype=np.int64)
+    selected[0], selected[-1] = 0, n - 1
+    a = 0
+    for i in range(threshold - 2):
+        start, end = int(i * every) + 1, int((i + 1) * every) + 1
+        next_end = min(int((i + 2) * every) + 1, n)
+        avg_x, avg_y = x[end:next_end].mean(), y[end:next_end].mean()
+        # Keep the point forming the largest triangle with the last kept point and the next bucket's average
+        area = np.abs((x[a] - avg_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (avg_y - y[a]))
+        a = start + int(area.argmax())
+        selected[i + 1] = a
+    return selected
+
+
+def load_curve(db: Session, user_id: int, start_ts: int, end_ts: int, points: int, method: str = "lttb"):
+    """(ts, equity) arrays for a time range, downsampled to about `points` points.
+
+    "bucket" averages fixed-width time buckets in SQL, so only the
+    buckets come back; "lttb" reads the range and keeps the points that
+    preserve peaks and troughs.
+    """
+    snapshot = models.EquitySnapshot
+    in_range = (snapshot.user_id == user_id, snapshot.ts >= start_ts, snapshot.ts <= end_ts)
+    if method == "bucket":
+        # Size buckets to the data actually in range, not the requested bounds
+        first, last = db.query(func.min(snapshot.ts), func.max(snapshot.ts)).filter(*in_range).one()
+        if first is None:
+            return np.zeros(0, dtype=np.int64), np.zeros(0)
+        start_ts = first
+        width = max(1, math.ceil((last - first + 1) / points))
+        bucket = (snapshot.ts - start_ts) // width
+        rows = db.query(func.min(snapshot.ts), func.avg(snapshot.equity)).filter(*in_range).group_by(bucket).order_by(bucket).all()
+        return np.array([r[0] for r in rows], dtype=np.int64), np.array([r[1] for r in rows], dtype=float)
+
+    rows = db.query(snapshot.ts, snapshot.equity).filter(*in_range).order_by(snapshot.ts).all()
+    ts = np.array([r[0] for r in rows], dtype=np.int64)
+    equity = np.array([r[1] for r in rows], dtype=float)
+    keep = lttb(ts.astype(float), equity, points)
+    return ts[keep], equity[keep]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Backfill equity snapshots from the transaction log")
+    parser.add_argument("--user", type=int, default=None, help="limit to one user id")
+    parser.add_argument("--interval", type=int, default=3600, help="seconds between points (default 3600)")
+    args = parser.parse_args()
+
+    models.Base.metadata.create_all(bind=database.engine)
+    db = database.SessionLocal()
+    try:
+        count = backfill(db, args.user, args.interval)
+        print(f"Backfilled {count} equity snapshots.")
+    finally:
+        db.close()
@@ -0,0 +1,152 @@
+"""
+The tradable instruments, loaded once at startup from a data file.
+
+INSTRUMENTS_FILE (default data/instruments.csv) has one row per ticker:
+
+    ticker,name,sector,low,high
+
+`low`/`high` is the range the ticker's price starts in; the base price is
+its midpoint. A .parquet file with the same columns works too if pyarrow
+is installed.
+
+Each ticker gets a compact integer id (its row), and every attribute is a
+column indexed by it: names and sectors as lists, the base price and
+bounds as NumPy arrays, the sector as an integer code. A lookup is one
+dict hit plus an index, and sector totals are a bincount over codes, so
+neither depends on how many instruments are listed.
+
+Generate a larger universe for load testing (the listed companies first,
+then synthetic tickers):
+
+    python instruments.py --generate 5000 --output data/instruments_5000.csv
+"""
+import argparse
+import csv
+import os
+import random
+
+import numpy as np
+
+INSTRUMENTS_FILE = os.getenv(
+    "INSTRUMENTS_FILE", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "instruments.csv")
+)
+
+COLUMNS = ("ticker", "name", "sector", "low", "high")
+
+
+class UnknownTicker(KeyError):
+    def __init__(self, ticker: str):
+        super().__init__(ticker)
+        self.ticker = ticker
+
+    def __str__(self):
+        return f"Unknown ticker: {self.ticker}"
+
+
+def _read_rows(path: str) -> list:
+    if path.endswith(".parquet"):
+        try:
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise RuntimeError("Reading a .parquet instruments file needs pyarrow (pip install pyarrow)")
+        table = pq.read_table(path, columns=list(COLUMNS)).to_pydict()
+        return [dict(zip(COLUMNS, values)) for values in zip(*(table[column] for column in COLUMNS))]
+    with open(path, newline="", encoding="utf-8") as f:
+        return list(csv.DictReader(f))
+
+
+class InstrumentRegistry:
+    """Ticker metadata in columns indexed by instrument id"""
+
+    def __init__(self, tickers, names, sectors, low, high):
+        self.tickers = list(tickers)
+        self.index = {ticker: i for i, ticker in enumerate(self.tickers)}
+        if len(self.index) != len(self.tickers):
+            raise ValueError("Duplicate ticker in the instrument list")
+        self.names = list(names)
+        self.low = np.asarray(low, dtype=float)
+        self.high = np.asarray(high, dtype=float)
+        self.base = (self.low + self.high) / 2
+        # Sectors as small integer codes, for bincount
+        self.sectors = sorted(set(sectors))
+        codes = {sector: i for i, sector in enumerate(self.sectors)}
+        self.sector_codes = np.array([codes[sector] for sector in sectors], dtype=np.int32)
+
+    @classmethod
+    def load(cls, path: str = INSTRUMENTS_FILE):
+        rows = _read_rows(path)
+        return cls(
+            [row["ticker"].strip().upper() for row in rows],
+            [row["name"] for row in rows],
+            [row["sector"] or "Other" for row in rows],
+            [float(row["low"]) for row in rows],
+            [float(row["high"]) for row in rows],
+        )
+
+    def __len__(self):
+        return len(self.tickers)
+
+    def __contains__(self, ticker: str):
+        return ticker in self.index
+
+    def id(self, ticker: str) -> int:
+        """The instrument id for a ticker; raises UnknownTicker if it isn't listed"""
+        try:
+            return self.index[ticker]
+        except KeyError:
+            raise UnknownTicker(ticker) from None
+
+    def name(self, ticker: str) -> str:
+        # Positions from before a ticker was delisted still display
+        instrument_id = self.index.get(ticker)
+        return self.names[instrument_id] if instrument_id is not None else ticker
+
+    def sector(self, ticker: str) -> str:
+        instrument_id = self.index.get(ticker)
+        return self.sectors[self.sector_codes[instrument_id]] if instrument_id is not None else "Other"
+
+    def price_ranges(self) -> dict:
+        """{ticker: (low, high)} for the price engine"""
+        return dict(zip(self.tickers, zip(self.low.tolist(), self.high.tolist())))
+
+    def sector_totals(self, tickers, values):
+        """(sector names, holdings per sector, value per sector) for the given tickers and values"""
+        ids = [self.index.get(ticker) for ticker in tickers]
+        other = len(self.sectors)   # unlisted tickers are grouped as "Other"
+        codes = np.array([self.sector_codes[i] if i is not None else other for i in ids], dtype=np.int64)
+        counts = np.bincount(codes, minlength=other + 1)
+        totals = np.bincount(codes, weights=np.asarray(values, dtype=float), minlength=other + 1)
+        present = np.flatnonzero(counts)
+        names = self.sectors + ["Other"]
+        return [names[i] for i in present], counts[present].tolist(), totals[present].tolist()
+
+
+def generate(base_path: str, count: int, seed: int = 0) -> list:
+    """The listed instruments plus synthetic ones up to `count` rows"""
+    rows = _read_rows(base_path)
+    sectors = sorted({row["sector"] for row in rows})
+    rng = random.Random(seed)
+    for i in range(len(rows), count):
+        low = round(rng.uniform(5, 900), 2)
+        rows.append({"ticker": f"SYN{i:05d}", "name": f"Synthetic Instrument {i}", "sector": rng.choice(sectors),
+                     "low": low, "high": round(low * rng.uniform(1.1, 1.4), 2)})
+    return rows[:count]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Inspect or generate an instruments file")
+    parser.add_argument("--generate", type=int, default=None, help="write a universe of this many instruments")
+    parser.add_argument("--output", default=None, help="file to write with --generate")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.generate:
+        if not args.output:
+            parser.error("--generate needs --output")
+        with open(args.output, "w", newline="", encoding="utf-8") as f:
+            writer = csv.DictWriter(f, fieldnames=COLUMNS)
+            writer.writeheader()
+            writer.writerows(generate(INSTRUMENTS_FILE, args.generate, args.seed))
+    else:
+        registry = InstrumentRegistry.load()
+        print(f"{len(registry)} instruments in {len(registry.sectors)} sectors from {INSTRUMENTS_FILE}")
@@ -0,0 +1,402 @@
+"""
+Write-behind trade journal (TRADE_JOURNAL=1).
+
+Normally every /trade commits its own database transaction before it
+answers. In journal mode a trade is instead checked against an in-memory
+ledger of balances and positions, appended to a local append-only
+journal and acknowledged as soon as that append is on disk:
+
+    check against the ledger -> append -> fsync (group commit) -> respond
+                                   background flush -> transactions / users / positions
+
+Group commit: one writer thread takes everything appended since its last
+write, writes it in one go and fsyncs once, so concurrent trades share a
+single fsync instead of paying for one each. A flusher thread writes the
+durable entries to the database every JOURNAL_FLUSH_SECONDS in one
+transaction (one multi-row INSERT, one UPDATE per user and per position)
+together with the sequence number of the last entry it covers
+(journal_checkpoint). Segments whose entries are all in the database are
+deleted.
+
+On startup `recover()` flushes every journaled entry past the checkpoint
+before a trade is accepted, so each entry reaches the database exactly
+once whether the process stopped before or after flushing it. A torn
+last line (the process died mid-write, so that trade was never
+acknowledged) is ignored.
+
+The ledger is authoritative for the users it has loaded, so journal mode
+needs a single process doing the trading (one uvicorn worker). Reads come
+from the database and trail trades by up to one flush interval.
+
+    python journal.py             # show what is waiting to be flushed
+    python journal.py --recover   # flush it now, with the server stopped (startup does the same)
+"""
+import argparse
+import glob
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+
+from sqlalchemy import insert, update
+from sqlalchemy.orm import Session
+
+import models, database, positions, batch_trades
+
+logger = logging.getLogger(__name__)
+
+ENABLED = os.getenv("TRADE_JOURNAL", "0") == "1"
+JOURNAL_DIR = os.getenv("JOURNAL_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "journal"))
+FLUSH_SECONDS = float(os.getenv("JOURNAL_FLUSH_SECONDS", "0.5"))
+SEGMENT_BYTES = int(os.getenv("JOURNAL_SEGMENT_BYTES", str(16 * 1024 * 1024)))
+
+# Entries per database transaction when recovering a long journal
+RECOVER_CHUNK = 5000
+
+
+class JournalError(RuntimeError):
+    """A journal write failed: the trades in it were not accepted"""
+
+
+class Ledger:
+    """Balances and positions of the users trading through the journal, ahead of the database"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.state = batch_trades.BatchState({}, {})
+
+    def ensure_loaded(self, db: Session, user_ids):
+        """Load users the ledger hasn't seen yet (all their positions) from the database"""
+        with self.lock:
+            missing = [uid for uid in user_ids if uid not in self.state.balances]
+        if not missing:
+            return
+        balances = dict(db.query(models.User.id, models.User.wallet_balance).filter(models.User.id.in_(missing)))
+        if not balances:
+            return
+        rows = db.execute(positions.holdings_query(list(balances), open_only=False)).all()
+        with self.lock:
+            # Another request may have loaded (and traded) them meanwhile
+            fresh = {uid for uid in balances if uid not in self.state.balances}
+            for uid in fresh:
+                self.state.balances[uid] = balances[uid]
+            for uid, ticker, quantity, cost, shares in rows:
+                if uid in fresh:
+                    self.state.holdings[(uid, ticker)] = [quantity, cost, shares]
+
+    def snapshot(self, user_ids, tickers) -> batch_trades.BatchState:
+        """A copy of the loaded users' balances and their positions in `tickers`, for run_orders"""
+        with self.lock:
+            balances = {uid: self.state.balances[uid] for uid in user_ids if uid in self.state.balances}
+            holdings = {
+                (uid, ticker): list(self.state.holdings[(uid, ticker)])
+                for uid in balances for ticker in tickers if (uid, ticker) in self.state.holdings
+            }
+        return batch_trades.BatchState(balances, holdings)
+
+    def apply(self, fills):
+        """Apply fills if no balance or position goes negative along the way (caller holds the lock).
+
+        Returns the resulting balances and positions of the users and tickers
+        involved (a BatchState), or None if they can't cover the fills.
+        """
+        balances, holdings = {}, {}
+        for fill in fills:
+            if fill.user_id not in balances:
+                if fill.user_id not in self.state.balances:
+                    return False
+                balances[fill.user_id] = self.state.balances[fill.user_id]
+            key = (fill.user_id, fill.ticker)
+            if key not in holdings:
+                holdings[key] = list(self.state.holdings.get(key, [0, 0.0, 0]))
+
+            balances[fill.user_id] -= fill.price * fill.quantity
+            holding = holdings[key]
+            holding[0] += fill.quantity
+            if fill.type == "BUY":
+                holding[1] += fill.price * fill.quantity
+                holding[2] += fill.quantity
+            if balances[fill.user_id] < 0 or holding[0] < 0:
+                return None
+
+        self.state.balances.update(balances)
+        self.state.holdings.update(holdings)
+        return batch_trades.BatchState(dict(balances), {key: list(row) for key, row in holdings.items()})
+
+    def revert(self, entries):
+        """Undo journal entries that never made it to disk"""
+        with self.lock:
+            for entry in entries:
+                amount = entry["price"] * entry["quantity"]
+                self.state.balances[entry["user_id"]] += amount
+                holding = self.state.holdings[(entry["user_id"], entry["ticker"])]
+                holding[0] -= entry["quantity"]
+                if entry["type"] == "BUY":
+                    holding[1] -= amount
+                    holding[2] -= entry["quantity"]
+
+
+class Commit:
+    """One group commit: every append since the writer's last write waits on it"""
+
+    def __init__(self):
+        self._done = threading.Event()
+        self.error = None
+
+    def finish(self, error: Exception = None):
+        self.error = error
+        self._done.set()
+
+    def wait(self):
+        """Block until the entries are on disk; raises JournalError if the write failed"""
+        self._done.wait()
+        if self.error is not None:
+            raise JournalError(f"Trade journal write failed: {self.error}")
+
+
+def entry_for(seq: int, fill: batch_trades.Fill, ts: float) -> dict:
+    return {"seq": seq, "user_id": fill.user_id, "ticker": fill.ticker, "quantity": fill.quantity,
+            "price": fill.price, "type": fill.type, "ts": ts}
+
+
+def write_entries(db: Session, entries):
+    """Write journal entries to the database with the checkpoint after them, in one transaction.
+
+    Unlike batch_trades.write_fills nothing is guarded: the ledger already
+    checked these trades and they have been acknowledged.
+    """
+    balances, holdings = {}, {}
+    for entry in entries:
+        amount = entry["price"] * entry["quantity"]
+        balances[entry["user_id"]] = balances.get(entry["user_id"], 0.0) - amount
+        holding = holdings.setdefault((entry["user_id"], entry["ticker"]), [0, 0.0, 0])
+        holding[0] += entry["quantity"]
+        if entry["type"] == "BUY":
+            holding[1] += amount
+            holding[2] += entry["quantity"]
+
+    for user_id, amount in balances.items():
+        db.execute(
+            update(models.User).where(models.User.id == user_id)
+            .values(wallet_balance=models.User.wallet_balance + amount)
+            .execution_options(synchronize_session=False)
+        )
+    for (user_id, ticker), (quantity, cost, shares_bought) in holdings.items():
+        positions.apply_delta(db, user_id, ticker, quantity, cost, shares_bought)
+
+    db.execute(insert(models.Transaction), [
+        {"user_id": entry["user_id"], "ticker": entry["ticker"], "quantity": entry["quantity"],
+         "price_per_share": entry["price"], "type": entry["type"], "timestamp": datetime.utcfromtimestamp(entry["ts"])}
+        for entry in entries
+    ])
+    db.merge(models.JournalCheckpoint(id=1, last_seq=entries[-1]["seq"]))
+    db.commit()
+
+
+def read_checkpoint(db: Session) -> int:
+    checkpoint = db.get(models.JournalCheckpoint, 1)
+    return checkpoint.last_seq if checkpoint else 0
+
+
+def segment_paths(directory: str) -> list:
+    # Named by their first sequence number, zero-padded, so names sort in order
+    return sorted(glob.glob(os.path.join(directory, "journal-*.log")))
+
+
+def read_segment(path: str):
+    """Yield a segment's entries, stopping at a torn or corrupt line"""
+    with open(path, "rb") as f:
+        for line in f:
+            if not line.endswith(b"\n"):
+                return
+            try:
+                yield json.loads(line)
+            except ValueError:
+                logger.warning("Ignoring corrupt trade journal line in %s", path)
+                return
+
+
+class TradeJournal:
+    """The ledger, the journal file and the writer/flusher threads behind journal mode"""
+
+    def __init__(self, directory: str = JOURNAL_DIR, flush_seconds: float = FLUSH_SECONDS,
+                 segment_bytes: int = SEGMENT_BYTES, on_flush=None, session_factory=database.SessionLocal):
+        self.directory = directory
+        self.flush_seconds = flush_seconds
+        self.segment_bytes = segment_bytes
+        self.on_flush = on_flush   # called with the user ids each flush wrote
+        self.session_factory = session_factory
+        self.ledger = Ledger()
+
+        self._cond = threading.Condition()
+        self._pending = []         # appended, not yet written
+        self._commit = Commit()    # what the pending entries wait on
+        self._durable = []         # on disk, not yet in the database
+        self._next_seq = 1
+        self._file = None
+        self._path = None
+        self._segments = []        # [(path, last seq)] of closed segments
+        self._flush_lock = threading.Lock()
+        self._stopping = False
+        self._stopped = threading.Event()
+        self._threads = []
+
+    def unflushed(self) -> int:
+        """Entries accepted but not yet in the database"""
+        with self._cond:
+            return len(self._pending) + len(self._durable)
+
+    def recover(self) -> int:
+        """Flush whatever the journal holds past the database checkpoint. Returns the entries flushed."""
+        os.makedirs(self.directory, exist_ok=True)
+        with self.session_factory() as db:
+            last_seq = read_checkpoint(db)
+            paths = segment_paths(self.directory)
+            entries, max_seq = [], last_seq
+            for path in paths:
+                for entry in read_segment(path):
+                    max_seq = max(max_seq, entry["seq"])
+                    if entry["seq"] > last_seq:
+                        entries.append(entry)
+            for start in range(0, len(entries), RECOVER_CHUNK):
+                write_entries(db, entries[start:start + RECOVER_CHUNK])
+
+        for path in paths:
+            os.remove(path)
+        self._next_seq = max_seq + 1
+        if entries:
+            logger.info("Recovered %d trade journal entries", len(entries))
+        return len(entries)
+
+    def start(self):
+        """Open a fresh segment and start the writer and flusher (after recover())"""
+        self._open_segment(self._next_seq)
+        for target, name in ((self._write_loop, "journal-writer"), (self._flush_loop, "journal-flusher")):
+            thread = threading.Thread(target=target, name=name, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        """Write and flush everything accepted so far, then stop the threads"""
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        self._stopped.set()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+        self.flush()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def append(self, fills):
+        """Apply fills to the ledger and queue them for the journal.
+
+        Returns (the Commit to wait on before acknowledging them, the
+        balances and positions they left in the ledger), or None if the
+        ledger can't cover them (a balance or position changed since the
+        caller's snapshot).
+        """
+        with self.ledger.lock:
+            written = self.ledger.apply(fills)
+            if written is None:
+                return None
+            # Under the ledger lock, so journal order is the order the ledger saw
+            with self._cond:
+                ts = time.time()
+                for fill in fills:
+                    self._pending.append(entry_for(self._next_seq, fill, ts))
+                    self._next_seq += 1
+                self._cond.notify()
+                return self._commit, written
+
+    def flush(self) -> int:
+        """Write the durable entries to the database now. Returns how many."""
+        with self._flush_lock:
+            with self._cond:
+                entries, self._durable = self._durable, []
+            if not entries:
+                return 0
+            try:
+                with self.session_factory() as db:
+                    write_entries(db, entries)
+            except Exception:
+                logger.exception("Trade journal flush failed, retrying next interval")
+                with self._cond:
+                    self._durable[:0] = entries
+                return 0
+
+            self._drop_segments(entries[-1]["seq"])
+            if self.on_flush is not None:
+                self.on_flush({entry["user_id"] for entry in entries})
+            return len(entries)
+
+    def _open_segment(self, first_seq: int):
+        path = os.path.join(self.directory, f"journal-{first_seq:012d}.log")
+        self._file = open(path, "ab")
+        self._path = path
+
+    def _drop_segments(self, flushed_seq: int):
+        with self._cond:
+            done = [path for path, last_seq in self._segments if last_seq <= flushed_seq]
+            self._segments = [(path, last_seq) for path, last_seq in self._segments if last_seq > flushed_seq]
+        for path in done:
+            os.remove(path)
+
+    def _write_loop(self):
+        while True:
+            with self._cond:
+                while not self._pending and not self._stopping:
+                    self._cond.wait()
+                if not self._pending:
+                    return
+                entries, self._pending = self._pending, []
+                commit, self._commit = self._commit, Commit()
+
+            data = b"".join(json.dumps(entry, separators=(",", ":")).encode("utf-8") + b"\n" for entry in entries)
+            offset = self._file.tell()
+            try:
+                self._file.write(data)
+                self._file.flush()
+                os.fsync(self._file.fileno())
+            except OSError as exc:
+                logger.exception("Trade journal write failed")
+                # Don't leave a partial group behind for recovery to replay
+                try:
+                    self._file.truncate(offset)
+                except OSError:
+                    pass
+                self.ledger.revert(entries)
+                commit.finish(exc)
+                continue
+
+            with self._cond:
+                self._durable.extend(entries)
+                if self._file.tell() >= self.segment_bytes:
+                    self._file.close()
+                    self._segments.append((self._path, entries[-1]["seq"]))
+                    self._open_segment(entries[-1]["seq"] + 1)
+            commit.finish()
+
+    def _flush_loop(self):
+        while not self._stopped.wait(self.flush_seconds):
+            self.flush()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Inspect or recover the trade journal")
+    parser.add_argument("--dir", default=JOURNAL_DIR, help="journal directory")
+    parser.add_argument("--recover", action="store_true", help="flush pending entries to the database")
+    args = parser.parse_args()
+
+    models.Base.metadata.create_all(bind=database.engine)
+    if args.recover:
+        print(f"Flushed {TradeJournal(args.dir).recover()} entries")
+    else:
+        with database.SessionLocal() as db:
+            last_seq = read_checkpoint(db)
+        pending = [entry for path in segment_paths(args.dir) for entry in read_segment(path) if entry["seq"] > last_seq]
+        print(f"Checkpoint {last_seq}, {len(pending)} entries waiting to be flushed")
@@ -0,0 +1,278 @@
+"""
+Every account ranked by portfolio value (cash plus holdings at market).
+
+The ranking is a SortedList of (-value, user_id), so a user's rank, the
+top N and a user's neighbours are O(log n) lookups however many accounts
+there are. It is kept current two ways:
+
+    trades   update the one account they touched: its cash and the
+             positions that changed, so remove/re-add its key (O(log n))
+    ticks    re-mark every account at once: positions live in flat
+             arrays (user row, ticker id, quantity), so the value of
+             every account is one vectorized multiply and bincount;
+             the new order comes from one lexsort and the sorted list is
+             rebuilt from it in linear time
+
+A re-mark or reload does its heavy work without holding the lock trades
+update under, then swaps the result in and redoes the few accounts that
+traded meanwhile, so a trade never waits on a whole-board pass.
+
+All values use the prices of the last re-mark, so everyone is ranked on
+the same marks. Each worker keeps its own copy, loaded from the database
+at startup and again every LEADERBOARD_REFRESH_SECONDS so trades made
+on other workers show up.
+
+P&L is measured against the cash every account opens with
+(equity.STARTING_BALANCE).
+"""
+import threading
+
+import numpy as np
+from sortedcontainers import SortedList
+from sqlalchemy.orm import Session
+
+import models, positions
+from equity import STARTING_BALANCE
+
+
+def _grow(array: np.ndarray, needed: int, minimum: int) -> np.ndarray:
+    if needed <= len(array):
+        return array
+    grown = np.zeros(max(minimum, 2 * len(array), needed), dtype=array.dtype)
+    grown[:len(array)] = array
+    return grown
+
+
+def mark(prices: np.ndarray, cash: np.ndarray, rows: np.ndarray, tickers: np.ndarray, quantities: np.ndarray) -> np.ndarray:
+    """Every account's cash plus its positions at `prices`, in one pass"""
+    values = cash.copy()
+    if len(rows):
+        # A ticker newer than the price array is worth nothing until it's priced
+        known = tickers < len(prices)
+        values += np.bincount(rows[known], weights=quantities[known] * prices[tickers[known]], minlength=len(cash))
+    return values
+
+
+def rank(values: np.ndarray, user_ids: np.ndarray) -> SortedList:
+    """The ranking for these values: highest first, ties by user id"""
+    order = np.lexsort((user_ids, -values))
+    # Already in key order, so building the list is linear
+    return SortedList(zip((-values[order]).tolist(), user_ids[order].tolist()))
+
+
+class Board:
+    """The accounts, their positions and the ranking (locked by the Leaderboard that owns it)"""
+
+    def __init__(self):
+        self.rows = {}                       # {user_id: row}
+        self.count = 0
+        self.user_ids = np.zeros(0, dtype=np.int64)
+        self.usernames = []
+        self.cash = np.zeros(0)
+        self.values = np.zeros(0)
+        self.slots = {}                      # {(row, ticker id): position slot}
+        self.row_slots = []                  # [slot, ...] per row
+        self.position_count = 0
+        self.position_rows = np.zeros(0, dtype=np.int64)
+        self.position_tickers = np.zeros(0, dtype=np.int64)
+        self.quantities = np.zeros(0)
+        self.prices = np.zeros(0)
+        self.ranking = SortedList()
+
+    def add_account(self, user_id: int, username: str, cash: float) -> int:
+        row = self.rows[user_id] = self.count
+        self.count += 1
+        self.user_ids = _grow(self.user_ids, self.count, 16)
+        self.cash = _grow(self.cash, self.count, 16)
+        self.values = _grow(self.values, self.count, 16)
+        self.user_ids[row] = user_id
+        self.usernames.append(username)
+        self.row_slots.append([])
+        self.cash[row] = self.values[row] = cash
+        self.ranking.add((-float(cash), user_id))
+        return row
+
+    def set_position(self, row: int, ticker_id: int, quantity: int) -> float:
+        """Set a holding's quantity; returns what it was"""
+        slot = self.slots.get((row, ticker_id))
+        if slot is not None:
+            old = float(self.quantities[slot])
+            self.quantities[slot] = quantity
+            return old
+        slot = self.slots[(row, ticker_id)] = self.position_count
+        self.position_count += 1
+        self.position_rows = _grow(self.position_rows, self.position_count, 64)
+        self.position_tickers = _grow(self.position_tickers, self.position_count, 64)
+        self.quantities = _grow(self.quantities, self.position_count, 64)
+        self.position_rows[slot] = row
+        self.position_tickers[slot] = ticker_id
+        self.quantities[slot] = quantity
+        self.row_slots[row].append(slot)
+        return 0.0
+
+    def price(self, ticker_id: int) -> float:
+        return float(self.prices[ticker_id]) if ticker_id < len(self.prices) else 0.0
+
+    def value_of(self, row: int) -> float:
+        """One account valued from scratch at the current marks"""
+        return float(self.cash[row]) + sum(
+            float(self.quantities[slot]) * self.price(self.position_tickers[slot]) for slot in self.row_slots[row]
+        )
+
+    def move(self, row: int, value: float):
+        user_id = int(self.user_ids[row])
+        self.ranking.remove((-float(self.values[row]), user_id))
+        self.values[row] = value
+        self.ranking.add((-value, user_id))
+
+    def columns(self):
+        """Copies of (cash, user ids, position rows, tickers, quantities) for a re-mark"""
+        count, positions = self.count, self.position_count
+        return (self.cash[:count].copy(), self.user_ids[:count].copy(), self.position_rows[:positions].copy(),
+                self.position_tickers[:positions].copy(), self.quantities[:positions].copy())
+
+    def entry(self, place: int, key) -> dict:
+        value, user_id = -key[0], key[1]
+        return {"rank": place, "user_id": user_id, "username": self.usernames[self.rows[user_id]],
+                "total_value": round(value, 2), "pnl": round(value - STARTING_BALANCE, 2)}
+
+
+class Leaderboard:
+    """Ranked account values, updated per trade and re-marked per tick"""
+
+    def __init__(self, engine):
+        self._engine = engine                # prices and ticker ids come from the price engine
+        self._lock = threading.Lock()        # guards the board; only ever held briefly
+        self._rebuild_lock = threading.Lock()  # one re-mark or reload at a time
+        self._board = Board()
+        self._touched = None                 # user ids updated while a re-mark runs
+        self._missed = None                  # updates made while a reload runs
+
+    def __len__(self):
+        return len(self._board.ranking)
+
+    def load(self, db: Session):
+        """Replace everything with the accounts and positions in the database, marked at current prices"""
+        with self._rebuild_lock:
+            with self._lock:
+                self._missed = []
+            try:
+                board = self._read(db)
+            finally:
+                with self._lock:
+                    missed, self._missed = self._missed, None
+            with self._lock:
+                self._board = board
+                # Updates carry absolute cash and quantities, so replaying ones
+                # the database already had changes nothing
+                for update in missed:
+                    self._apply(*update)
+
+    def _read(self, db: Session) -> Board:
+        users = db.query(models.User.id, models.User.username, models.User.wallet_balance).all()
+        holdings = db.execute(positions.holdings_query()).all()
+        board = Board()
+        for user_id, username, balance in users:
+            board.rows[user_id] = len(board.usernames)
+            board.usernames.append(username)
+        board.count = len(users)
+        board.user_ids = np.array([user[0] for user in users], dtype=np.int64)
+        board.cash = np.array([user[2] or 0.0 for user in users], dtype=float)
+        board.values = board.cash.copy()
+        board.row_slots = [[] for _ in users]
+
+        ticker_index = self._engine.index
+        for user_id, ticker, quantity, _, _ in holdings:
+            row, ticker_id = board.rows.get(user_id), ticker_index.get(ticker)
+            if row is not None and ticker_id is not None:
+                board.set_position(row, ticker_id, quantity)
+
+        board.prices = np.asarray(self._engine.prices, dtype=float)
+        cash, user_ids, rows, tickers, quantities = board.columns()
+        board.values[:board.count] = mark(board.prices, cash, rows, tickers, quantities)
+        board.ranking = rank(board.values[:board.count], user_ids)
+        return board
+
+    def add_account(self, user_id: int, username: str, cash: float):
+        """A new account (signup), with no positions yet"""
+        with self._lock:
+            self._apply(user_id, cash, {}, username)
+
+    def update(self, user_id: int, cash: float, positions: dict):
+        """A trade changed this account: its cash, and {ticker: quantity} for the positions it touched"""
+        with self._lock:
+            self._apply(user_id, cash, positions, "")
+
+    def _apply(self, user_id: int, cash: float, positions: dict, username: str):
+        if self._missed is not None:
+            self._missed.append((user_id, cash, positions, username))
+        if self._touched is not None:
+            self._touched.add(user_id)
+        board = self._board
+        row = board.rows.get(user_id)
+        if row is None:
+            # Signed up on another worker; picked up by name on the next refresh
+            row = board.add_account(user_id, username, cash)
+
+        value = float(board.values[row]) - float(board.cash[row]) + cash
+        board.cash[row] = cash
+        for ticker, quantity in positions.items():
+            ticker_id = self._engine.index.get(ticker)
+            if ticker_id is not None:
+                old = board.set_position(row, ticker_id, quantity)
+                value += (quantity - old) * board.price(ticker_id)
+        board.move(row, value)
+
+    def remark(self):
+        """Value every account at the engine's current prices and re-rank.
+
+        Skipped if the previous re-mark or a reload is still running (ticks
+        can outpace a very large board; the next one catches up).
+        """
+        if not self._rebuild_lock.acquire(blocking=False):
+            return
+        try:
+            prices = np.asarray(self._engine.prices, dtype=float)
+            with self._lock:
+                board = self._board
+                cash, user_ids, rows, tickers, quantities = board.columns()
+                self._touched = set()
+
+            # The whole-board pass runs while trades keep updating the live ranking
+            values = mark(prices, cash, rows, tickers, quantities)
+            ranking = rank(values, user_ids)
+
+            with self._lock:
+                count = len(values)
+                board.prices = prices
+                board.values[:count] = values
+                board.ranking = ranking
+                # Accounts opened since aren't in the new ranking; ones that traded have moved on
+                for row in range(count, board.count):
+                    board.values[row] = board.value_of(row)
+                    ranking.add((-float(board.values[row]), int(board.user_ids[row])))
+                for user_id in self._touched:
+                    row = board.rows[user_id]
+                    if row < count:
+                        board.move(row, board.value_of(row))
+                self._touched = None
+        finally:
+            self._rebuild_lock.release()
+
+    def top(self, limit: int) -> list:
+        with self._lock:
+            board = self._board
+            return [board.entry(place, key) for place, key in enumerate(board.ranking.islice(0, limit), 1)]
+
+    def around(self, user_id: int, neighbors: int):
+        """(the user's entry, entries within `neighbors` places of it), or None if they aren't ranked"""
+        with self._lock:
+            board = self._board
+            row = board.rows.get(user_id)
+            if row is None:
+                return None
+            index = board.ranking.index((-float(board.values[row]), user_id))
+            start = max(0, index - neighbors)
+            nearby = [board.entry(place, key) for place, key in
+                      enumerate(board.ranking.islice(start, index + neighbors + 1), start + 1)]
+            return nearby[index - start], nearby
@@ -1,16 +1,43 @@
-from fastapi import FastAPI, HTTPException, Depends
+from fastapi import FastAPI, HTTPException, Depends, Request, Response, WebSocket, WebSocketDisconnect
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
+from sqlalchemy import insert, select, tuple_, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from typing import List
+from collections import namedtuple
+from contextlib import ExitStack, asynccontextmanager
 from fastapi.middleware.cors import CORSMiddleware
-from datetime import datetime
-import random
+from datetime import datetime, timezone
+import anyio
+import asyncio
+import base64
+import csv
+import io
+import json
+import logging
+import os
+import time
 
-import models, schemas, database
+import models, schemas, database, auth, metrics, positions, price_store, batch_trades, equity, order_book, journal
+from cache import ResponseCache
+from instruments import InstrumentRegistry, UnknownTicker
+from leaderboard import Leaderboard
+from price_engine import PriceEngine
+from price_history import PriceHistory, last_known_prices, save_bar
+from risk import RiskCalculator
+from streaming import hub
 
 # Create tables if they don't exist
 models.Base.metadata.create_all(bind=database.engine)
 
+logger = logging.getLogger(__name__)
+
 app = FastAPI()
+# Endpoints can be profiled per request when PROFILING_ENABLED=1 (see metrics.py)
+app.router.route_class = metrics.ProfiledRoute
 
 # --- THIS BLOCK IS REQUIRED TO FIX NETWORK ERROR ---
 app.add_middleware(
@@ -21,6 +48,16 @@ app.add_middleware(
     allow_headers=["*"],
 )
 # -------------------------------------------------
+# Per-route latency, SQL statement counts and pool waits for GET /metrics
+app.add_middleware(metrics.MetricsMiddleware)
+metrics.instrument_engine(database.engine)
+for index, read_engine in enumerate(database.read_engines):
+    metrics.instrument_engine(read_engine, f"replica-{index}")
+if database.ASYNC_MODE:
+    metrics.instrument_engine(database.async_engine.sync_engine, "async")
+    for index, read_engine in enumerate(database.async_read_engines):
+        metrics.instrument_engine(read_engine.sync_engine, f"async-replica-{index}")
+
 # Helper to get DB session
 def get_db():
     db = database.SessionLocal()
@@ -29,342 +66,695 @@ def get_db():
     finally:
         db.close()
 
+# Callers are identified by the signed token /login issued (see auth.py),
+# so resolving them costs an HMAC instead of a database query
+bearer_scheme = HTTPBearer(auto_error=False)
+
+def current_user_id(credentials: HTTPAuthorizationCredentials = Depends(bearer_scheme)) -> int:
+    """The user id the request's bearer token was issued to"""
+    if credentials is None:
+        raise HTTPException(status_code=401, detail="Not authenticated", headers={"WWW-Authenticate": "Bearer"})
+    try:
+        return auth.decode_token(credentials.credentials)["user_id"]
+    except auth.InvalidToken as exc:
+        raise HTTPException(status_code=401, detail=str(exc), headers={"WWW-Authenticate": "Bearer"})
+
+def authorize_user(user_id: int, caller_id: int = Depends(current_user_id)):
+    """Only let a caller read or trade for their own account"""
+    if caller_id != user_id:
+        raise HTTPException(status_code=403, detail="Not allowed for this user")
+
 # --- 1. LOGIN ---
+# Login and signup are async so bcrypt runs on auth's own hashing pool:
+# the short database calls go to the threadpool, the hashing doesn't hold it
 @app.post("/login", response_model=schemas.LoginResponse)
-def login(credentials: schemas.UserLogin, db: Session = Depends(get_db)):
-    # Find user by username or email
-    user = db.query(models.User).filter(
-        (models.User.username == credentials.username) | 
-        (models.User.email == credentials.username)
-    ).first()
-    
-    if not user:
-        raise HTTPException(status_code=401, detail="Invalid username/email or password")
+async def login(credentials: schemas.UserLogin, db: Session = Depends(get_db)):
+    user = await run_in_threadpool(find_login_user, db, credentials.username)
     
-    # Check password (Simple comparison for now; use hashing in production!)
-    if user.hashed_password != credentials.password:
+    if not user or not await auth.verify_password_async(credentials.password, user.hashed_password):
         raise HTTPException(status_code=401, detail="Invalid username/email or password")
     
+    # Upgrade plaintext (or outdated) hashes while we have the password
+    if auth.needs_rehash(user.hashed_password):
+        hashed_password = await auth.hash_password_async(credentials.password)
+        await run_in_threadpool(store_password_hash, db, user.id, hashed_password)
+    
     return {
         "user_id": user.id,
         "username": user.username,
-        "message": "Login successful"
+        "message": "Login successful",
+        "access_token": auth.issue_token(user.id, user.username)
     }
 
+def find_login_user(db: Session, identifier: str):
+    """Look up a login by email or username with a single indexed query"""
+    field, value = auth.normalize_login(identifier)
+    columns = (models.User.id, models.User.username, models.User.hashed_password)
+    if field == "email":
+        user = db.query(*columns).filter(models.User.email == value).first()
+        if user:
+            return user
+        # Usernames may contain "@" too
+        value = identifier.strip()
+    return db.query(*columns).filter(models.User.username == value).first()
+
+def store_password_hash(db: Session, user_id: int, hashed_password: str):
+    db.execute(update(models.User).where(models.User.id == user_id).values(hashed_password=hashed_password))
+    db.commit()
+
 # --- 2. SIGN UP (Create User) ---
 @app.post("/users/", response_model=schemas.UserResponse)
-def create_user(user: schemas.UserCreate, db: Session = Depends(get_db)):
-    # Check if username already exists
-    existing_user = db.query(models.User).filter(models.User.username == user.username).first()
-    if existing_user:
+async def create_user(user: schemas.UserCreate, db: Session = Depends(get_db)):
+    hashed_password = await auth.hash_password_async(user.password)
+    return await run_in_threadpool(insert_user, db, user, hashed_password)
+
+def insert_user(db: Session, user: schemas.UserCreate, hashed_password: str):
+    """INSERT the user in one round trip, letting the unique indexes catch duplicates"""
+    try:
+        new_user = db.execute(
+            insert(models.User).values(
+                username=user.username.strip(),
+                email=auth.normalize_email(user.email),
+                hashed_password=hashed_password,
+                wallet_balance=equity.STARTING_BALANCE
+            ).returning(models.User.id, models.User.username, models.User.email, models.User.wallet_balance)
+        ).one()
+        db.commit()
+    except IntegrityError as exc:
+        db.rollback()
+        # The violated constraint names the column (e.g. "users.email", "ix_users_email")
+        if "email" in str(exc.orig).lower():
+            raise HTTPException(status_code=400, detail="Email already registered")
         raise HTTPException(status_code=400, detail="Username already registered")
-    
-    # Check if email already exists
-    existing_email = db.query(models.User).filter(models.User.email == user.email).first()
-    if existing_email:
-        raise HTTPException(status_code=400, detail="Email already registered")
-    
-    # Create new user (Simple password storage for now; use hashing in production!)
-    new_user = models.User(
-        username=user.username,
-        email=user.email,
-        hashed_password=user.password
-    )
-    db.add(new_user)
-    db.commit()
-    db.refresh(new_user)
+    leaderboard.add_account(new_user.id, new_user.username, new_user.wallet_balance)
+    database.stick_to_primary(new_user.id)
     return new_user
 
 # --- 3. GET USER INFO (Balance + Portfolio) ---
-@app.get("/users/{user_id}", response_model=schemas.UserResponse)
-def read_user(user_id: int, db: Session = Depends(get_db)):
-    user = db.query(models.User).filter(models.User.id == user_id).first()
+@app.get("/users/{user_id}", response_model=schemas.UserResponse, dependencies=[Depends(authorize_user)])
+def read_user(user_id: int, db: Session = Depends(database.get_read_db)):
+    user = load_user(user_id, db)
     if user is None:
         raise HTTPException(status_code=404, detail="User not found")
     return user
 
-# Company names mapping
-COMPANY_NAMES = {
-    "AAPL": "Apple Inc.",
-    "MSFT": "Microsoft Corporation",
-    "TSLA": "Tesla, Inc.",
-    "NVDA": "NVIDIA Corporation",
-    "AMZN": "Amazon.com, Inc.",
-    "GOOGL": "Alphabet Inc. Class A",
-    "META": "Meta Platforms, Inc.",
-    "AMD": "Advanced Micro Devices",
-    "NFLX": "Netflix, Inc.",
-    "DIS": "The Walt Disney Company",
-    "JPM": "JPMorgan Chase & Co.",
-    "V": "Visa Inc.",
-    "MA": "Mastercard Incorporated",
-    "BAC": "Bank of America Corp",
-    "WMT": "Walmart Inc.",
-    "PG": "The Procter & Gamble Company",
-    "JNJ": "Johnson & Johnson",
-    "UNH": "UnitedHealth Group Inc.",
-}
-
-# Price tracking dictionary (in-memory, would use Redis in production)
-ticker_prices = {}
-
-# Base price ranges
-PRICE_RANGES = {
-        "AAPL": (150, 200), "MSFT": (350, 450), "TSLA": (200, 300),
-        "NVDA": (800, 950), "AMZN": (150, 200), "GOOGL": (130, 160),
-        "META": (450, 550), "AMD": (150, 200), "NFLX": (550, 650),
-    "DIS": (100, 125), "JPM": (140, 180), "V": (220, 280),
-    "MA": (350, 420), "BAC": (30, 45), "WMT": (140, 180),
-    "PG": (150, 180), "JNJ": (150, 180), "UNH": (450, 550)
-}
-
-def get_base_price(ticker: str) -> float:
-    """Get base price for a ticker from price ranges"""
-    if ticker in PRICE_RANGES:
-        min_p, max_p = PRICE_RANGES[ticker]
-        base = (min_p + max_p) / 2
-    else:
-        base = 250  # Default base price
-    return base
+# Tradable instruments: names, sectors and price ranges from INSTRUMENTS_FILE (see instruments.py)
+instruments = InstrumentRegistry.load()
+
+def require_instrument(ticker: str):
+    """Reject a ticker that isn't listed"""
+    if ticker not in instruments:
+        raise HTTPException(status_code=400, detail=str(UnknownTicker(ticker)))
+
+# How often prices move and queued updates are pushed to clients (seconds)
+PRICE_TICK_SECONDS = float(os.getenv("PRICE_TICK_SECONDS", "2"))
+
+# Central price engine: every ticker moves together once per tick
+# (set PRICE_ENGINE_SEED for a reproducible price path, e.g. in load tests,
+# and PRICE_STORE=shm or db so several uvicorn workers share one market)
+PRICE_ENGINE_SEED = os.getenv("PRICE_ENGINE_SEED")
+price_engine = PriceEngine(
+    instruments.price_ranges(),
+    seed=int(PRICE_ENGINE_SEED) if PRICE_ENGINE_SEED else None,
+    store=price_store.create_store(),
+    tick_seconds=PRICE_TICK_SECONDS
+)
+
+# Price history as OHLC bars (PRICE_BAR_SECONDS each), kept for risk metrics
+PRICE_BAR_SECONDS = float(os.getenv("PRICE_BAR_SECONDS", "60"))
+price_history = PriceHistory(bar_seconds=PRICE_BAR_SECONDS, lookback=int(os.getenv("RISK_LOOKBACK_BARS", "500")))
+with database.SessionLocal() as history_db:
+    price_history.load(history_db)
+    # Held tickers that are no longer listed don't tick: they're shown at their last stored price
+    unlisted_prices = last_known_prices(history_db, {
+        ticker for (ticker,) in history_db.query(models.Position.ticker).filter(models.Position.quantity > 0).distinct()
+        if ticker not in price_engine.index
+    })
+
+# Equity curve: snapshot every user's cash + holdings each EQUITY_SNAPSHOT_SECONDS
+equity_recorder = equity.EquityRecorder(interval=float(os.getenv("EQUITY_SNAPSHOT_SECONDS", "300")))
+
+# Beta is measured against an equal-weight index of the listed companies
+risk_calculator = RiskCalculator(price_history, instruments.tickers)
+
+# Accounts ranked by value: trades move one account, every tick re-marks them all
+# (reloaded every LEADERBOARD_REFRESH_SECONDS to pick up other workers' trades)
+leaderboard = Leaderboard(price_engine)
+with database.SessionLocal() as leaderboard_db:
+    leaderboard.load(leaderboard_db)
+LEADERBOARD_REFRESH_SECONDS = float(os.getenv("LEADERBOARD_REFRESH_SECONDS", "300"))
+
+# Cached reads: market data per price version, a user's results until their next trade
+# (RESPONSE_CACHE_TTL also bounds how stale another worker's copy can get)
+response_cache = ResponseCache(
+    maxsize=int(os.getenv("RESPONSE_CACHE_SIZE", "10000")),
+    ttl=float(os.getenv("RESPONSE_CACHE_TTL", "30"))
+)
+
+def cached_response(entry, request: Request = None, response: Response = None):
+    """Return a cached (value, etag) entry, or 304 if the client already has that version"""
+    value, etag = entry
+    if request is not None and request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+    if response is not None:
+        response.headers["ETag"] = etag
+    return value
+
+def user_result_key(name: str, user_id: int, *extra):
+    """Cache key for a user's priced result: changes on their trades and on price moves"""
+    return response_cache.user_key(name, user_id, price_engine.version, *extra)
 
 def get_current_price(ticker: str, db: Session = None) -> float:
-    """Get current price with market impact from transactions"""
+    """Get current price with market impact from transactions (the last stored price for an unlisted ticker)"""
     ticker_upper = ticker.upper()
-    
-    # Initialize price if not exists
-    if ticker_upper not in ticker_prices:
-        ticker_prices[ticker_upper] = get_base_price(ticker_upper)
-    
-    current_price = ticker_prices[ticker_upper]
-    
-    # Add some natural volatility (0.5% to 2% variation)
-    volatility = random.uniform(0.995, 1.02)
-    current_price = current_price * volatility
-    
-    return round(current_price, 2)
+    if ticker_upper not in price_engine.index and ticker_upper in unlisted_prices:
+        return unlisted_prices[ticker_upper]
+    return price_engine.price(ticker_upper)
+
+def get_day_change(ticker: str):
+    """(dollar change, percent change) since the session opened; an unlisted ticker doesn't move"""
+    if ticker not in price_engine.index and ticker in unlisted_prices:
+        return 0.0, 0.0
+    return price_engine.day_change(ticker)
 
-def apply_market_impact(ticker: str, quantity: int, transaction_type: str):
-    """Apply market impact when buying or selling"""
+def apply_market_impact(ticker: str, quantity: int, transaction_type: str) -> float:
+    """Apply market impact when buying or selling, returns the new price"""
     ticker_upper = ticker.upper()
-    
-    # Initialize price if not exists
-    if ticker_upper not in ticker_prices:
-        ticker_prices[ticker_upper] = get_base_price(ticker_upper)
-    
-    # Market impact: buying increases price, selling decreases price
-    # Impact factor: 0.1% per share (capped at 5% per trade)
-    impact_factor = min(abs(quantity) * 0.001, 0.05)
-    
-    if transaction_type == "BUY":
-        # Buying increases demand, price goes up
-        ticker_prices[ticker_upper] *= (1 + impact_factor)
-    else:  # SELL
-        # Selling increases supply, price goes down
-        ticker_prices[ticker_upper] *= (1 - impact_factor)
-    
-    # Ensure price doesn't go below 50% of base or above 200% of base
-    base_price = get_base_price(ticker_upper)
-    ticker_prices[ticker_upper] = max(base_price * 0.5, min(ticker_prices[ticker_upper], base_price * 2.0))
+    new_price = price_engine.apply_impact(ticker_upper, quantity, transaction_type)
+
+    # Let connected dashboards know on the next tick
+    hub.publish_prices({ticker_upper: new_price})
+    return new_price
+
+def adjust_balance(db: Session, user_id: int, amount: float, require_funds: bool = False):
+    """Atomically add `amount` to a user's balance and return the new balance.
+
+    With require_funds the UPDATE only matches if the balance covers the
+    debit, so concurrent buys can't double-spend. Returns None if the user
+    doesn't exist or can't afford it.
+    """
+    return db.execute(balance_update(user_id, amount, require_funds)).scalar()
+
+def balance_update(user_id: int, amount: float, require_funds: bool = False):
+    """The UPDATE ... RETURNING statement behind adjust_balance"""
+    stmt = update(models.User).where(models.User.id == user_id)
+    if require_funds:
+        stmt = stmt.where(models.User.wallet_balance >= -amount)
+    stmt = stmt.values(wallet_balance=models.User.wallet_balance + amount).returning(models.User.wallet_balance)
+    return stmt.execution_options(synchronize_session=False)
+
+def invalidate_user(user_id: int):
+    """A write for this user committed: drop their cached reads and serve their next reads from the primary"""
+    response_cache.invalidate_user(user_id)
+    database.stick_to_primary(user_id)
+
+def invalidate_users(user_ids):
+    """Drop cached reads for users whose journaled trades just reached the database"""
+    for user_id in user_ids:
+        invalidate_user(user_id)
+
+# Write-behind mode (TRADE_JOURNAL=1, see journal.py): trades are checked against
+# an in-memory ledger and acknowledged once journaled; the journal is flushed to
+# the database in the background. Anything a previous run left unflushed goes in first.
+trade_journal = None
+if journal.ENABLED:
+    trade_journal = journal.TradeJournal(on_flush=invalidate_users)
+    trade_journal.recover()
+    trade_journal.start()
+    metrics.REGISTRY.append(metrics.Gauge("trade_journal_unflushed", "Journaled trades not yet written to the database", trade_journal.unflushed))
+
+def load_trading_state(db: Session, user_ids, tickers) -> batch_trades.BatchState:
+    """Balances and positions to run orders against: the ledger in journal mode, else the database"""
+    if trade_journal is not None:
+        trade_journal.ledger.ensure_loaded(db, user_ids)
+        return trade_journal.ledger.snapshot(user_ids, tickers)
+    return batch_trades.BatchState.load(db, user_ids, tickers)
+
+def record_fills(db: Session, fills):
+    """Write fills (caller commits), or journal them in journal mode.
+
+    Returns the balances and positions as written (a BatchState), or None if a balance or position can't cover them.
+    """
+    if trade_journal is None:
+        return batch_trades.write_fills(db, fills)
+    appended = trade_journal.append(fills)
+    if appended is None:
+        return None
+    commit, written = appended
+    wait_for_journal(commit)
+    return written
+
+def wait_for_journal(commit: journal.Commit):
+    try:
+        commit.wait()
+    except journal.JournalError as exc:
+        raise HTTPException(status_code=503, detail=str(exc))
 
 # --- 4. Trade STOCK (The Core Logic) ---
 @app.post("/trade")
-def trade_stock(trade: schemas.TransactionCreate, db: Session = Depends(get_db)):
-    # 1. Get User
-    user = db.query(models.User).filter(models.User.id == trade.user_id).first()
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
-
-    # 2. Get Current Stock Price (with market impact)
-    ticker_upper = trade.ticker.upper()
-    current_price = get_current_price(ticker_upper, db)
+def trade_stock(trade: schemas.TransactionCreate, db: Session = Depends(get_db), caller_id: int = Depends(current_user_id)):
+    if trade.user_id != caller_id:
+        raise HTTPException(status_code=403, detail="Not allowed for this user")
     
-    # Determine transaction type
+    # 1. Determine transaction type
+    ticker_upper = trade.ticker.upper()
     if trade.quantity > 0:
         transaction_type = "BUY"
     elif trade.quantity < 0:
         transaction_type = "SELL"
     else:
         raise HTTPException(status_code=400, detail="Quantity cannot be zero")
+    require_instrument(ticker_upper)
     
-    # Apply market impact BEFORE calculating cost
-    apply_market_impact(ticker_upper, abs(trade.quantity), transaction_type)
+    if trade_journal is not None:
+        return trade_stock_journaled(trade, ticker_upper, db)
     
-    # Get updated price after market impact
-    current_price = get_current_price(ticker_upper, db)
-    total_cost = current_price * trade.quantity
+    # Hold the ticker's lock so the fill price and its market impact are one step.
+    # Balance and share checks are conditional UPDATEs, so they also hold across processes.
+    with price_engine.lock_for(ticker_upper):
+        # 2. Get Current Stock Price (with market impact)
+        current_price = price_engine.quote_impact(ticker_upper, abs(trade.quantity), transaction_type)
+        total_cost = current_price * trade.quantity
 
-    # 3. BUY LOGIC (Positive Quantity)
-    if trade.quantity > 0:
-        if user.wallet_balance < total_cost:
-            raise HTTPException(status_code=400, detail=f"Insufficient funds. Cost: ${total_cost:.2f}, Balance: ${user.wallet_balance:.2f}")
-        
-        user.wallet_balance -= total_cost
+        # 3. BUY LOGIC (Positive Quantity)
+        if trade.quantity > 0:
+            new_balance = adjust_balance(db, trade.user_id, -total_cost, require_funds=True)
+            if new_balance is None:
+                db.rollback()
+                user = db.query(models.User).filter(models.User.id == trade.user_id).first()
+                if not user:
+                    raise HTTPException(status_code=404, detail="User not found")
+                raise HTTPException(status_code=400, detail=f"Insufficient funds. Cost: ${total_cost:.2f}, Balance: ${user.wallet_balance:.2f}")
+            
+            position = positions.add_shares(db, trade.user_id, ticker_upper, trade.quantity, current_price)
 
-    # 4. SELL LOGIC (Negative Quantity)
-    elif trade.quantity < 0:
-        # --- OWNERSHIP CHECK ---
-        user_transactions = db.query(models.Transaction).filter(
-            models.Transaction.user_id == trade.user_id,
-            models.Transaction.ticker == ticker_upper
-        ).all()
-        
-        total_owned = sum(t.quantity for t in user_transactions)
-        sell_quantity = abs(trade.quantity)
+        # 4. SELL LOGIC (Negative Quantity)
+        else:
+            # --- OWNERSHIP CHECK ---
+            sell_quantity = abs(trade.quantity)
+            position = positions.remove_shares(db, trade.user_id, ticker_upper, sell_quantity)
+            if position is None:
+                db.rollback()
+                user = db.query(models.User).filter(models.User.id == trade.user_id).first()
+                if not user:
+                    raise HTTPException(status_code=404, detail="User not found")
+                held = positions.get_position(db, trade.user_id, ticker_upper)
+                total_owned = held.quantity if held else 0
+                raise HTTPException(
+                    status_code=400, 
+                    detail=f"Insufficient shares. You own {total_owned} shares of {ticker_upper}, but attempting to sell {sell_quantity} shares"
+                )
+            # ---------------------------
+
+            new_balance = adjust_balance(db, trade.user_id, -total_cost) # Subtracting a negative cost adds money
+
+        # 5. Save Transaction
+        new_tx = models.Transaction(
+            user_id=trade.user_id,
+            ticker=ticker_upper,
+            quantity=trade.quantity,
+            price_per_share=current_price,
+            type=transaction_type
+        )
+        db.add(new_tx)
+        db.commit()
 
-        if total_owned < sell_quantity:
-            raise HTTPException(
-                status_code=400, 
-                detail=f"Insufficient shares. You own {total_owned} shares of {ticker_upper}, but attempting to sell {sell_quantity} shares"
-            )
-        # ---------------------------
+        # Only move the market once the trade is committed
+        apply_market_impact(ticker_upper, abs(trade.quantity), transaction_type)
+    
+    return trade_result(trade.user_id, ticker_upper, current_price, position, new_balance)
 
-        user.wallet_balance -= total_cost # Subtracting a negative cost adds money
+def trade_stock_journaled(trade: schemas.TransactionCreate, ticker_upper: str, db: Session):
+    """/trade in journal mode: checked against the ledger, acknowledged once the journal is on disk"""
+    trade_journal.ledger.ensure_loaded(db, [trade.user_id])
+    with price_engine.lock_for(ticker_upper):
+        # A trade on another ticker may spend the same balance between the snapshot
+        # and the append: the append re-checks, so take a fresh snapshot once
+        for attempt in range(2):
+            state = trade_journal.ledger.snapshot([trade.user_id], [ticker_upper])
+            fills, (result,) = batch_trades.run_orders(state, [(0, trade)], price_engine.simulate_impact)
+            if result["status"] == "rejected":
+                raise HTTPException(status_code=404 if result["detail"] == "User not found" else 400, detail=result["detail"])
+            appended = trade_journal.append(fills)
+            if appended is not None:
+                commit, written = appended
+                break
+        else:
+            raise HTTPException(status_code=409, detail="Balance changed while trading, please retry")
+        
+        # The ledger already counts the trade, so the market moves now; the response waits for the fsync
+        apply_market_impact(ticker_upper, abs(trade.quantity), fills[0].type)
     
-    else:
-        raise HTTPException(status_code=400, detail="Quantity cannot be zero")
+    wait_for_journal(commit)
+    return trade_result(trade.user_id, ticker_upper, result["price"], written.holdings[(trade.user_id, ticker_upper)],
+                        written.balances[trade.user_id])
 
-    # 5. Save Transaction
-    new_tx = models.Transaction(
-        user_id=user.id,
-        ticker=ticker_upper,
-        quantity=trade.quantity,
-        price_per_share=current_price,
-        type=transaction_type
-    )
-    db.add(new_tx)
-    db.commit()
+def trade_result(user_id: int, ticker_upper: str, current_price: float, position, new_balance: float):
+    """Publish a committed trade to the user's dashboards and build the response"""
+    invalidate_user(user_id)
+    leaderboard.update(user_id, new_balance, {ticker_upper: position[0]})
+    
+    # Push the changed holding to the user's open dashboards
+    quantity, cost_basis, shares_bought = position
+    hub.publish_portfolio(user_id, {
+        "positions": {ticker_upper: {
+            "quantity": quantity,
+            "average_cost": round(cost_basis / shares_bought, 2) if shares_bought else 0.0
+        }},
+        "wallet_balance": round(new_balance, 2)
+    })
     
     return {
         "msg": "Trade successful", 
         "ticker": ticker_upper,
         "price": current_price,
-        "new_balance": round(user.wallet_balance, 2)
+        "new_balance": round(new_balance, 2)
     }
 
-# Helper function to calculate portfolio items
-def calculate_portfolio_items(user_id: int, db: Session):
-    # 1. Get all transactions for this user
-    transactions = db.query(models.Transaction).filter(models.Transaction.user_id == user_id).all()
+# --- 4b. BATCH TRADES (Many orders, one commit) ---
+MAX_BATCH_ORDERS = 1000
+# Accounts that may batch orders for any user (e.g. a desk or a load-test driver);
+# everyone else may only include orders for their own account
+BATCH_OPERATOR_IDS = {int(uid) for uid in os.getenv("BATCH_OPERATOR_IDS", "").split(",") if uid.strip()}
+
+@app.post("/trades/batch", response_model=schemas.BatchTradeResponse)
+def trade_batch(batch: schemas.BatchTradeRequest, db: Session = Depends(get_db), caller_id: int = Depends(current_user_id)):
+    if caller_id not in BATCH_OPERATOR_IDS and any(order.user_id != caller_id for order in batch.orders):
+        raise HTTPException(status_code=403, detail="Orders may only be placed for your own account (multi-user batches need a BATCH_OPERATOR_IDS account)")
+    if len(batch.orders) > MAX_BATCH_ORDERS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BATCH_ORDERS} orders per batch")
+    if batch.chunk_size is not None and batch.chunk_size < 1:
+        raise HTTPException(status_code=400, detail="chunk_size must be at least 1")
     
-    # 2. Group by Ticker and calculate average cost
-    portfolio_data = {} 
-    purchase_data = {}  # Track purchases for average cost calculation
+    orders = list(enumerate(batch.orders))
+    user_ids = {order.user_id for order in batch.orders}
+    tickers = sorted({order.ticker.upper() for order in batch.orders})
+    # All-or-nothing is a single commit; best effort may commit as it goes
+    chunk_size = batch.chunk_size if batch.mode == "best_effort" and batch.chunk_size else max(len(orders), 1)
     
-    for t in transactions:
-        ticker = t.ticker
-        if ticker not in portfolio_data:
-            portfolio_data[ticker] = 0
-            purchase_data[ticker] = {"total_cost": 0, "total_shares": 0}
+    results = []
+    changed = set()
+    # Lock every ticker in the batch (in sorted order, so two batches can't deadlock)
+    with ExitStack() as stack:
+        for ticker in tickers:
+            stack.enter_context(price_engine.lock_for(ticker))
+        state = load_trading_state(db, user_ids, tickers)
         
-        portfolio_data[ticker] += t.quantity
-        
-        # Track purchases for average cost
-        if t.type == "BUY" and t.quantity > 0:
-            purchase_data[ticker]["total_cost"] += t.price_per_share * t.quantity
-            purchase_data[ticker]["total_shares"] += t.quantity
+        for start in range(0, len(orders), chunk_size):
+            chunk = orders[start:start + chunk_size]
+            # A guard only fails if another request traded for these users meanwhile:
+            # reload their state and try the chunk once more
+            for attempt in range(2):
+                trial = state.copy()
+                fills, chunk_results = batch_trades.run_orders(trial, chunk, price_engine.simulate_impact, listed=instruments)
+                rejected = [r for r in chunk_results if r["status"] == "rejected"]
+                if batch.mode == "atomic" and rejected:
+                    db.rollback()
+                    raise HTTPException(status_code=400, detail=f"Order {rejected[0]['index']} ({rejected[0]['ticker']}) rejected: {rejected[0]['detail']}. No orders were executed.")
+                written = record_fills(db, fills) if fills else None
+                if not fills or written is not None:
+                    db.commit()
+                    # Report what was written: other requests may have traded for these users meanwhile
+                    if written is not None:
+                        batch_trades.apply_written(trial, written, chunk_results)
+                    state = trial
+                    break
+                db.rollback()
+                state = load_trading_state(db, user_ids, tickers)
+            else:
+                if batch.mode == "atomic":
+                    raise HTTPException(status_code=409, detail="Balances changed while the batch was running. No orders were executed.")
+                fills = []
+                chunk_results = [
+                    dict(result, status="rejected", price=None, new_balance=None, detail="Balances changed while the batch was running, please retry")
+                    for result in chunk_results
+                ]
+            
+            # Committed: move the market for each fill in order
+            for fill in fills:
+                apply_market_impact(fill.ticker, abs(fill.quantity), fill.type)
+                changed.add((fill.user_id, fill.ticker))
+            results.extend(chunk_results)
+    
+    publish_batch(state, changed)
+    
+    filled = sum(1 for result in results if result["status"] == "filled")
+    return schemas.BatchTradeResponse(mode=batch.mode, filled=filled, rejected=len(results) - filled, results=results)
 
-    # 3. Create the list for the frontend
-    result = []
+def publish_batch(state: batch_trades.BatchState, changed):
+    """Invalidate cached reads, re-rank and push changed holdings ({(user_id, ticker)}) to open dashboards"""
+    touched = {}
+    for user_id, ticker in changed:
+        touched.setdefault(user_id, {})[ticker] = state.holdings[(user_id, ticker)][0]
+    for user_id, holdings in touched.items():
+        invalidate_user(user_id)
+        leaderboard.update(user_id, state.balances[user_id], holdings)
+    
+    for user_id, ticker in changed:
+        quantity, cost_basis, shares_bought = state.holdings[(user_id, ticker)]
+        hub.publish_portfolio(user_id, {
+            "positions": {ticker: {
+                "quantity": quantity,
+                "average_cost": round(cost_basis / shares_bought, 2) if shares_bought else 0.0
+            }},
+            "wallet_balance": round(state.balances[user_id], 2)
+        })
+
+# --- 4c. LIMIT / STOP ORDERS (Resting orders, matched on every tick) ---
+order_books = order_book.OrderBooks()
+with database.SessionLocal() as orders_db:
+    order_books.load(orders_db)
+
+@app.post("/orders", response_model=schemas.OrderResponse)
+def place_order(order: schemas.OrderCreate, db: Session = Depends(get_db), caller_id: int = Depends(current_user_id)):
+    if order.user_id != caller_id:
+        raise HTTPException(status_code=403, detail="Not allowed for this user")
+    if order.quantity == 0:
+        raise HTTPException(status_code=400, detail="Quantity cannot be zero")
+    if order.price <= 0:
+        raise HTTPException(status_code=400, detail="Price must be positive")
+    require_instrument(order.ticker.upper())
     
-    for ticker, qty in portfolio_data.items():
-        if qty > 0: # Only show stocks you currently own
-            # Get current price
-            current_price = get_current_price(ticker)
-            total_value = round(qty * current_price, 2)
+    # Funds and shares are checked when the order fills, like any trade
+    new_order = models.Order(
+        user_id=order.user_id,
+        ticker=order.ticker.upper(),
+        quantity=order.quantity,
+        type="BUY" if order.quantity > 0 else "SELL",
+        order_type=order.order_type.upper(),
+        price=round(order.price, 2),
+        status="OPEN"
+    )
+    db.add(new_order)
+    db.commit()
+    db.refresh(new_order)
+    database.stick_to_primary(order.user_id)
+    
+    order_books.add(order_book.resting_order(new_order))
+    return new_order
+
+@app.get("/orders/{user_id}", response_model=List[schemas.OrderResponse], dependencies=[Depends(authorize_user)])
+def get_orders(user_id: int, db: Session = Depends(database.get_read_db), status: str = "OPEN", limit: int = 100):
+    # Newest first; status=ALL for every order
+    query = db.query(models.Order).filter(models.Order.user_id == user_id)
+    if status.upper() != "ALL":
+        query = query.filter(models.Order.status == status.upper())
+    return query.order_by(models.Order.id.desc()).limit(max(1, min(limit, MAX_HISTORY_PAGE))).all()
+
+@app.delete("/orders/{order_id}", response_model=schemas.OrderResponse)
+def cancel_order(order_id: int, db: Session = Depends(get_db), caller_id: int = Depends(current_user_id)):
+    # Conditional UPDATE: an order the tick already claimed can't be cancelled
+    cancelled = db.execute(
+        update(models.Order)
+        .where(models.Order.id == order_id, models.Order.user_id == caller_id, models.Order.status == "OPEN")
+        .values(status="CANCELLED")
+        .returning(models.Order.id)
+        .execution_options(synchronize_session=False)
+    ).scalar()
+    db.commit()
+    database.stick_to_primary(caller_id)
+    
+    order = db.query(models.Order).filter(models.Order.id == order_id, models.Order.user_id == caller_id).first()
+    if order is None:
+        raise HTTPException(status_code=404, detail="Order not found")
+    if cancelled is None:
+        raise HTTPException(status_code=400, detail=f"Order is already {order.status.lower()}")
+    
+    order_books.remove(order_id)
+    return order
+
+def fill_triggered_orders(triggered):
+    """Fill the orders a tick crossed as one batch (worker thread)"""
+    tickers = sorted({order.ticker for order in triggered})
+    # The tick already took these off the books: until the claims are committed, a failure puts them back
+    unsettled, past_limit = triggered, []
+    # Fills on disk in the journal but not yet settled in the orders table
+    journaled = []
+    db = database.SessionLocal()
+    try:
+        with ExitStack() as stack:
+            for ticker in tickers:
+                stack.enter_context(price_engine.lock_for(ticker))
             
-            # Calculate average cost
-            avg_cost = 0
-            if ticker in purchase_data and purchase_data[ticker]["total_shares"] > 0:
-                avg_cost = purchase_data[ticker]["total_cost"] / purchase_data[ticker]["total_shares"]
+            for attempt in range(2):
+                # Claim first: cancelled orders, or ones another worker filled, drop out here
+                claimed = order_book.claim(db, [order.id for order in triggered])
+                ready = [order for order in triggered if order.id in claimed]
+                state = load_trading_state(db, {order.user_id for order in ready}, tickers)
+                limits = {index: order_book.limit_price(order) for index, order in enumerate(ready)}
+                fills, results = batch_trades.run_orders(state, list(enumerate(ready)), price_engine.simulate_impact, limits)
+                written = record_fills(db, fills) if fills else None
+                if not fills or written is not None:
+                    if trade_journal is not None and fills:
+                        # Durable already: these orders must not rest again, whatever happens next
+                        journaled = [(ready[fill.index], fill) for fill in fills]
+                        filled = {order.id for order, _ in journaled}
+                        unsettled = [order for order in triggered if order.id not in filled]
+                    reopened = order_book.settle(db, ready, results, batch_trades.PAST_LIMIT)
+                    db.commit()
+                    journaled = []
+                    if written is not None:
+                        batch_trades.apply_written(state, written, results)
+                    # Filling these would move the price past their limit: wait for a better one
+                    unsettled, past_limit = [], [(order, price_engine.price(order.ticker)) for order in reopened]
+                    break
+                # A trade changed these balances meanwhile: reload and try once more
+                db.rollback()
             else:
-                avg_cost = current_price * 0.9  # Default to 10% below current if no purchase data
-            
-            # Calculate total return
-            total_cost_basis = avg_cost * qty
-            total_return = total_value - total_cost_basis
-            total_return_percent = (total_return / total_cost_basis * 100) if total_cost_basis > 0 else 0
-            
-            # Calculate day change (simulate 0.5% to 2.5% daily variation)
-            day_change_percent = round(random.uniform(-2.5, 2.5), 2)
-            day_change = round(current_price * qty * (day_change_percent / 100), 2)
+                # Still contended: leave everything resting for the next tick
+                unsettled, fills = ready, []
             
-            # Get company name
-            company_name = COMPANY_NAMES.get(ticker, f"{ticker} Corporation")
-            
-            item = schemas.PortfolioItem(
-                ticker=ticker,
-                company_name=company_name,
-                quantity=qty,
-                current_price=current_price,
-                total_value=total_value,
-                day_change=day_change,
-                day_change_percent=day_change_percent,
-                total_return=round(total_return, 2),
-                total_return_percent=round(total_return_percent, 2),
-                average_cost=round(avg_cost, 2)
-            )
-            result.append(item)
+            for fill in fills:
+                apply_market_impact(fill.ticker, abs(fill.quantity), fill.type)
+        publish_batch(state, {(fill.user_id, fill.ticker) for fill in fills})
+    except Exception:
+        logger.exception("Filling %d triggered orders failed", len(triggered))
+        if journaled:
+            db.rollback()
+            settle_journaled(journaled)
+    finally:
+        db.close()
+        for order in unsettled:
+            order_books.add(order)
+        for order, price in past_limit:
+            order_books.park(order, price)
+
+def settle_journaled(journaled):
+    """Mark orders FILLED whose fills reached the journal but whose settle didn't commit, and move the market for them"""
+    for order, fill in journaled:
+        apply_market_impact(fill.ticker, abs(fill.quantity), fill.type)
+    try:
+        with database.SessionLocal() as db:
+            order_book.claim(db, [order.id for order, _ in journaled])
+            db.commit()
+    except Exception:
+        # Left OPEN in the table: they'd be loaded onto the books again at startup
+        logger.exception("Orders %s are journaled as filled but still OPEN", [order.id for order, _ in journaled])
+
+# Plain rows cached in place of ORM objects (safe to share across sessions)
+UserRow = namedtuple("UserRow", "id username email wallet_balance")
+
+USER_COLUMNS = (models.User.id, models.User.username, models.User.email, models.User.wallet_balance)
+
+def load_user(user_id: int, db: Session):
+    """The user's profile and balance (None if there's no such user), cached until their next trade"""
+    def fetch():
+        row = db.query(*USER_COLUMNS).filter(models.User.id == user_id).first()
+        return UserRow(*row) if row else None
+    return response_cache.remember(response_cache.user_key("user", user_id), fetch)
+
+def load_positions(user_id: int, db: Session):
+    """The user's open positions (maintained by /trade), cached until their next trade"""
+    return response_cache.remember(
+        response_cache.user_key("positions", user_id), lambda: positions.get_open_positions(db, user_id)
+    )
+
+def portfolio_entry(user_id: int, db: Session):
+    """(priced portfolio items, etag), priced once per price version"""
+    return response_cache.get_or_compute(
+        user_result_key("portfolio", user_id), lambda: price_positions(load_positions(user_id, db))
+    )
+
+# Helper function to calculate portfolio items
+def calculate_portfolio_items(user_id: int, db: Session):
+    # Shared by every endpoint built on the priced portfolio
+    return portfolio_entry(user_id, db)[0]
+
+# Helper function to price position rows at the current market
+def price_positions(open_positions):
+    # Create the list for the frontend
+    result = []
+    
+    for position in open_positions:
+        ticker = position.ticker
+        qty = position.quantity
+
+        # Get current price
+        current_price = get_current_price(ticker)
+        total_value = round(qty * current_price, 2)
+        
+        # Calculate average cost
+        avg_cost = 0
+        if position.shares_bought > 0:
+            avg_cost = position.cost_basis / position.shares_bought
+        else:
+            avg_cost = current_price * 0.9  # Default to 10% below current if no purchase data
+        
+        # Calculate total return
+        total_cost_basis = avg_cost * qty
+        total_return = total_value - total_cost_basis
+        total_return_percent = (total_return / total_cost_basis * 100) if total_cost_basis > 0 else 0
+        
+        # Calculate day change (since the price engine's session open)
+        price_change, price_change_percent = get_day_change(ticker)
+        day_change_percent = round(price_change_percent, 2)
+        day_change = round(price_change * qty, 2)
+        
+        # Get company name
+        company_name = instruments.name(ticker)
+        
+        item = schemas.PortfolioItem(
+            ticker=ticker,
+            company_name=company_name,
+            quantity=qty,
+            current_price=current_price,
+            total_value=total_value,
+            day_change=day_change,
+            day_change_percent=day_change_percent,
+            total_return=round(total_return, 2),
+            total_return_percent=round(total_return_percent, 2),
+            average_cost=round(avg_cost, 2)
+        )
+        result.append(item)
     
     # Sort by total value (descending)
     result.sort(key=lambda x: x.total_value, reverse=True)
             
     return result
 
-@app.get("/portfolio/{user_id}", response_model=List[schemas.PortfolioItem])
-def get_portfolio(user_id: int, db: Session = Depends(get_db)):
-    return calculate_portfolio_items(user_id, db)
+@app.get("/portfolio/{user_id}", response_model=List[schemas.PortfolioItem], dependencies=[Depends(authorize_user)])
+def get_portfolio(user_id: int, db: Session = Depends(database.get_read_db), request: Request = None, response: Response = None):
+    return cached_response(portfolio_entry(user_id, db), request, response)
 
-@app.get("/portfolio/{user_id}/summary", response_model=schemas.PortfolioSummary)
-def get_portfolio_summary(user_id: int, db: Session = Depends(get_db)):
-    # Get user
-    user = db.query(models.User).filter(models.User.id == user_id).first()
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
-    
-    # Get all transactions for this user
-    transactions = db.query(models.Transaction).filter(models.Transaction.user_id == user_id).all()
-    
-    # Group by Ticker and calculate average cost
-    portfolio_data = {} 
-    purchase_data = {}
-    
-    for t in transactions:
-        ticker = t.ticker
-        if ticker not in portfolio_data:
-            portfolio_data[ticker] = 0
-            purchase_data[ticker] = {"total_cost": 0, "total_shares": 0}
-        
-        portfolio_data[ticker] += t.quantity
-        
-        if t.type == "BUY" and t.quantity > 0:
-            purchase_data[ticker]["total_cost"] += t.price_per_share * t.quantity
-            purchase_data[ticker]["total_shares"] += t.quantity
-    
+# Helper function to summarize already-priced portfolio items
+def build_portfolio_summary(user: models.User, portfolio_items: List[schemas.PortfolioItem]):
     # Calculate summary metrics
     total_value = 0
     day_gain_loss = 0
     
     # Calculate total profit/loss
     total_cost_basis = 0
-    for ticker, qty in portfolio_data.items():
-        if qty > 0:
-            current_price = get_current_price(ticker)
-            total_value += qty * current_price
-            
-            day_change_percent = round(random.uniform(-2.5, 2.5), 2)
-            day_gain_loss += current_price * qty * (day_change_percent / 100)
-            
-            # Calculate cost basis for this ticker
-            if ticker in purchase_data and purchase_data[ticker]["total_shares"] > 0:
-                avg_cost = purchase_data[ticker]["total_cost"] / purchase_data[ticker]["total_shares"]
-                total_cost_basis += avg_cost * qty
+    for item in portfolio_items:
+        total_value += item.quantity * item.current_price
+        day_gain_loss += item.day_change
+        total_cost_basis += item.average_cost * item.quantity
     
     # Calculate total profit/loss (current value - cost basis)
     total_profit_loss = total_value - total_cost_basis
     total_profit_loss_percent = (total_profit_loss / total_cost_basis * 100) if total_cost_basis > 0 else 0
     
     day_gain_loss_percent = (day_gain_loss / (total_value - day_gain_loss) * 100) if (total_value - day_gain_loss) > 0 else 0
-    total_positions = len([qty for qty in portfolio_data.values() if qty > 0])
+    total_positions = len(portfolio_items)
     cash_available = user.wallet_balance
     
     return schemas.PortfolioSummary(
@@ -377,16 +767,124 @@ def get_portfolio_summary(user_id: int, db: Session = Depends(get_db)):
         total_profit_loss_percent=round(total_profit_loss_percent, 2)
     )
 
-@app.get("/trades/{user_id}/history", response_model=List[schemas.TradeHistoryItem])
-def get_trade_history(user_id: int, db: Session = Depends(get_db), limit: int = 20):
-    # Get all transactions for this user, ordered by most recent
-    transactions = db.query(models.Transaction).filter(
-        models.Transaction.user_id == user_id
-    ).order_by(models.Transaction.timestamp.desc()).limit(limit).all()
+@app.get("/portfolio/{user_id}/summary", response_model=schemas.PortfolioSummary, dependencies=[Depends(authorize_user)])
+def get_portfolio_summary(user_id: int, db: Session = Depends(database.get_read_db), request: Request = None, response: Response = None):
+    def compute():
+        # Get user
+        user = load_user(user_id, db)
+        if not user:
+            raise HTTPException(status_code=404, detail="User not found")
+        
+        return build_portfolio_summary(user, calculate_portfolio_items(user_id, db))
+    return cached_response(response_cache.get_or_compute(user_result_key("summary", user_id), compute), request, response)
+
+@app.get("/trades/{user_id}/history", response_model=List[schemas.TradeHistoryItem], dependencies=[Depends(authorize_user)])
+def get_trade_history(user_id: int, db: Session = Depends(database.get_read_db), limit: int = 20, cursor: str = None,
+                      response: Response = None):
+    # Get this user's transactions, most recent first, one page at a time
+    limit = max(1, min(limit, MAX_HISTORY_PAGE))
+    transactions = db.execute(trade_history_query(user_id, limit, cursor)).all()
+    
+    # A full page may have more behind it: hand back where to continue
+    if response is not None and len(transactions) == limit:
+        response.headers["X-Next-Cursor"] = encode_history_cursor(transactions[-1])
+    
+    return build_trade_history(transactions)
+
+# History columns (no ORM objects needed to build the response)
+HISTORY_COLUMNS = (
+    models.Transaction.id, models.Transaction.ticker, models.Transaction.type,
+    models.Transaction.quantity, models.Transaction.price_per_share, models.Transaction.timestamp
+)
+MAX_HISTORY_PAGE = 500
+
+def encode_history_cursor(row) -> str:
+    """Opaque cursor pointing just past `row` in (timestamp, id) order"""
+    return base64.urlsafe_b64encode(f"{row.timestamp.isoformat()}|{row.id}".encode()).decode()
+
+def decode_history_cursor(cursor: str):
+    try:
+        timestamp, row_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return datetime.fromisoformat(timestamp), int(row_id)
+    except (ValueError, UnicodeDecodeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def trade_history_query(user_id: int, limit: int = None, cursor: str = None):
+    """Newest-first history for a user, resuming after `cursor` (keyset pagination).
+
+    Seeks with (timestamp, id) < cursor on the (user_id, timestamp) index
+    instead of OFFSET, so every page costs the same however deep it is.
+    """
+    stmt = select(*HISTORY_COLUMNS).where(models.Transaction.user_id == user_id)
+    if cursor:
+        stmt = stmt.where(tuple_(models.Transaction.timestamp, models.Transaction.id) < decode_history_cursor(cursor))
+    stmt = stmt.order_by(models.Transaction.timestamp.desc(), models.Transaction.id.desc())
+    if limit is not None:
+        stmt = stmt.limit(limit)
+    return stmt
+
+EXPORT_FIELDS = ["id", "timestamp", "ticker", "company_name", "type", "quantity", "price_per_share", "total_amount"]
+
+def export_rows(user_id: int):
+    """Every trade for a user as dicts, streamed from the database in batches.
+
+    Opens its own session (on a read replica, if any) because it runs while
+    the response is being sent. yield_per makes the driver use a server-side
+    cursor, so memory stays flat no matter how long the history is.
+    """
+    db = database.read_session(user_id)
+    try:
+        result = db.execute(trade_history_query(user_id).execution_options(yield_per=1000))
+        for t in result:
+            yield {
+                "id": t.id,
+                "timestamp": t.timestamp.isoformat(),
+                "ticker": t.ticker,
+                "company_name": instruments.name(t.ticker),
+                "type": t.type,
+                "quantity": abs(t.quantity),
+                "price_per_share": t.price_per_share,
+                "total_amount": round(abs(t.quantity * t.price_per_share), 2),
+            }
+    finally:
+        db.close()
+
+def export_chunks(rows, format: str, batch_size: int = 1000):
+    """Serialize rows to NDJSON or CSV, yielding one string per batch of rows"""
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=EXPORT_FIELDS) if format == "csv" else None
+    if writer:
+        writer.writeheader()
     
+    for count, row in enumerate(rows, 1):
+        if writer:
+            writer.writerow(row)
+        else:
+            buffer.write(json.dumps(row) + "\n")
+        if count % batch_size == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    
+    yield buffer.getvalue()
+
+@app.get("/trades/{user_id}/export", dependencies=[Depends(authorize_user)])
+def export_trade_history(user_id: int, format: str = "ndjson"):
+    if format not in ("ndjson", "csv"):
+        raise HTTPException(status_code=400, detail="format must be 'ndjson' or 'csv'")
+    
+    media_type = "text/csv" if format == "csv" else "application/x-ndjson"
+    return StreamingResponse(
+        export_chunks(export_rows(user_id), format),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="trades_{user_id}.{format}"'}
+    )
+
+# Helper function to format transactions for the history table
+def build_trade_history(transactions):
     result = []
     for t in transactions:
-        company_name = COMPANY_NAMES.get(t.ticker, f"{t.ticker} Corporation")
+        company_name = instruments.name(t.ticker)
         total_amount = abs(t.quantity * t.price_per_share)
         
         item = schemas.TradeHistoryItem(
@@ -403,13 +901,12 @@ def get_trade_history(user_id: int, db: Session = Depends(get_db), limit: int =
     
     return result
 
-@app.get("/portfolio/{user_id}/risk-metrics", response_model=schemas.RiskMetrics)
-def get_risk_metrics(user_id: int, db: Session = Depends(get_db)):
-    # Get portfolio items
-    portfolio_items = calculate_portfolio_items(user_id, db)
-    
-    if not portfolio_items:
-        # Return default values if no portfolio
+# Helper function to calculate risk metrics from portfolio items
+def build_risk_metrics(portfolio_items: List[schemas.PortfolioItem]):
+    # Computed from the recorded price bars (cached until the next bar or trade)
+    metrics = risk_calculator.metrics({item.ticker: item.quantity for item in portfolio_items}) if portfolio_items else None
+    if metrics is None:
+        # Return default values if no portfolio (or not enough price history yet)
         return schemas.RiskMetrics(
             sharpe_ratio=0.0,
             sharpe_status="N/A",
@@ -421,24 +918,20 @@ def get_risk_metrics(user_id: int, db: Session = Depends(get_db)):
             max_drawdown_status="N/A"
         )
     
-    # Calculate risk metrics (simplified calculations)
-    total_value = sum(item.total_value for item in portfolio_items)
-    
-    # Sharpe Ratio (simplified: based on returns)
-    avg_return = sum(item.total_return_percent for item in portfolio_items) / len(portfolio_items) if portfolio_items else 0
-    sharpe_ratio = round(avg_return / 10, 2) if avg_return > 0 else round(random.uniform(1.5, 2.0), 2)
+    # Sharpe Ratio (annualized excess return per unit of volatility)
+    sharpe_ratio = round(metrics["sharpe_ratio"], 2)
     sharpe_status = "Good" if sharpe_ratio > 1.5 else "Moderate" if sharpe_ratio > 1.0 else "Low"
     
-    # Beta (simplified: market correlation)
-    beta = round(random.uniform(0.8, 1.3), 2)
+    # Beta (vs. the equal-weight index)
+    beta = round(metrics["beta"], 2)
     beta_status = "Moderate" if 0.9 <= beta <= 1.1 else "High" if beta > 1.1 else "Low"
     
-    # Volatility (simplified: based on day changes)
-    volatility = round(random.uniform(15.0, 22.0), 1)
+    # Volatility (annualized, %)
+    volatility = round(metrics["volatility"], 1)
     volatility_status = "Medium" if 16 <= volatility <= 20 else "High" if volatility > 20 else "Low"
     
-    # Max Drawdown (simplified: worst loss)
-    max_drawdown = round(random.uniform(-15.0, -8.0), 1)
+    # Max Drawdown (worst fall from a peak, %)
+    max_drawdown = round(metrics["max_drawdown"], 1)
     max_drawdown_status = "Low" if max_drawdown > -10 else "Moderate" if max_drawdown > -15 else "High"
     
     return schemas.RiskMetrics(
@@ -452,29 +945,39 @@ def get_risk_metrics(user_id: int, db: Session = Depends(get_db)):
         max_drawdown_status=max_drawdown_status
     )
 
+@app.get("/portfolio/{user_id}/risk-metrics", response_model=schemas.RiskMetrics, dependencies=[Depends(authorize_user)])
+def get_risk_metrics(user_id: int, db: Session = Depends(database.get_read_db), request: Request = None, response: Response = None):
+    entry = response_cache.get_or_compute(
+        user_result_key("risk", user_id), lambda: build_risk_metrics(calculate_portfolio_items(user_id, db))
+    )
+    return cached_response(entry, request, response)
+
 @app.get("/market/prices", response_model=List[schemas.MarketPrice])
-def get_market_prices():
-    # Return current market prices for common stocks
+def get_market_prices(request: Request = None, response: Response = None):
+    # Every user sees the same prices: build them once per tick (or trade)
+    return cached_response(response_cache.get_or_compute(("market", price_engine.version), build_market_prices), request, response)
+
+def build_market_prices():
+    # Every listed instrument, with day changes computed for the whole universe in one pass
+    tickers, prices, changes, percents = price_engine.day_changes()
     result = []
-    for ticker, company_name in COMPANY_NAMES.items():
-        current_price = get_current_price(ticker)
-        day_change_percent = round(random.uniform(-3.0, 3.0), 2)
-        day_change = round(current_price * (day_change_percent / 100), 2)
+    for ticker, current_price, day_change, day_change_percent in zip(tickers, prices.tolist(), changes.tolist(), percents.tolist()):
+        if ticker not in instruments:
+            continue
         
         item = schemas.MarketPrice(
             ticker=ticker,
-            company_name=company_name,
+            company_name=instruments.name(ticker),
             current_price=round(current_price, 2),
             day_change=round(day_change, 2),
-            day_change_percent=day_change_percent
+            day_change_percent=round(day_change_percent, 2)
         )
         result.append(item)
     
     return result
 
-@app.get("/portfolio/{user_id}/allocation", response_model=List[schemas.PortfolioAllocationItem])
-def get_portfolio_allocation(user_id: int, db: Session = Depends(get_db)):
-    portfolio_items = calculate_portfolio_items(user_id, db)
+# Helper function to split portfolio items by value
+def build_portfolio_allocation(portfolio_items: List[schemas.PortfolioItem]):
     total_value = sum(item.total_value for item in portfolio_items)
     
     if total_value == 0:
@@ -493,42 +996,392 @@ def get_portfolio_allocation(user_id: int, db: Session = Depends(get_db)):
     result.sort(key=lambda x: x.percentage, reverse=True)
     return result
 
+@app.get("/portfolio/{user_id}/allocation", response_model=List[schemas.PortfolioAllocationItem], dependencies=[Depends(authorize_user)])
+def get_portfolio_allocation(user_id: int, db: Session = Depends(database.get_read_db), request: Request = None, response: Response = None):
+    entry = response_cache.get_or_compute(
+        user_result_key("allocation", user_id), lambda: build_portfolio_allocation(calculate_portfolio_items(user_id, db))
+    )
+    return cached_response(entry, request, response)
 
-@app.get("/portfolio/{user_id}/sectors", response_model=List[schemas.SectorBreakdownItem])
-def get_sector_breakdown(user_id: int, db: Session = Depends(get_db)):
-    # Sector mapping
-    SECTOR_MAP = {
-        "AAPL": "Technology", "MSFT": "Technology", "NVDA": "Technology",
-        "AMD": "Technology", "META": "Technology", "GOOGL": "Technology",
-        "AMZN": "Consumer", "DIS": "Consumer", "NFLX": "Consumer", "WMT": "Consumer",
-        "TSLA": "Industrial", "JPM": "Financial", "V": "Financial", "MA": "Financial", "BAC": "Financial",
-        "PG": "Consumer", "JNJ": "Healthcare", "UNH": "Healthcare"
-    }
-    
-    portfolio_items = get_portfolio(user_id, db)
+# Helper function to group portfolio items by sector
+def build_sector_breakdown(portfolio_items: List[schemas.PortfolioItem]):
     total_value = sum(item.total_value for item in portfolio_items)
     
     if total_value == 0:
         return []
     
-    sector_data = {}
-    for item in portfolio_items:
-        sector = SECTOR_MAP.get(item.ticker, "Other")
-        if sector not in sector_data:
-            sector_data[sector] = {"holdings": 0, "value": 0}
-        sector_data[sector]["holdings"] += 1
-        sector_data[sector]["value"] += item.total_value
+    # Holdings and value per sector code in one pass
+    sectors, holdings, values = instruments.sector_totals(
+        [item.ticker for item in portfolio_items], [item.total_value for item in portfolio_items]
+    )
     
     result = []
-    for sector, data in sector_data.items():
-        percentage = (data["value"] / total_value) * 100
+    for sector, count, value in zip(sectors, holdings, values):
+        percentage = (value / total_value) * 100
         result.append(schemas.SectorBreakdownItem(
             sector=sector,
-            holdings=data["holdings"],
+            holdings=count,
             percentage=round(percentage, 2),
-            total_value=round(data["value"], 2)
+            total_value=round(value, 2)
         ))
     
     # Sort by percentage descending
     result.sort(key=lambda x: x.percentage, reverse=True)
-    return result
\ No newline at end of file
+    return result
+
+@app.get("/portfolio/{user_id}/sectors", response_model=List[schemas.SectorBreakdownItem], dependencies=[Depends(authorize_user)])
+def get_sector_breakdown(user_id: int, db: Session = Depends(database.get_read_db), request: Request = None, response: Response = None):
+    entry = response_cache.get_or_compute(
+        user_result_key("sectors", user_id), lambda: build_sector_breakdown(calculate_portfolio_items(user_id, db))
+    )
+    return cached_response(entry, request, response)
+
+@app.get("/portfolio/{user_id}/performance", response_model=List[schemas.PerformanceDataPoint], dependencies=[Depends(authorize_user)])
+def get_portfolio_performance(user_id: int, db: Session = Depends(database.get_read_db), start: datetime = None, end: datetime = None,
+                              points: int = 300, method: str = "lttb"):
+    if method not in ("lttb", "bucket"):
+        raise HTTPException(status_code=400, detail="method must be 'lttb' or 'bucket'")
+    points = max(3, min(points, 5000))
+    
+    # Times are UTC; default to everything up to now
+    start_ts = int(equity.to_unix(start)) if start else 0
+    end_ts = int(equity.to_unix(end)) if end else int(time.time())
+    timestamps, values = equity.load_curve(db, user_id, start_ts, end_ts, points, method)
+    
+    result = []
+    for ts, value in zip(timestamps.tolist(), values.tolist()):
+        result.append(schemas.PerformanceDataPoint(
+            day=(ts - int(timestamps[0])) // 86400,
+            value=round(value, 2),
+            timestamp=datetime.fromtimestamp(ts, tz=timezone.utc).replace(tzinfo=None)
+        ))
+    
+    return result
+
+# --- 5. DASHBOARD (Everything the Dashboard shows, in one call) ---
+@app.get("/dashboard/{user_id}", response_model=schemas.DashboardResponse, dependencies=[Depends(authorize_user)])
+def get_dashboard(user_id: int, db: Session = Depends(database.get_read_db), history_limit: int = 5,
+                  request: Request = None, response: Response = None):
+    def compute():
+        user = load_user(user_id, db)
+        if not user:
+            raise HTTPException(status_code=404, detail="User not found")
+        
+        # Price the portfolio once and derive everything else from it
+        portfolio_items = calculate_portfolio_items(user_id, db)
+        
+        return schemas.DashboardResponse(
+            summary=build_portfolio_summary(user, portfolio_items),
+            portfolio=portfolio_items,
+            risk_metrics=build_risk_metrics(portfolio_items),
+            history=get_trade_history(user_id, db, limit=history_limit),
+            allocation=build_portfolio_allocation(portfolio_items),
+            sectors=build_sector_breakdown(portfolio_items),
+            market_prices=get_market_prices()
+        )
+    entry = response_cache.get_or_compute(user_result_key("dashboard", user_id, history_limit), compute)
+    return cached_response(entry, request, response)
+
+# --- 5b. LEADERBOARD (Accounts ranked by portfolio value) ---
+MAX_LEADERBOARD_PAGE = 100
+
+@app.get("/leaderboard", response_model=List[schemas.LeaderboardEntry], dependencies=[Depends(current_user_id)])
+def get_leaderboard(limit: int = 10):
+    return leaderboard.top(max(1, min(limit, MAX_LEADERBOARD_PAGE)))
+
+@app.get("/leaderboard/{user_id}", response_model=schemas.LeaderboardStanding, dependencies=[Depends(authorize_user)])
+def get_leaderboard_standing(user_id: int, neighbors: int = 5):
+    # The user's rank plus the accounts just above and below them
+    found = leaderboard.around(user_id, max(0, min(neighbors, MAX_LEADERBOARD_PAGE)))
+    if found is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    entry, nearby = found
+    return schemas.LeaderboardStanding(entry=entry, total_accounts=len(leaderboard), neighbors=nearby)
+
+def refresh_leaderboard():
+    """Reload the leaderboard from the database (worker thread)"""
+    with database.SessionLocal() as db:
+        leaderboard.load(db)
+
+# --- 6. LIVE UPDATES (WebSocket instead of polling) ---
+def volatility_tick():
+    """Advance the price engine one tick and publish the new prices"""
+    with metrics.tick_duration.time():
+        prices = price_engine.tick()
+        hub.publish_prices(prices)
+        
+        # Fold the tick into the current bar; finished bars are saved off the event loop
+        bar = price_history.record(list(prices), list(prices.values()), time.time())
+        if bar is not None:
+            asyncio.get_running_loop().run_in_executor(None, save_finished_bar, bar)
+        
+        # Resting orders the new prices cross are filled off the event loop
+        triggered = order_books.triggered(prices)
+        if triggered:
+            asyncio.get_running_loop().run_in_executor(None, fill_triggered_orders, triggered)
+        
+        # Re-mark every account at the new prices (or reload them all, now and then)
+        if time.monotonic() - app.state.leaderboard_loaded >= LEADERBOARD_REFRESH_SECONDS:
+            app.state.leaderboard_loaded = time.monotonic()
+            asyncio.get_running_loop().run_in_executor(None, refresh_leaderboard)
+        else:
+            asyncio.get_running_loop().run_in_executor(None, leaderboard.remark)
+
+def save_finished_bar(bar):
+    """Store a finished bar and take the equity snapshot if one is due (worker thread)"""
+    save_bar(bar)
+    equity_recorder.on_bar(bar, PRICE_BAR_SECONDS)
+
+@app.on_event("startup")
+async def start_price_stream():
+    # Sync routes run on this pool (FastAPI's default is 40 threads)
+    if os.getenv("THREADPOOL_SIZE"):
+        anyio.to_thread.current_default_thread_limiter().total_tokens = int(os.getenv("THREADPOOL_SIZE"))
+    app.state.leaderboard_loaded = time.monotonic()
+    app.state.stream_task = asyncio.create_task(hub.run(PRICE_TICK_SECONDS, on_tick=volatility_tick))
+
+@app.on_event("shutdown")
+async def stop_price_stream():
+    app.state.stream_task.cancel()
+    if trade_journal is not None:
+        # Get every acknowledged trade into the database before exiting
+        await run_in_threadpool(trade_journal.stop)
+
+@app.websocket("/ws/{user_id}")
+async def stream_updates(websocket: WebSocket, user_id: int, token: str = ""):
+    # Browsers can't set headers on a WebSocket, so the token comes as ?token=
+    try:
+        allowed = auth.decode_token(token)["user_id"] == user_id
+    except auth.InvalidToken:
+        allowed = False
+    if not allowed:
+        await websocket.close(code=1008)
+        return
+    
+    await websocket.accept()
+    subscriber = hub.subscribe(user_id)
+    # Start with a full price snapshot so the client doesn't wait a tick
+    subscriber.offer(price_engine.snapshot(), None)
+
+    async def send_updates():
+        while True:
+            for message in await subscriber.next_messages():
+                await websocket.send_json(message)
+
+    sender = asyncio.create_task(send_updates())
+    try:
+        # Clients don't send anything; this just notices when they leave
+        while True:
+            await websocket.receive_text()
+    except WebSocketDisconnect:
+        pass
+    finally:
+        sender.cancel()
+        hub.unsubscribe(subscriber)
+
+# --- 7. ASYNC MODE (DB_ASYNC=1: trade and portfolio routes on the event loop) ---
+# Each request awaits the database instead of holding one of the threadpool's
+# workers, so a process isn't capped at the pool size. The routes below reuse
+# the statements and helpers above and replace their sync versions.
+_async_ticker_locks = {}
+
+def async_lock_for(ticker: str) -> asyncio.Lock:
+    """Per-ticker queue for async trades, so only one of them at a time waits on the ticker's lock"""
+    return _async_ticker_locks.setdefault(ticker, asyncio.Lock())
+
+@asynccontextmanager
+async def ticker_lock(ticker: str):
+    """Hold price_engine.lock_for(ticker) from the event loop, the lock batch and triggered fills take too"""
+    async with async_lock_for(ticker):
+        lock = price_engine.lock_for(ticker)
+        # Waiting would block the event loop: wait on a worker thread when it's taken
+        if not lock.acquire(blocking=False):
+            try:
+                await run_in_threadpool(lock.acquire)
+            except asyncio.CancelledError:
+                # The wait can't be abandoned, so the worker holds the lock by the time the cancel lands
+                lock.release()
+                raise
+        try:
+            yield
+        finally:
+            lock.release()
+
+async def run_engine(fn, *args):
+    """Call the price engine without blocking the event loop on a DB-backed store"""
+    if isinstance(price_engine.store, price_store.DatabasePriceStore):
+        return await run_in_threadpool(fn, *args)
+    return fn(*args)
+
+async def get_user_async(db: AsyncSession, user_id: int):
+    result = await db.execute(select(models.User).where(models.User.id == user_id))
+    return result.scalars().first()
+
+async def trade_stock_async(trade: schemas.TransactionCreate, db: AsyncSession = Depends(database.get_async_db),
+                            caller_id: int = Depends(current_user_id)):
+    if trade.user_id != caller_id:
+        raise HTTPException(status_code=403, detail="Not allowed for this user")
+    
+    ticker_upper = trade.ticker.upper()
+    if trade.quantity > 0:
+        transaction_type = "BUY"
+    elif trade.quantity < 0:
+        transaction_type = "SELL"
+    else:
+        raise HTTPException(status_code=400, detail="Quantity cannot be zero")
+    require_instrument(ticker_upper)
+    
+    async with ticker_lock(ticker_upper):
+        current_price = await run_engine(price_engine.quote_impact, ticker_upper, abs(trade.quantity), transaction_type)
+        total_cost = current_price * trade.quantity
+
+        if trade.quantity > 0:
+            new_balance = (await db.execute(balance_update(trade.user_id, -total_cost, require_funds=True))).scalar()
+            if new_balance is None:
+                await db.rollback()
+                user = await get_user_async(db, trade.user_id)
+                if not user:
+                    raise HTTPException(status_code=404, detail="User not found")
+                raise HTTPException(status_code=400, detail=f"Insufficient funds. Cost: ${total_cost:.2f}, Balance: ${user.wallet_balance:.2f}")
+            
+            position = await positions.add_shares_async(db, trade.user_id, ticker_upper, trade.quantity, current_price)
+        else:
+            sell_quantity = abs(trade.quantity)
+            position = await positions.remove_shares_async(db, trade.user_id, ticker_upper, sell_quantity)
+            if position is None:
+                await db.rollback()
+                if not await get_user_async(db, trade.user_id):
+                    raise HTTPException(status_code=404, detail="User not found")
+                held = await positions.get_position_async(db, trade.user_id, ticker_upper)
+                total_owned = held.quantity if held else 0
+                raise HTTPException(
+                    status_code=400, 
+                    detail=f"Insufficient shares. You own {total_owned} shares of {ticker_upper}, but attempting to sell {sell_quantity} shares"
+                )
+
+            new_balance = (await db.execute(balance_update(trade.user_id, -total_cost))).scalar()
+
+        db.add(models.Transaction(
+            user_id=trade.user_id,
+            ticker=ticker_upper,
+            quantity=trade.quantity,
+            price_per_share=current_price,
+            type=transaction_type
+        ))
+        await db.commit()
+
+        await run_engine(apply_market_impact, ticker_upper, abs(trade.quantity), transaction_type)
+    
+    return trade_result(trade.user_id, ticker_upper, current_price, position, new_balance)
+
+async def load_user_async(user_id: int, db: AsyncSession):
+    async def fetch():
+        row = (await db.execute(
+            select(*USER_COLUMNS).where(models.User.id == user_id)
+        )).first()
+        return UserRow(*row) if row else None
+    return await response_cache.remember_async(response_cache.user_key("user", user_id), fetch)
+
+async def load_positions_async(user_id: int, db: AsyncSession):
+    async def fetch():
+        return await positions.get_open_positions_async(db, user_id)
+    return await response_cache.remember_async(response_cache.user_key("positions", user_id), fetch)
+
+async def portfolio_entry_async(user_id: int, db: AsyncSession):
+    async def compute():
+        return price_positions(await load_positions_async(user_id, db))
+    return await response_cache.get_or_compute_async(user_result_key("portfolio", user_id), compute)
+
+async def calculate_portfolio_items_async(user_id: int, db: AsyncSession):
+    return (await portfolio_entry_async(user_id, db))[0]
+
+async def get_portfolio_async(user_id: int, db: AsyncSession = Depends(database.get_async_read_db),
+                              request: Request = None, response: Response = None):
+    return cached_response(await portfolio_entry_async(user_id, db), request, response)
+
+async def get_portfolio_summary_async(user_id: int, db: AsyncSession = Depends(database.get_async_read_db),
+                                      request: Request = None, response: Response = None):
+    async def compute():
+        user = await load_user_async(user_id, db)
+        if not user:
+            raise HTTPException(status_code=404, detail="User not found")
+        
+        return build_portfolio_summary(user, await calculate_portfolio_items_async(user_id, db))
+    entry = await response_cache.get_or_compute_async(user_result_key("summary", user_id), compute)
+    return cached_response(entry, request, response)
+
+async def cached_portfolio_view_async(name: str, build, user_id: int, db: AsyncSession,
+                                      request: Request = None, response: Response = None):
+    """Serve build(priced portfolio) from the cache, as the sync routes do"""
+    async def compute():
+        return build(await calculate_portfolio_items_async(user_id, db))
+    entry = await response_cache.get_or_compute_async(user_result_key(name, user_id), compute)
+    return cached_response(entry, request, response)
+
+async def get_risk_metrics_async(user_id: int, db: AsyncSession = Depends(database.get_async_read_db),
+                                 request: Request = None, response: Response = None):
+    return await cached_portfolio_view_async("risk", build_risk_metrics, user_id, db, request, response)
+
+async def get_portfolio_allocation_async(user_id: int, db: AsyncSession = Depends(database.get_async_read_db),
+                                         request: Request = None, response: Response = None):
+    return await cached_portfolio_view_async("allocation", build_portfolio_allocation, user_id, db, request, response)
+
+async def get_sector_breakdown_async(user_id: int, db: AsyncSession = Depends(database.get_async_read_db),
+                                     request: Request = None, response: Response = None):
+    return await cached_portfolio_view_async("sectors", build_sector_breakdown, user_id, db, request, response)
+
+async def get_trade_history_async(user_id: int, db: AsyncSession = Depends(database.get_async_read_db), limit: int = 20,
+                                  cursor: str = None, response: Response = None):
+    limit = max(1, min(limit, MAX_HISTORY_PAGE))
+    transactions = (await db.execute(trade_history_query(user_id, limit, cursor))).all()
+    if response is not None and len(transactions) == limit:
+        response.headers["X-Next-Cursor"] = encode_history_cursor(transactions[-1])
+    return build_trade_history(transactions)
+
+async def get_dashboard_async(user_id: int, db: AsyncSession = Depends(database.get_async_read_db), history_limit: int = 5,
+                              request: Request = None, response: Response = None):
+    async def compute():
+        user = await load_user_async(user_id, db)
+        if not user:
+            raise HTTPException(status_code=404, detail="User not found")
+        
+        portfolio_items = await calculate_portfolio_items_async(user_id, db)
+        
+        return schemas.DashboardResponse(
+            summary=build_portfolio_summary(user, portfolio_items),
+            portfolio=portfolio_items,
+            risk_metrics=build_risk_metrics(portfolio_items),
+            history=await get_trade_history_async(user_id, db, limit=history_limit),
+            allocation=build_portfolio_allocation(portfolio_items),
+            sectors=build_sector_breakdown(portfolio_items),
+            market_prices=get_market_prices()
+        )
+    entry = await response_cache.get_or_compute_async(user_result_key("dashboard", user_id, history_limit), compute)
+    return cached_response(entry, request, response)
+
+def serve_async(path: str, method: str, endpoint, response_model=None):
+    """Replace the sync route for `path` with an async endpoint (keeping its dependencies, e.g. auth)"""
+    replaced = [
+        route for route in app.router.routes
+        if getattr(route, "path", None) == path and method in getattr(route, "methods", ())
+    ]
+    app.router.routes = [route for route in app.router.routes if route not in replaced]
+    dependencies = [dependency for route in replaced for dependency in route.dependencies]
+    app.add_api_route(path, endpoint, methods=[method], response_model=response_model, dependencies=dependencies)
+
+if database.ASYNC_MODE:
+    # Journal mode keeps the sync /trade: it never waits on the database
+    if trade_journal is None:
+        serve_async("/trade", "POST", trade_stock_async)
+    serve_async("/portfolio/{user_id}", "GET", get_portfolio_async, List[schemas.PortfolioItem])
+    serve_async("/portfolio/{user_id}/summary", "GET", get_portfolio_summary_async, schemas.PortfolioSummary)
+    serve_async("/portfolio/{user_id}/risk-metrics", "GET", get_risk_metrics_async, schemas.RiskMetrics)
+    serve_async("/portfolio/{user_id}/allocation", "GET", get_portfolio_allocation_async, List[schemas.PortfolioAllocationItem])
+    serve_async("/portfolio/{user_id}/sectors", "GET", get_sector_breakdown_async, List[schemas.SectorBreakdownItem])
+    serve_async("/trades/{user_id}/history", "GET", get_trade_history_async, List[schemas.TradeHistoryItem])
+    serve_async("/dashboard/{user_id}", "GET", get_dashboard_async, schemas.DashboardResponse)
+
+# --- 8. METRICS (Prometheus scrape endpoint) ---
+@app.get("/metrics", include_in_schema=False)
+def get_metrics():
+    return Response(metrics.render(), media_type=metrics.CONTENT_TYPE)
@@ -0,0 +1,316 @@
+"""
+Request metrics in Prometheus text format, served on GET /metrics.
+
+    http_request_duration_seconds   latency histogram per method and route template
+    http_requests_total             requests per method, route and status code
+    http_request_sql_queries        SQL statements per request, per route
+    sql_query_duration_seconds      time per SQL statement (SQLAlchemy engine events)
+    db_pool_wait_seconds            time spent waiting for a pooled connection, per pool
+    db_pool_checked_out             connections currently checked out, per pool
+    price_tick_duration_seconds     one price-engine tick (prices, bars, order matching)
+
+Everything is plain in-process counters, so each worker reports its own
+numbers (scrape every worker, or sum them in Prometheus).
+
+Profiling: with PROFILING_ENABLED=1 a request sent with `X-Profile: 1`
+runs its endpoint under cProfile and gets the top functions by cumulative
+time back as text instead of its normal body, e.g.
+
+    curl -H "X-Profile: 1" -H "Authorization: Bearer ..." localhost:8000/portfolio/1
+
+Sync endpoints are profiled in their worker thread. An async endpoint is
+profiled on the event loop thread, so the report can include other
+requests that ran while it was awaiting. Leave it off in production.
+"""
+import bisect
+import cProfile
+import contextvars
+import functools
+import inspect
+import io
+import os
+import pstats
+import threading
+import time
+from contextlib import contextmanager
+
+from fastapi.routing import APIRoute
+from sqlalchemy import event
+
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED") == "1"
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 50, 100)
+
+
+def _label_text(names, values) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(
+        '{}="{}"'.format(name, str(value).replace("\\", "\\\\").replace('"', '\\"'))
+        for name, value in zip(names, values)
+    )
+    return "{" + pairs + "}"
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labelnames=()):
+        self.name, self.help, self.labelnames = name, help, tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def inc(self, *labels, amount: float = 1.0):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_label_text(self.labelnames, labels)} {value}")
+        return lines
+
+
+class Gauge:
+    """A value read when /metrics is scraped (one reader per label set)"""
+
+    def __init__(self, name: str, help: str, read=None, labelnames=()):
+        self.name, self.help, self.labelnames = name, help, tuple(labelnames)
+        self._readers = {} if read is None else {(): read}
+
+    def add(self, read, *labels):
+        """Report read() as the sample for `labels`"""
+        self._readers[labels] = read
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        for labels, read in sorted(self._readers.items()):
+            value = read()
+            if value is not None:
+                lines.append(f"{self.name}{_label_text(self.labelnames, labels)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, buckets=LATENCY_BUCKETS, labelnames=()):
+        self.name, self.help, self.labelnames = name, help, tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._series = {}   # {labels: [bucket counts..., sum, count]}
+
+    def observe(self, value: float, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+            series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    @contextmanager
+    def time(self, *labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *labels)
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        names = self.labelnames + ("le",)
+        with self._lock:
+            for labels, series in sorted(self._series.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets + ("+Inf",), series):
+                    cumulative += count
+                    lines.append(f"{self.name}_bucket{_label_text(names, labels + (bound,))} {cumulative}")
+                label_text = _label_text(self.labelnames, labels)
+                lines.append(f"{self.name}_sum{label_text} {series[-2]}")
+                lines.append(f"{self.name}_count{label_text} {series[-1]}")
+        return lines
+
+
+request_duration = Histogram("http_request_duration_seconds", "HTTP request latency", labelnames=("method", "route"))
+requests_total = Counter("http_requests_total", "HTTP requests", labelnames=("method", "route", "status"))
+request_queries = Histogram("http_request_sql_queries", "SQL statements per HTTP request", QUERY_BUCKETS, ("method", "route"))
+query_duration = Histogram("sql_query_duration_seconds", "SQL statement execution time")
+pool_wait = Histogram("db_pool_wait_seconds", "Time spent waiting for a pooled database connection", labelnames=("pool",))
+pool_checked_out = Gauge("db_pool_checked_out", "Database connections currently checked out", labelnames=("pool",))
+tick_duration = Histogram("price_tick_duration_seconds", "Price engine tick duration")
+
+REGISTRY = [request_duration, requests_total, request_queries, query_duration, pool_wait, pool_checked_out, tick_duration]
+
+
+def render() -> str:
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# --- Per-request state (visible in the worker thread a sync endpoint runs on) ---
+
+class RequestStats:
+    __slots__ = ("queries", "query_seconds")
+
+    def __init__(self):
+        self.queries = 0
+        self.query_seconds = 0.0
+
+
+_request_stats = contextvars.ContextVar("request_stats", default=None)
+_profiler = contextvars.ContextVar("profiler", default=None)
+
+
+def instrument_engine(engine, pool: str = "primary"):
+    """Time every SQL statement and every wait for a pooled connection on `engine`
+
+    `pool` labels its pool metrics (e.g. primary, replica-0, async), so each
+    engine adds a sample to the one metric family rather than a new family.
+    """
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["query_start"].pop()
+        query_duration.observe(elapsed)
+        stats = _request_stats.get()
+        if stats is not None:
+            stats.queries += 1
+            stats.query_seconds += elapsed
+
+    @event.listens_for(engine, "handle_error")
+    def handle_error(context):
+        starts = context.connection.info.get("query_start") if context.connection is not None else None
+        if starts:
+            starts.pop()
+
+    # Connections out of this pool, counted from its checkout/checkin events
+    checked_out = [0]
+    count_lock = threading.Lock()
+
+    @event.listens_for(engine, "checkout")
+    def on_checkout(dbapi_connection, connection_record, connection_proxy):
+        with count_lock:
+            checked_out[0] += 1
+
+    @event.listens_for(engine, "checkin")
+    def on_checkin(dbapi_connection, connection_record):
+        with count_lock:
+            checked_out[0] -= 1
+
+    pool_checked_out.add(lambda: checked_out[0], pool)
+
+    # The pool has no "waiting" event, so time engine.connect(), which sessions
+    # (and AsyncEngine, through sync_engine) call for every connection they check out
+    connect = engine.connect
+
+    @functools.wraps(connect)
+    def timed_connect():
+        start = time.perf_counter()
+        try:
+            return connect()
+        finally:
+            pool_wait.observe(time.perf_counter() - start, pool)
+
+    engine.connect = timed_connect
+
+
+# --- Middleware ---
+
+class MetricsMiddleware:
+    """ASGI middleware: per-route latency, status and SQL counts, plus opt-in profiling"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        stats = RequestStats()
+        stats_token = _request_stats.set(stats)
+        profiler = None
+        if PROFILING_ENABLED and (b"x-profile", b"1") in scope.get("headers", []):
+            profiler = cProfile.Profile()
+            profiler_token = _profiler.set(profiler)
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            # A profiled request answers with its profile instead
+            if profiler is None:
+                await send(message)
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - start
+            # The route template (e.g. /portfolio/{user_id}) keeps the label count bounded
+            route = scope.get("route")
+            route_path = getattr(route, "path", "unmatched")
+            request_duration.observe(elapsed, scope["method"], route_path)
+            requests_total.inc(scope["method"], route_path, str(status))
+            request_queries.observe(stats.queries, scope["method"], route_path)
+            _request_stats.reset(stats_token)
+            if profiler is not None:
+                _profiler.reset(profiler_token)
+
+        if profiler is not None:
+            await send_profile(send, profiler, stats, status, elapsed)
+
+
+async def send_profile(send, profiler: cProfile.Profile, stats: RequestStats, status: int, elapsed: float, top: int = 40):
+    out = io.StringIO()
+    out.write(f"status {status}, {elapsed * 1000:.1f} ms, {stats.queries} SQL statements in {stats.query_seconds * 1000:.1f} ms\n\n")
+    pstats.Stats(profiler, stream=out).sort_stats("cumulative").print_stats(top)
+    body = out.getvalue().encode("utf-8")
+    await send({"type": "http.response.start", "status": 200, "headers": [
+        (b"content-type", b"text/plain; charset=utf-8"), (b"content-length", str(len(body)).encode("ascii"))
+    ]})
+    await send({"type": "http.response.body", "body": body})
+
+
+# --- Profiling hook on the endpoints themselves ---
+
+def profiled(endpoint):
+    """Wrap an endpoint so it runs under the request's profiler, if it has one"""
+    if inspect.iscoroutinefunction(endpoint):
+        @functools.wraps(endpoint)
+        async def async_wrapper(*args, **kwargs):
+            profiler = _profiler.get()
+            if profiler is None:
+                return await endpoint(*args, **kwargs)
+            profiler.enable()
+            try:
+                return await endpoint(*args, **kwargs)
+            finally:
+                profiler.disable()
+        return async_wrapper
+
+    @functools.wraps(endpoint)
+    def wrapper(*args, **kwargs):
+        profiler = _profiler.get()
+        if profiler is None:
+            return endpoint(*args, **kwargs)
+        profiler.enable()
+        try:
+            return endpoint(*args, **kwargs)
+        finally:
+            profiler.disable()
+    return wrapper
+
+
+class ProfiledRoute(APIRoute):
+    """APIRoute whose endpoint can be profiled per request (see `profiled`)"""
+
+    def __init__(self, path: str, endpoint, **kwargs):
+        super().__init__(path, profiled(endpoint) if PROFILING_ENABLED else endpoint, **kwargs)
@@ -0,0 +1,115 @@
+"""
+Schema migrations for existing databases.
+
+New tables come from the models (`create_all`), but that never changes a
+table that already exists. Those changes live in `migrations/` as
+numbered modules, each with an `upgrade(conn)` function, and this runner
+applies the ones a database hasn't had yet, in order, recording each in
+`schema_migrations`:
+
+    python migrate.py           # apply pending migrations
+    python migrate.py --list    # show applied / pending, change nothing
+
+A migration with `TRANSACTIONAL = False` runs in autocommit mode so it
+can build indexes online (CREATE INDEX CONCURRENTLY on PostgreSQL, which
+doesn't block writes to the table while it builds).
+"""
+import argparse
+import importlib
+import os
+from datetime import datetime
+
+from sqlalchemy import Column, DateTime, MetaData, String, Table, inspect, select, text
+
+import models, database
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "migrations")
+
+schema_migrations = Table(
+    "schema_migrations", MetaData(),
+    Column("version", String, primary_key=True),
+    Column("applied_at", DateTime, nullable=False),
+)
+
+
+def available_migrations():
+    """[(version, module)] for every migrations/NNNN_name.py, in order"""
+    found = []
+    for filename in sorted(os.listdir(MIGRATIONS_DIR)):
+        if filename[:4].isdigit() and filename.endswith(".py"):
+            version = filename[:-3]
+            found.append((version, importlib.import_module(f"migrations.{version}")))
+    return found
+
+
+def applied_versions(engine) -> set:
+    schema_migrations.create(engine, checkfirst=True)
+    with engine.connect() as conn:
+        return {version for (version,) in conn.execute(select(schema_migrations.c.version))}
+
+
+def run(engine=None, verbose: bool = True) -> list:
+    """Create missing tables, then apply pending migrations. Returns the versions applied."""
+    engine = engine or database.engine
+    models.Base.metadata.create_all(bind=engine)
+    done = applied_versions(engine)
+
+    applied = []
+    for version, module in available_migrations():
+        if version in done:
+            continue
+        if verbose:
+            print(f"Applying {version}: {(module.__doc__ or '').strip()}")
+
+        if getattr(module, "TRANSACTIONAL", True):
+            with engine.begin() as conn:
+                module.upgrade(conn)
+                conn.execute(schema_migrations.insert().values(version=version, applied_at=datetime.utcnow()))
+        else:
+            with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+                module.upgrade(conn)
+                conn.execute(schema_migrations.insert().values(version=version, applied_at=datetime.utcnow()))
+        applied.append(version)
+    return applied
+
+
+# --- Helpers for migration modules ---
+
+def column_exists(conn, table: str, column: str) -> bool:
+    return column in {c["name"] for c in inspect(conn).get_columns(table)}
+
+
+def create_index(conn, name: str, table: str, columns: str, unique: bool = False):
+    """Create an index if it's missing, online where the database supports it.
+
+    On PostgreSQL this must run in autocommit mode (TRANSACTIONAL = False).
+    A concurrent build that failed half-way leaves an INVALID index behind;
+    that one is dropped and rebuilt.
+    """
+    unique_sql = "UNIQUE " if unique else ""
+    if conn.dialect.name == "postgresql":
+        invalid = conn.execute(text(
+            "SELECT 1 FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid "
+            "WHERE c.relname = :name AND NOT i.indisvalid"
+        ), {"name": name}).first()
+        if invalid:
+            conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}"))
+        conn.execute(text(f"CREATE {unique_sql}INDEX CONCURRENTLY IF NOT EXISTS {name} ON {table} ({columns})"))
+    else:
+        conn.execute(text(f"CREATE {unique_sql}INDEX IF NOT EXISTS {name} ON {table} ({columns})"))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Apply database migrations")
+    parser.add_argument("--list", action="store_true", help="show migration status only")
+    args = parser.parse_args()
+
+    if args.list:
+        done = applied_versions(database.engine)
+        for version, module in available_migrations():
+            status = "applied" if version in done else "pending"
+            print(f"{version:40} {status:8} {(module.__doc__ or '').strip()}")
+        raise SystemExit(0)
+
+    applied = run()
+    print(f"Applied {len(applied)} migration(s)." if applied else "Database is up to date.")
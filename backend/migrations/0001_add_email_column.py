@@ -0,0 +1,13 @@
+"""Add the email column (and its unique index) to users"""
+from sqlalchemy import text
+
+from migrate import column_exists, create_index
+
+# The index is built online, which PostgreSQL only allows outside a transaction
+TRANSACTIONAL = False
+
+
+def upgrade(conn):
+    if not column_exists(conn, "users", "email"):
+        conn.execute(text("ALTER TABLE users ADD COLUMN email VARCHAR"))
+    create_index(conn, "ix_users_email", "users", "email", unique=True)
@@ -0,0 +1,12 @@
+"""Index transactions by (user_id, ticker) and (user_id, timestamp DESC)"""
+from migrate import create_index
+
+# Built online so a large transactions table stays writable meanwhile
+TRANSACTIONAL = False
+
+
+def upgrade(conn):
+    # Per-user/ticker aggregates (positions rebuild/verify, ownership lookups)
+    create_index(conn, "ix_transactions_user_ticker", "transactions", "user_id, ticker")
+    # Newest-first trade history
+    create_index(conn, "ix_transactions_user_timestamp", "transactions", 'user_id, "timestamp" DESC')
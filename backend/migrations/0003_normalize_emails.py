@@ -0,0 +1,19 @@
+"""Store emails trimmed and lower-cased, as login now looks them up"""
+from sqlalchemy import text
+
+
+def upgrade(conn):
+    # One account per normalized address gets it: one that already stores it
+    # that way, else the oldest. The others keep theirs as-is (reported below)
+    # and can still log in by username
+    conn.execute(text(
+        "UPDATE users SET email = LOWER(TRIM(email)) "
+        "WHERE email IS NOT NULL AND email <> LOWER(TRIM(email)) "
+        "AND NOT EXISTS (SELECT 1 FROM users other WHERE other.email = LOWER(TRIM(users.email))) "
+        "AND id = (SELECT MIN(id) FROM users u2 WHERE LOWER(TRIM(u2.email)) = LOWER(TRIM(users.email)))"
+    ))
+    skipped = conn.execute(text(
+        "SELECT id, email FROM users WHERE email IS NOT NULL AND email <> LOWER(TRIM(email)) ORDER BY id"
+    )).all()
+    for user_id, email in skipped:
+        print(f"  user {user_id}: left {email!r} as-is, another account has {email.strip().lower()!r}")
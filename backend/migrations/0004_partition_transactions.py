@@ -0,0 +1,49 @@
+"""Partition transactions by month on PostgreSQL (see compaction.py)"""
+from datetime import datetime
+
+from sqlalchemy import text
+
+import compaction
+
+
+def upgrade(conn):
+    # SQLite has no partitions: compaction.py treats months as timestamp ranges of the one table
+    if conn.dialect.name != "postgresql" or compaction.is_partitioned(conn):
+        return
+
+    this_month = compaction.month_start(datetime.utcnow())
+    first = conn.execute(text('SELECT min("timestamp") FROM transactions')).scalar() or this_month
+
+    # Rebuild as a partitioned table (its primary key has to include the partition
+    # column) and copy the log over; the id sequence carries on as it was
+    conn.execute(text("ALTER TABLE transactions RENAME TO transactions_unpartitioned"))
+    conn.execute(text("ALTER TABLE transactions_unpartitioned RENAME CONSTRAINT transactions_pkey TO transactions_unpartitioned_pkey"))
+    conn.execute(text("ALTER SEQUENCE transactions_id_seq OWNED BY NONE"))
+    conn.execute(text("""
+        CREATE TABLE transactions (
+            id integer NOT NULL DEFAULT nextval('transactions_id_seq'),
+            user_id integer REFERENCES users (id),
+            ticker varchar,
+            quantity integer,
+            price_per_share double precision,
+            type varchar,
+            "timestamp" timestamp without time zone NOT NULL,
+            PRIMARY KEY (id, "timestamp")
+        ) PARTITION BY RANGE ("timestamp")
+    """))
+    conn.execute(text(f"CREATE TABLE {compaction.DEFAULT_PARTITION} PARTITION OF transactions DEFAULT"))
+    compaction.ensure_partitions(conn, first, compaction.add_months(this_month, compaction.MONTHS_AHEAD))
+
+    # Undated trades (there shouldn't be any) are kept as the oldest, in the DEFAULT partition
+    conn.execute(text("""
+        INSERT INTO transactions (id, user_id, ticker, quantity, price_per_share, type, "timestamp")
+        SELECT id, user_id, ticker, quantity, price_per_share, type, COALESCE("timestamp", '1970-01-01')
+        FROM transactions_unpartitioned
+    """))
+    conn.execute(text("DROP TABLE transactions_unpartitioned"))
+    conn.execute(text("ALTER SEQUENCE transactions_id_seq OWNED BY transactions.id"))
+
+    # Indexes on the parent are created on every partition, current and future
+    conn.execute(text("CREATE INDEX ix_transactions_id ON transactions (id)"))
+    conn.execute(text("CREATE INDEX ix_transactions_user_ticker ON transactions (user_id, ticker)"))
+    conn.execute(text('CREATE INDEX ix_transactions_user_timestamp ON transactions (user_id, "timestamp" DESC)'))
@@ -0,0 +1,9 @@
+"""Add net_cost to position_snapshots (the cash compacted trades took, for equity backfills)"""
+from sqlalchemy import text
+
+from migrate import column_exists
+
+
+def upgrade(conn):
+    if not column_exists(conn, "position_snapshots", "net_cost"):
+        conn.execute(text("ALTER TABLE position_snapshots ADD COLUMN net_cost FLOAT NOT NULL DEFAULT 0"))
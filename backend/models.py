@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Float, ForeignKey, DateTime
+from sqlalchemy import Column, Integer, BigInteger, String, Float, ForeignKey, DateTime, UniqueConstraint, Index
 from sqlalchemy.orm import relationship
 from database import Base
 from datetime import datetime
@@ -16,6 +16,7 @@ class User(Base):
 
     # Relationship to transactions
     transactions = relationship("Transaction", back_populates="owner")
+    positions = relationship("Position", back_populates="owner")
 
 class Transaction(Base):
     __tablename__ = "transactions"
@@ -29,4 +30,131 @@ class Transaction(Base):
     timestamp = Column(DateTime, default=datetime.utcnow)
 
     # Link back to User
-    owner = relationship("User", back_populates="transactions")
\ No newline at end of file
+    owner = relationship("User", back_populates="transactions")
+
+# Hot paths: per-user/ticker aggregates and the newest-first trade history.
+# Existing databases get these from migrations/0002_transaction_indexes.py.
+Index("ix_transactions_user_ticker", Transaction.user_id, Transaction.ticker)
+Index("ix_transactions_user_timestamp", Transaction.user_id, Transaction.timestamp.desc())
+
+class Position(Base):
+    """Current holding per (user, ticker), maintained by /trade.
+
+    This is a materialized view of the transaction log so portfolio
+    endpoints don't have to re-aggregate every trade on each request.
+    Rebuild it from the log with `python positions.py`.
+    """
+    __tablename__ = "positions"
+    __table_args__ = (
+        UniqueConstraint("user_id", "ticker", name="uq_positions_user_ticker"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    ticker = Column(String, nullable=False)
+    quantity = Column(Integer, nullable=False, default=0) # Net shares held
+    cost_basis = Column(Float, nullable=False, default=0.0) # Total spent on BUYs
+    shares_bought = Column(Integer, nullable=False, default=0) # Total shares ever bought
+
+    # Link back to User
+    owner = relationship("User", back_populates="positions")
+
+
+class PriceState(Base):
+    """Per-ticker market state for the `db` price store (see price_store.py)"""
+    __tablename__ = "price_state"
+
+    slot = Column(Integer, primary_key=True, autoincrement=False) # Array index in the price engine
+    ticker = Column(String, unique=True, nullable=False)
+    base = Column(Float, nullable=False)
+    anchor = Column(Float, nullable=False) # Level moved by market impact
+    noise = Column(Float, nullable=False) # Volatility factor for the current tick
+    open_price = Column(Float, nullable=False) # Price when the session opened
+
+class MarketClock(Base):
+    """Single row holding the shared tick counter for the `db` price store"""
+    __tablename__ = "market_clock"
+
+    id = Column(Integer, primary_key=True, autoincrement=False)
+    seed = Column(BigInteger, nullable=False)
+    tick_id = Column(BigInteger, nullable=False)
+    session = Column(Integer, nullable=False) # Date ordinal of the current session
+
+
+class PriceBar(Base):
+    """OHLC bar per ticker, recorded from the price engine (see price_history.py)"""
+    __tablename__ = "price_bars"
+    __table_args__ = (
+        UniqueConstraint("ticker", "bar_time", name="uq_price_bars_ticker_time"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    ticker = Column(String, nullable=False)
+    bar_time = Column(DateTime, nullable=False) # Start of the bar (UTC)
+    open = Column(Float, nullable=False)
+    high = Column(Float, nullable=False)
+    low = Column(Float, nullable=False)
+    close = Column(Float, nullable=False)
+
+class EquitySnapshot(Base):
+    """A user's account value at a point in time (see equity.py)"""
+    __tablename__ = "equity_snapshots"
+    __table_args__ = (
+        UniqueConstraint("user_id", "ts", name="uq_equity_snapshots_user_ts"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    ts = Column(BigInteger, nullable=False) # Unix time (UTC seconds), a multiple of the snapshot interval
+    cash = Column(Float, nullable=False)
+    equity = Column(Float, nullable=False) # Cash plus holdings marked to market
+
+class Order(Base):
+    """A resting limit or stop order, filled by the matching engine when a tick crosses its price"""
+    __tablename__ = "orders"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    ticker = Column(String, nullable=False)
+    quantity = Column(Integer, nullable=False) # Positive to buy, negative to sell (like Transaction)
+    type = Column(String, nullable=False) # "BUY" or "SELL"
+    order_type = Column(String, nullable=False) # "LIMIT" or "STOP"
+    price = Column(Float, nullable=False) # Limit price, or the stop's trigger price
+    status = Column(String, nullable=False, default="OPEN") # OPEN, FILLED, CANCELLED or REJECTED
+    created_at = Column(DateTime, default=datetime.utcnow)
+    filled_at = Column(DateTime, nullable=True)
+    fill_price = Column(Float, nullable=True)
+    detail = Column(String, nullable=True) # Why a triggered order was rejected
+
+# Startup loads every open order; users list their own
+Index("ix_orders_status_ticker", Order.status, Order.ticker)
+Index("ix_orders_user_status", Order.user_id, Order.status)
+
+class JournalCheckpoint(Base):
+    """The last trade journal entry written to the database (see journal.py); a single row"""
+    __tablename__ = "journal_checkpoint"
+
+    id = Column(Integer, primary_key=True)
+    last_seq = Column(BigInteger, nullable=False, default=0)
+
+class PositionSnapshot(Base):
+    """Position per (user, ticker) from every trade before the compaction checkpoint (see compaction.py)"""
+    __tablename__ = "position_snapshots"
+    __table_args__ = (
+        UniqueConstraint("user_id", "ticker", name="uq_position_snapshots_user_ticker"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    ticker = Column(String, nullable=False)
+    quantity = Column(Integer, nullable=False, default=0)
+    cost_basis = Column(Float, nullable=False, default=0.0)
+    shares_bought = Column(Integer, nullable=False, default=0)
+    net_cost = Column(Float, nullable=False, default=0.0) # Cash the folded trades took: buys minus sells
+
+class CompactionCheckpoint(Base):
+    """Where the retained transaction log starts: older trades live in position_snapshots; a single row"""
+    __tablename__ = "compaction_checkpoint"
+
+    id = Column(Integer, primary_key=True)
+    compacted_before = Column(DateTime, nullable=False)
@@ -0,0 +1,211 @@
+"""
+Resting limit and stop orders, matched against every price tick.
+
+Each ticker keeps four binary heaps, one per kind of order, ordered so the
+order the market reaches first is on top (ties go to the older order):
+
+    buy limit    fills once price <= limit    highest limit first
+    sell limit   fills once price >= limit    lowest limit first
+    buy stop     fires once price >= stop     lowest stop first
+    sell stop    fires once price <= stop     highest stop first
+
+A tick only looks at the top of each heap and pops while it's crossed, so
+matching costs O(log n) per triggered order however many orders rest
+untouched. Cancelling marks the order dead; its heap entry is skipped when
+it surfaces, and a heap that is mostly dead entries gets rebuilt.
+
+The orders table is the source of truth: the books are loaded from it at
+startup, and a triggered order is only filled once it has been claimed
+there (OPEN -> FILLED in the fill's transaction), so a cancel racing the
+tick, or another worker holding the same order, can't fill it twice.
+
+A limit order whose own market impact would push its fill past the limit
+is parked rather than put straight back on its heap: it would otherwise
+be claimed and reopened on every tick while the price sits just inside
+the limit. It rejoins the heap once the price moves past the one it was
+tried at in the order's favour. Parked orders sit in two more heaps (buys
+and sells) keyed by that price, so a tick only pops the ones it releases.
+"""
+import heapq
+import threading
+from collections import namedtuple
+from datetime import datetime
+
+from sqlalchemy import bindparam, update
+from sqlalchemy.orm import Session
+
+import models
+
+RestingOrder = namedtuple("RestingOrder", "id user_id ticker quantity order_type price")
+
+
+def limit_price(order: RestingOrder):
+    """The worst price a triggered order may fill at (stops fill at market)"""
+    return order.price if order.order_type == "LIMIT" else None
+
+
+def _heap_side(order: RestingOrder):
+    """(heap name, sign): an order triggers once sign * price <= sign * its price"""
+    buying = order.quantity > 0
+    if order.order_type == "LIMIT":
+        return ("buy_limit", -1) if buying else ("sell_limit", 1)
+    return ("buy_stop", 1) if buying else ("sell_stop", -1)
+
+
+class TickerBook:
+    """The four heaps of resting orders for one ticker"""
+
+    SIGNS = {"buy_limit": -1, "sell_limit": 1, "buy_stop": 1, "sell_stop": -1}
+    # Parked orders, keyed by the price they were tried at: a buy is released
+    # once the price is below it, a sell once it's above (sign * price > key)
+    PARKED_SIGNS = {"buy": -1, "sell": 1}
+
+    def __init__(self):
+        self.heaps = {name: [] for name in self.SIGNS}
+        self.parked = {name: [] for name in self.PARKED_SIGNS}
+        self.dead = 0
+
+    def push(self, order: RestingOrder):
+        name, sign = _heap_side(order)
+        heapq.heappush(self.heaps[name], (sign * order.price, order.id, order))
+
+    def park(self, order: RestingOrder, tried_at: float):
+        name = "buy" if order.quantity > 0 else "sell"
+        heapq.heappush(self.parked[name], (self.PARKED_SIGNS[name] * tried_at, order.id, order))
+
+    def unpark(self, price: float, live: dict):
+        """Put back on the heaps the parked orders `price` has moved past in their favour"""
+        for name, sign in self.PARKED_SIGNS.items():
+            heap = self.parked[name]
+            while heap and heap[0][0] < sign * price:
+                _, order_id, order = heapq.heappop(heap)
+                if order_id in live:
+                    self.push(order)
+                else:
+                    self.dead -= 1
+
+    def pop_crossed(self, price: float, live: dict) -> list:
+        """Pop every live order the price crosses"""
+        self.unpark(price, live)
+        crossed = []
+        for name, sign in self.SIGNS.items():
+            heap = self.heaps[name]
+            while heap and heap[0][0] <= sign * price:
+                _, order_id, order = heapq.heappop(heap)
+                if live.pop(order_id, None) is not None:
+                    crossed.append(order)
+                else:
+                    self.dead -= 1
+        return crossed
+
+    def compact(self, live: dict):
+        """Drop cancelled entries once they make up most of the book"""
+        heaps = list(self.heaps.values()) + list(self.parked.values())
+        if self.dead * 2 <= sum(len(heap) for heap in heaps):
+            return
+        for heap in heaps:
+            heap[:] = [entry for entry in heap if entry[1] in live]
+            heapq.heapify(heap)
+        self.dead = 0
+
+
+class OrderBooks:
+    """Every ticker's resting orders, safe to use from the tick loop and request threads"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._books = {}
+        self._live = {}   # {order_id: RestingOrder} for orders still resting
+
+    def __len__(self):
+        return len(self._live)
+
+    def add(self, order: RestingOrder):
+        with self._lock:
+            self._live[order.id] = order
+            self._books.setdefault(order.ticker, TickerBook()).push(order)
+
+    def park(self, order: RestingOrder, price: float):
+        """Rest an order that just failed at `price` without matching it again until the price improves"""
+        with self._lock:
+            self._live[order.id] = order
+            self._books.setdefault(order.ticker, TickerBook()).park(order, price)
+
+    def remove(self, order_id: int):
+        """Stop matching an order (cancelled). Returns it, or None if it wasn't resting."""
+        with self._lock:
+            order = self._live.pop(order_id, None)
+            if order is not None:
+                book = self._books[order.ticker]
+                book.dead += 1
+                book.compact(self._live)
+            return order
+
+    def triggered(self, prices: dict) -> list:
+        """Pop every resting order that `prices` ({ticker: price}) crosses"""
+        crossed = []
+        with self._lock:
+            for ticker, book in self._books.items():
+                price = prices.get(ticker)
+                if price is not None:
+                    crossed.extend(book.pop_crossed(price, self._live))
+        return crossed
+
+    def load(self, db: Session):
+        """Rebuild the books from the open orders in the database"""
+        rows = db.query(
+            models.Order.id, models.Order.user_id, models.Order.ticker, models.Order.quantity,
+            models.Order.order_type, models.Order.price
+        ).filter(models.Order.status == "OPEN").order_by(models.Order.id)
+        for row in rows:
+            self.add(RestingOrder(*row))
+
+
+def resting_order(order: models.Order) -> RestingOrder:
+    return RestingOrder(order.id, order.user_id, order.ticker, order.quantity, order.order_type, order.price)
+
+
+def claim(db: Session, order_ids) -> set:
+    """Mark open orders FILLED (caller commits). Returns the ids this call claimed."""
+    if not order_ids:
+        return set()
+    claimed = db.execute(
+        update(models.Order)
+        .where(models.Order.id.in_(order_ids), models.Order.status == "OPEN")
+        .values(status="FILLED", filled_at=datetime.utcnow())
+        .returning(models.Order.id)
+        .execution_options(synchronize_session=False)
+    ).scalars().all()
+    return set(claimed)
+
+
+def settle(db: Session, orders, results, reopen_detail: str) -> list:
+    """Record how claimed orders went (caller commits).
+
+    `results` are batch_trades.run_orders results in the same order. Fills
+    keep FILLED with their price, limits whose fill would land past the
+    limit (`reopen_detail`) go back to OPEN, everything else is REJECTED.
+    Returns the orders to put back on the book.
+    """
+    filled, rejected, reopened = [], [], []
+    for order, result in zip(orders, results):
+        if result["status"] == "filled":
+            filled.append({"order_id": order.id, "fill": result["price"]})
+        elif result.get("detail") == reopen_detail:
+            reopened.append(order)
+        else:
+            rejected.append({"order_id": order.id, "reason": result.get("detail")})
+
+    # One executemany per outcome (Core statement: ORM bulk updates need the primary key as a column)
+    table = models.Order.__table__
+    by_id = table.update().where(table.c.id == bindparam("order_id"))
+    if filled:
+        db.execute(by_id.values(fill_price=bindparam("fill")), filled)
+    if rejected:
+        db.execute(by_id.values(status="REJECTED", filled_at=None, detail=bindparam("reason")), rejected)
+    if reopened:
+        db.execute(
+            update(models.Order).where(models.Order.id.in_([order.id for order in reopened]))
+            .values(status="OPEN", filled_at=None).execution_options(synchronize_session=False)
+        )
+    return reopened
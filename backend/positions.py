@@ -0,0 +1,361 @@
+"""
+Helpers for the materialized `positions` table.
+
+`/trade` keeps one row per (user, ticker) up to date in the same DB
+transaction as the trade itself, so portfolio endpoints read O(positions)
+rows instead of replaying the whole transaction log.
+
+Every read goes through one query layer: `holdings_query` over this
+table and `transaction_totals` over the log select the same columns,
+
+    user_id, ticker, net quantity, BUY cost, BUY shares
+
+grouped per (user, ticker) on the database side and returned as plain
+row tuples, never hydrated ORM objects. Once compaction.py has folded
+old months into `position_snapshots`, the log side reads those snapshot
+rows plus the trades since, not the whole history. Per-user helpers serve the
+portfolio routes, and `holdings_by_user` serves jobs that cover many
+users at once.
+
+Run this script to rebuild the table from the transaction log, or to
+check that it still matches:
+
+    python positions.py            # rebuild every user
+    python positions.py --verify   # report mismatches, change nothing
+    python positions.py --user 7   # limit to one user
+"""
+import argparse
+from collections import namedtuple
+
+from sqlalchemy import func, case, or_, select, union_all, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+import models, database
+
+# One position as the portfolio routes see it (plain tuple, safe to cache and share)
+Holding = namedtuple("Holding", "ticker quantity cost_basis shares_bought")
+
+HOLDING_COLUMNS = (models.Position.ticker, models.Position.quantity, models.Position.cost_basis, models.Position.shares_bought)
+
+# Dialects with INSERT ... ON CONFLICT, used for single-statement upserts
+_INSERTS = {"postgresql": postgresql.insert, "sqlite": sqlite.insert}
+
+
+def get_position(db: Session, user_id: int, ticker: str):
+    """Get the position row for a user/ticker (or None)"""
+    return db.query(models.Position).filter(
+        models.Position.user_id == user_id,
+        models.Position.ticker == ticker
+    ).first()
+
+
+def holdings_query(user_ids=None, tickers=None, open_only: bool = True):
+    """SELECT (user_id, ticker, quantity, cost_basis, shares_bought) from the positions table.
+
+    Every user's rows, or only `user_ids`'; every ticker or only `tickers`;
+    by default only positions with shares in them.
+    """
+    stmt = select(models.Position.user_id, *HOLDING_COLUMNS)
+    if user_ids is not None:
+        stmt = stmt.where(models.Position.user_id.in_(user_ids))
+    if tickers is not None:
+        stmt = stmt.where(models.Position.ticker.in_(tickers))
+    if open_only:
+        stmt = stmt.where(models.Position.quantity > 0)
+    return stmt
+
+
+def _open_positions_query(user_id: int):
+    return select(*HOLDING_COLUMNS).where(
+        models.Position.user_id == user_id,
+        models.Position.quantity > 0
+    )
+
+
+def get_open_positions(db: Session, user_id: int):
+    """Every position the user currently holds shares in, as Holding tuples"""
+    return [Holding(*row) for row in db.execute(_open_positions_query(user_id))]
+
+
+def holdings_by_user(db: Session, user_ids=None) -> dict:
+    """{user_id: [Holding, ...]} of open positions for many users in one query (every user if None)"""
+    grouped = {}
+    for user_id, *holding in db.execute(holdings_query(user_ids)):
+        grouped.setdefault(user_id, []).append(Holding(*holding))
+    return grouped
+
+
+def _returning(stmt):
+    return stmt.returning(
+        models.Position.quantity, models.Position.cost_basis, models.Position.shares_bought
+    ).execution_options(synchronize_session=False)
+
+
+def _upsert_shares(insert, user_id: int, ticker: str, quantity: int, cost: float, shares_bought: int):
+    # Single round trip: INSERT ... ON CONFLICT DO UPDATE
+    table = models.Position.__table__
+    stmt = insert(models.Position).values(
+        user_id=user_id, ticker=ticker, quantity=quantity, cost_basis=cost, shares_bought=shares_bought
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[table.c.user_id, table.c.ticker],
+        set_={
+            "quantity": table.c.quantity + stmt.excluded.quantity,
+            "cost_basis": table.c.cost_basis + stmt.excluded.cost_basis,
+            "shares_bought": table.c.shares_bought + stmt.excluded.shares_bought,
+        }
+    )
+    return _returning(stmt)
+
+
+def _increment_shares(user_id: int, ticker: str, quantity: int, cost: float, shares_bought: int, min_quantity: int = 0):
+    # Other databases: increment in place, insert on the first purchase
+    stmt = update(models.Position).where(
+        models.Position.user_id == user_id,
+        models.Position.ticker == ticker
+    ).values(
+        quantity=models.Position.quantity + quantity,
+        cost_basis=models.Position.cost_basis + cost,
+        shares_bought=models.Position.shares_bought + shares_bought
+    )
+    if min_quantity > 0:
+        stmt = stmt.where(models.Position.quantity >= min_quantity)
+    return _returning(stmt)
+
+
+def _decrement_shares(user_id: int, ticker: str, quantity: int):
+    stmt = update(models.Position).where(
+        models.Position.user_id == user_id,
+        models.Position.ticker == ticker,
+        models.Position.quantity >= quantity
+    ).values(quantity=models.Position.quantity - quantity)
+    return _returning(stmt)
+
+
+def add_shares(db: Session, user_id: int, ticker: str, quantity: int, price: float):
+    """Atomically add bought shares to a position (caller commits).
+
+    Returns the updated (quantity, cost_basis, shares_bought) row.
+    """
+    cost = price * quantity
+    insert = _INSERTS.get(db.get_bind().dialect.name)
+    if insert is not None:
+        return db.execute(_upsert_shares(insert, user_id, ticker, quantity, cost, quantity)).first()
+
+    row = db.execute(_increment_shares(user_id, ticker, quantity, cost, quantity)).first()
+    if row is None:
+        db.add(models.Position(user_id=user_id, ticker=ticker, quantity=quantity, cost_basis=cost, shares_bought=quantity))
+        db.flush()
+        row = (quantity, cost, quantity)
+    return row
+
+
+def remove_shares(db: Session, user_id: int, ticker: str, quantity: int):
+    """Atomically take sold shares out of a position (caller commits).
+
+    The UPDATE only matches if the user holds at least `quantity` shares, so
+    concurrent sells can't oversell. Returns the updated row, or None if
+    they don't own enough.
+    """
+    return db.execute(_decrement_shares(user_id, ticker, quantity)).first()
+
+
+def apply_delta(db: Session, user_id: int, ticker: str, quantity: int, cost: float, shares_bought: int,
+                min_quantity: int = 0) -> bool:
+    """Add a net change from several trades to a position in one statement (caller commits).
+
+    With min_quantity > 0 the UPDATE only matches if the position holds at
+    least that many shares beforehand (the most the trades sell ahead of
+    their buys). Returns the updated (quantity, cost_basis, shares_bought)
+    row, or None if it doesn't match.
+    """
+    if min_quantity > 0:
+        return db.execute(_increment_shares(user_id, ticker, quantity, cost, shares_bought, min_quantity)).first()
+
+    insert = _INSERTS.get(db.get_bind().dialect.name)
+    if insert is not None:
+        return db.execute(_upsert_shares(insert, user_id, ticker, quantity, cost, shares_bought)).first()
+    row = db.execute(_increment_shares(user_id, ticker, quantity, cost, shares_bought)).first()
+    if row is None:
+        db.add(models.Position(user_id=user_id, ticker=ticker, quantity=quantity, cost_basis=cost, shares_bought=shares_bought))
+        db.flush()
+        row = (quantity, cost, shares_bought)
+    return row
+
+
+def apply_trade(db: Session, user_id: int, ticker: str, quantity: int, price: float, transaction_type: str):
+    """Update the user's position for a trade (caller commits).
+
+    Returns the updated row, or None if a sell exceeds the shares held.
+    """
+    # Only purchases count towards average cost, same as the transaction log
+    if transaction_type == "BUY" and quantity > 0:
+        return add_shares(db, user_id, ticker, quantity, price)
+    return remove_shares(db, user_id, ticker, abs(quantity))
+
+
+# Async versions (DB_ASYNC=1), same statements on an AsyncSession
+
+async def get_position_async(db: AsyncSession, user_id: int, ticker: str):
+    result = await db.execute(select(models.Position).where(
+        models.Position.user_id == user_id,
+        models.Position.ticker == ticker
+    ))
+    return result.scalars().first()
+
+
+async def get_open_positions_async(db: AsyncSession, user_id: int):
+    return [Holding(*row) for row in await db.execute(_open_positions_query(user_id))]
+
+
+async def add_shares_async(db: AsyncSession, user_id: int, ticker: str, quantity: int, price: float):
+    cost = price * quantity
+    insert = _INSERTS.get(db.bind.dialect.name)
+    if insert is not None:
+        return (await db.execute(_upsert_shares(insert, user_id, ticker, quantity, cost, quantity))).first()
+
+    row = (await db.execute(_increment_shares(user_id, ticker, quantity, cost, quantity))).first()
+    if row is None:
+        db.add(models.Position(user_id=user_id, ticker=ticker, quantity=quantity, cost_basis=cost, shares_bought=quantity))
+        await db.flush()
+        row = (quantity, cost, quantity)
+    return row
+
+
+async def remove_shares_async(db: AsyncSession, user_id: int, ticker: str, quantity: int):
+    return (await db.execute(_decrement_shares(user_id, ticker, quantity))).first()
+
+
+def log_start(db: Session):
+    """Where the retained transaction log starts (None if nothing has been compacted)"""
+    checkpoint = db.get(models.CompactionCheckpoint, 1)
+    return checkpoint.compacted_before if checkpoint else None
+
+
+def _log_totals(user_ids=None, since=None, before=None):
+    is_buy = (models.Transaction.type == "BUY") & (models.Transaction.quantity > 0)
+    stmt = select(
+        models.Transaction.user_id.label("user_id"),
+        models.Transaction.ticker.label("ticker"),
+        func.sum(models.Transaction.quantity).label("quantity"),
+        func.sum(case((is_buy, models.Transaction.price_per_share * models.Transaction.quantity), else_=0.0)).label("cost_basis"),
+        func.sum(case((is_buy, models.Transaction.quantity), else_=0)).label("shares_bought"),
+    ).group_by(models.Transaction.user_id, models.Transaction.ticker)
+
+    if user_ids is not None:
+        stmt = stmt.where(models.Transaction.user_id.in_(user_ids))
+    if since is not None:
+        stmt = stmt.where(models.Transaction.timestamp >= since)
+    if before is not None:
+        # Undated trades count as the oldest: compaction folds them in first
+        stmt = stmt.where(or_(models.Transaction.timestamp < before, models.Transaction.timestamp.is_(None)))
+    return stmt
+
+
+def transaction_totals(user_ids=None, since=None, before=None):
+    """SELECT (user_id, ticker, net quantity, BUY cost, BUY shares) from the transaction log,
+    grouped per (user, ticker): what the positions table should hold
+
+    `since` is where the retained log starts (log_start): the position
+    snapshots stand in for everything earlier. `before` stops at a point in
+    time instead of the latest trade.
+    """
+    if since is None:
+        return _log_totals(user_ids, before=before)
+
+    snapshots = select(
+        models.PositionSnapshot.user_id, models.PositionSnapshot.ticker, models.PositionSnapshot.quantity,
+        models.PositionSnapshot.cost_basis, models.PositionSnapshot.shares_bought
+    )
+    if user_ids is not None:
+        snapshots = snapshots.where(models.PositionSnapshot.user_id.in_(user_ids))
+    both = union_all(snapshots, _log_totals(user_ids, since, before)).subquery()
+    return select(
+        both.c.user_id, both.c.ticker, func.sum(both.c.quantity), func.sum(both.c.cost_basis), func.sum(both.c.shares_bought)
+    ).group_by(both.c.user_id, both.c.ticker)
+
+
+def aggregate_transactions(db: Session, user_id: int = None):
+    """Recompute positions from the transaction log (and the snapshots of its compacted part).
+
+    Returns {(user_id, ticker): (quantity, cost_basis, shares_bought)}.
+    """
+    stmt = transaction_totals(None if user_id is None else [user_id], since=log_start(db))
+    return {
+        (uid, ticker): (int(qty or 0), float(cost or 0.0), int(shares or 0))
+        for uid, ticker, qty, cost, shares in db.execute(stmt)
+    }
+
+
+def _stored_positions(db: Session, user_id: int = None):
+    query = db.query(models.Position)
+    if user_id is not None:
+        query = query.filter(models.Position.user_id == user_id)
+    return {(p.user_id, p.ticker): p for p in query}
+
+
+def rebuild_positions(db: Session, user_id: int = None) -> int:
+    """Rebuild the positions table from the transaction log. Returns rows written."""
+    expected = aggregate_transactions(db, user_id)
+    stored = _stored_positions(db, user_id)
+
+    for key, position in stored.items():
+        if key not in expected:
+            db.delete(position)
+
+    for (uid, ticker), (qty, cost, shares) in expected.items():
+        position = stored.get((uid, ticker))
+        if position is None:
+            position = models.Position(user_id=uid, ticker=ticker)
+            db.add(position)
+        position.quantity = qty
+        position.cost_basis = cost
+        position.shares_bought = shares
+
+    db.commit()
+    return len(expected)
+
+
+def verify_positions(db: Session, user_id: int = None, tolerance: float = 0.01):
+    """Compare the positions table with the transaction log.
+
+    Returns a list of (user_id, ticker, stored, expected) tuples for every
+    row that doesn't match.
+    """
+    expected = aggregate_transactions(db, user_id)
+    stored = {
+        key: (p.quantity, p.cost_basis, p.shares_bought)
+        for key, p in _stored_positions(db, user_id).items()
+    }
+
+    mismatches = []
+    for key in sorted(set(expected) | set(stored)):
+        want = expected.get(key, (0, 0.0, 0))
+        have = stored.get(key, (0, 0.0, 0))
+        if have[0] != want[0] or have[2] != want[2] or abs(have[1] - want[1]) > tolerance:
+            mismatches.append((key[0], key[1], have, want))
+    return mismatches
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rebuild or verify the positions table")
+    parser.add_argument("--verify", action="store_true", help="only report mismatches")
+    parser.add_argument("--user", type=int, default=None, help="limit to one user id")
+    args = parser.parse_args()
+
+    models.Base.metadata.create_all(bind=database.engine)
+    db = database.SessionLocal()
+    try:
+        if args.verify:
+            mismatches = verify_positions(db, args.user)
+            for uid, ticker, have, want in mismatches:
+                print(f"user {uid} {ticker}: stored {have}, expected {want}")
+            print(f"{len(mismatches)} mismatched positions.")
+            raise SystemExit(1 if mismatches else 0)
+
+        count = rebuild_positions(db, args.user)
+        print(f"Rebuilt {count} positions from the transaction log.")
+    finally:
+        db.close()
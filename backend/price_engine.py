@@ -0,0 +1,155 @@
+"""
+Central price engine for the simulated market.
+
+Every ticker moves together once per tick: a single vectorized NumPy step
+draws the volatility for the whole universe, and reads between ticks are
+O(1) lookups into the current snapshot. Two reads in the same tick always
+agree, and a seeded engine replays the exact same price path.
+
+The noise for tick N depends only on (seed, N), and the mutable state
+lives in a PriceStore (see price_store.py). With a shared store every
+worker process derives the same tick from the wall clock and sees the
+same market.
+"""
+import threading
+import time
+from datetime import date
+
+import numpy as np
+
+from instruments import UnknownTicker
+from price_store import MemoryPriceStore, clip_anchor
+
+
+class PriceEngine:
+    """Prices for every ticker, stored in arrays indexed by ticker id"""
+
+    def __init__(self, price_ranges: dict, seed: int = None, low: float = 0.995, high: float = 1.02,
+                 store=None, tick_seconds: float = 1.0):
+        self.low = low
+        self.high = high
+        self.tick_seconds = tick_seconds
+        self.store = store or MemoryPriceStore()
+        self._lock = threading.Lock()
+        self._ticker_locks = {}
+        # Bumped whenever local prices change (ticks and trades), for caches
+        self.version = 0
+
+        tickers = list(price_ranges)
+        ranges = np.array([price_ranges[t] for t in tickers], dtype=float).reshape(-1, 2)
+        if seed is None:
+            seed = int(np.random.SeedSequence().entropy % 2**63)
+        # A shared store keeps the first worker's seed so everyone draws the same noise
+        self.seed = self.store.attach(tickers, ranges.mean(axis=1), seed)
+
+        self._load()
+        self.tick()
+
+    def _noise(self, tick_id: int):
+        def draw(count):
+            return np.random.default_rng([self.seed, tick_id]).uniform(self.low, self.high, count)
+        return draw
+
+    def _next_tick_id(self) -> int:
+        if self.store.shared:
+            # Every worker maps the same moment to the same tick
+            return int(time.time() // self.tick_seconds)
+        return self.tick_id + 1
+
+    def _load(self):
+        """Refresh the local snapshot from the store"""
+        state = self.store.load()
+        prices = np.round(state.anchor * state.noise, 2)
+        with self._lock:
+            self.tick_id = state.tick_id
+            self.tickers = state.tickers
+            self.index = {ticker: i for i, ticker in enumerate(state.tickers)}
+            self.base = state.base
+            self.noise = state.noise
+            self.open_prices = np.round(state.open_prices, 2)
+            # Swap in new arrays so concurrent readers never see a half-updated tick
+            self.prices = prices
+            self.version += 1
+
+    def _ticker_id(self, ticker: str) -> int:
+        """Get the array index for a ticker (UnknownTicker if the engine doesn't price it)"""
+        ticker_id = self.index.get(ticker)
+        if ticker_id is None:
+            raise UnknownTicker(ticker)
+        return ticker_id
+
+    def price(self, ticker: str) -> float:
+        """Current price for a ticker (constant until the next tick or trade)"""
+        ticker_id = self._ticker_id(ticker)
+        return float(self.prices[ticker_id])
+
+    def day_change(self, ticker: str):
+        """(dollar change, percent change) since the session opened"""
+        ticker_id = self._ticker_id(ticker)
+        price = self.prices[ticker_id]
+        open_price = self.open_prices[ticker_id]
+        change = float(price - open_price)
+        return change, float(change / open_price * 100) if open_price else 0.0
+
+    def day_changes(self):
+        """(tickers, prices, dollar changes, percent changes) for the whole universe, as arrays"""
+        with self._lock:
+            tickers, prices, open_prices = self.tickers, self.prices, self.open_prices
+        changes = prices - open_prices
+        percents = np.divide(changes * 100, open_prices, out=np.zeros_like(changes), where=open_prices != 0)
+        return tickers, prices, changes, percents
+
+    def snapshot(self) -> dict:
+        """{ticker: price} for the whole universe at the current tick"""
+        tickers, prices = self.tickers, self.prices
+        return dict(zip(tickers, prices.tolist()))
+
+    def tick(self) -> dict:
+        """Advance every ticker one step and return the new snapshot"""
+        tick_id = self._next_tick_id()
+        # New trading day: day change is measured from the first tick of it
+        self.store.advance(tick_id, date.today().toordinal(), self._noise(tick_id))
+        self._load()
+        return self.snapshot()
+
+    def lock_for(self, ticker: str) -> threading.Lock:
+        """Per-ticker lock that callers hold around a whole trade on that ticker"""
+        lock = self._ticker_locks.get(ticker)
+        if lock is None:
+            with self._lock:
+                lock = self._ticker_locks.setdefault(ticker, threading.Lock())
+        return lock
+
+    def _impact_factor(self, quantity: int, transaction_type: str) -> float:
+        # Market impact: buying increases price, selling decreases price
+        # Impact factor: 0.1% per share (capped at 5% per trade)
+        impact_factor = min(abs(quantity) * 0.001, 0.05)
+        return 1 + impact_factor if transaction_type == "BUY" else 1 - impact_factor
+
+    def quote_impact(self, ticker: str, quantity: int, transaction_type: str) -> float:
+        """Price a trade would fill at, without moving the market"""
+        return self.simulate_impact(ticker, quantity, transaction_type)[0]
+
+    def simulate_impact(self, ticker: str, quantity: int, transaction_type: str, anchor: float = None):
+        """(fill price, anchor afterwards) for a trade on top of `anchor`, without moving the market.
+
+        Defaults to the stored anchor; pass the previous result to price a
+        sequence of trades before any of them is applied.
+        """
+        ticker_id = self._ticker_id(ticker)
+        if anchor is None:
+            anchor = self.store.anchor(ticker_id)
+        anchor = clip_anchor(anchor * self._impact_factor(quantity, transaction_type), self.base[ticker_id])
+        return float(np.round(anchor * self.noise[ticker_id], 2)), anchor
+
+    def apply_impact(self, ticker: str, quantity: int, transaction_type: str) -> float:
+        """Move a ticker for a trade and return its new price"""
+        ticker_id = self._ticker_id(ticker)
+        anchor = self.store.impact(ticker_id, self._impact_factor(quantity, transaction_type))
+
+        with self._lock:
+            prices = self.prices.copy()
+            prices[ticker_id] = np.round(anchor * self.noise[ticker_id], 2)
+            self.prices = prices
+            self.version += 1
+            return float(prices[ticker_id])
@@ -0,0 +1,177 @@
+"""
+Per-ticker price history as OHLC bars.
+
+The stream loop hands every tick's snapshot to `PriceHistory.record`,
+which folds it into the current bar with a few vectorized NumPy ops. When
+a tick lands in a new bar the finished one is returned for saving to the
+`price_bars` table and appended to an in-memory window of recent bars,
+which is what the risk metrics read. On startup the window is reloaded
+from the table.
+
+Bars are keyed by (ticker, bar start), and saving ignores bars that are
+already stored, so several workers sharing one market can all record.
+Each bar keeps its own ticker list, and columns are always matched by
+ticker, never by position: the universe (instruments.py) or a store's
+ticker order can change between bars, or between a bar and the reload.
+"""
+import threading
+from collections import deque, namedtuple
+from datetime import datetime, timezone
+
+import numpy as np
+from sqlalchemy import func
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
+
+import models, database
+
+Bar = namedtuple("Bar", "bar_time tickers open high low close")
+
+# Dialects that can skip duplicate bars in the INSERT itself
+_INSERTS = {"postgresql": postgresql.insert, "sqlite": sqlite.insert}
+
+
+class PriceHistory:
+    """The bar being built plus the last `lookback` finished bars"""
+
+    def __init__(self, bar_seconds: float = 60.0, lookback: int = 500):
+        self.bar_seconds = bar_seconds
+        self._lock = threading.Lock()
+        self._window = deque(maxlen=lookback)
+        self._current = None
+        self._matrix = None
+
+    def _bar_start(self, timestamp: float) -> datetime:
+        start = timestamp // self.bar_seconds * self.bar_seconds
+        return datetime.fromtimestamp(start, tz=timezone.utc).replace(tzinfo=None)
+
+    def record(self, tickers: list, prices, timestamp: float):
+        """Add one tick for every ticker. Returns the bar it finished, if any."""
+        prices = np.asarray(prices, dtype=float)
+        bar_time = self._bar_start(timestamp)
+        with self._lock:
+            current = self._current
+            if current is not None and current.bar_time == bar_time:
+                if current.tickers != list(tickers):
+                    current = self._current = _realign(current, list(tickers), prices)
+                np.maximum(current.high, prices, out=current.high)
+                np.minimum(current.low, prices, out=current.low)
+                current.close[:] = prices
+                return None
+
+            if current is not None:
+                self._window.append(current)
+                self._matrix = None
+            self._current = Bar(bar_time, list(tickers), prices.copy(), prices.copy(), prices.copy(), prices.copy())
+            return current
+
+    def window(self):
+        """(latest bar time, tickers, closes[bars, tickers]) for the finished bars.
+
+        Columns are the latest bar's tickers; older bars are matched to them
+        by name, and a ticker an older bar doesn't have is NaN there. The
+        matrix is rebuilt once per bar and shared by every caller.
+        """
+        with self._lock:
+            if self._matrix is None:
+                bars = list(self._window)
+                tickers = bars[-1].tickers if bars else []
+                columns = {ticker: i for i, ticker in enumerate(tickers)}
+                closes = np.full((len(bars), len(tickers)), np.nan)
+                for row, bar in enumerate(bars):
+                    if bar.tickers == tickers:
+                        closes[row] = bar.close
+                        continue
+                    for ticker, close in zip(bar.tickers, bar.close):
+                        column = columns.get(ticker)
+                        if column is not None:
+                            closes[row, column] = close
+                self._matrix = (bars[-1].bar_time if bars else None, tickers, closes)
+            return self._matrix
+
+    def load(self, db):
+        """Fill the window from the most recent stored bars"""
+        times = [t for (t,) in db.query(models.PriceBar.bar_time).distinct()
+                 .order_by(models.PriceBar.bar_time.desc()).limit(self._window.maxlen)]
+        if not times:
+            return
+        rows = db.query(
+            models.PriceBar.bar_time, models.PriceBar.ticker, models.PriceBar.open,
+            models.PriceBar.high, models.PriceBar.low, models.PriceBar.close
+        ).filter(models.PriceBar.bar_time >= min(times)).order_by(models.PriceBar.bar_time, models.PriceBar.id).all()
+
+        bars = {}
+        for bar_time, ticker, *ohlc in rows:
+            bars.setdefault(bar_time, []).append((ticker, ohlc))
+        with self._lock:
+            self._window.clear()
+            for bar_time in sorted(bars):
+                tickers = [ticker for ticker, _ in bars[bar_time]]
+                ohlc = np.array([values for _, values in bars[bar_time]], dtype=float).T
+                self._window.append(Bar(bar_time, tickers, *ohlc))
+            self._matrix = None
+
+
+def last_known_prices(db, tickers) -> dict:
+    """{ticker: last stored price} for tickers the engine no longer prices (e.g. dropped from the universe).
+
+    The last bar's close, else the last trade's price, else the average
+    cost of the positions in it: never a made-up default.
+    """
+    tickers = set(tickers)
+    if not tickers:
+        return {}
+    latest = db.query(models.PriceBar.ticker, func.max(models.PriceBar.bar_time).label("bar_time")).filter(
+        models.PriceBar.ticker.in_(tickers)
+    ).group_by(models.PriceBar.ticker).subquery()
+    prices = dict(db.query(models.PriceBar.ticker, models.PriceBar.close).join(
+        latest, (models.PriceBar.ticker == latest.c.ticker) & (models.PriceBar.bar_time == latest.c.bar_time)
+    ))
+    for ticker in tickers - set(prices):
+        last_trade = db.query(models.Transaction.price_per_share).filter(models.Transaction.ticker == ticker).order_by(
+            models.Transaction.timestamp.desc(), models.Transaction.id.desc()
+        ).first()
+        if last_trade is not None:
+            prices[ticker] = last_trade[0]
+    missing = tickers - set(prices)
+    if missing:
+        for ticker, cost, shares in db.query(
+            models.Position.ticker, func.sum(models.Position.cost_basis), func.sum(models.Position.shares_bought)
+        ).filter(models.Position.ticker.in_(missing)).group_by(models.Position.ticker):
+            if shares:
+                prices[ticker] = round(cost / shares, 2)
+    return prices
+
+
+def _realign(bar: Bar, tickers: list, prices) -> Bar:
+    """`bar` with its columns in `tickers` order; tickers new to it start their bar at `prices`"""
+    columns = {ticker: i for i, ticker in enumerate(bar.tickers)}
+    source = np.array([columns.get(ticker, -1) for ticker in tickers], dtype=int)
+    known = source >= 0
+    arrays = []
+    for values in bar[2:]:
+        aligned = prices.copy()
+        aligned[known] = values[source[known]]
+        arrays.append(aligned)
+    return Bar(bar.bar_time, tickers, *arrays)
+
+
+def save_bar(bar: Bar, session_factory=None):
+    """Write a finished bar to price_bars (bars another worker already saved are skipped)"""
+    db = (session_factory or database.SessionLocal)()
+    try:
+        rows = [
+            {"ticker": ticker, "bar_time": bar.bar_time, "open": float(o), "high": float(h), "low": float(l), "close": float(c)}
+            for ticker, o, h, l, c in zip(bar.tickers, bar.open, bar.high, bar.low, bar.close)
+        ]
+        insert = _INSERTS.get(db.get_bind().dialect.name)
+        try:
+            if insert is not None:
+                db.execute(insert(models.PriceBar).on_conflict_do_nothing(index_elements=["ticker", "bar_time"]), rows)
+            else:
+                db.bulk_insert_mappings(models.PriceBar, rows)
+            db.commit()
+        except IntegrityError:
+            db.rollback()
+    finally:
+        db.close()
@@ -0,0 +1,347 @@
+"""
+Where the price engine keeps market state that every worker must agree on.
+
+The engine only needs a few arrays per ticker (base, anchor level moved
+by market impact, the current tick's noise and the session open) plus a
+tick counter. A store holds those and does the two writes atomically:
+advancing to a new tick and the read-modify-write of market impact.
+
+Backends (pick one with PRICE_STORE):
+
+    memory  process-local arrays; fine for a single worker (default)
+    shm     a memory-mapped file shared by every worker on one host
+            (PRICE_STORE_PATH, Unix only since it locks with fcntl)
+    db      rows in the app database, for workers on several hosts
+"""
+import os
+import tempfile
+import threading
+from abc import ABC, abstractmethod
+from collections import namedtuple
+from contextlib import contextmanager
+
+import numpy as np
+from sqlalchemy import case, update
+from sqlalchemy.exc import IntegrityError
+
+import models, database
+
+MarketState = namedtuple("MarketState", "tick_id session tickers base anchor noise open_prices")
+
+
+def clip_anchor(anchor, base):
+    """Ensure price doesn't go below 50% of base or above 200% of base"""
+    return max(base * 0.5, min(anchor, base * 2.0))
+
+
+class PriceStore(ABC):
+    """Interface the price engine talks to (a store missing any of these can't be created)"""
+
+    # True when other processes see the same state (the engine then derives
+    # tick ids from the wall clock so every worker lands on the same tick)
+    shared = False
+
+    @abstractmethod
+    def attach(self, tickers: list, base: np.ndarray, seed: int) -> int:
+        """Create state for the universe if the store is empty. Returns the seed everyone uses."""
+
+    @abstractmethod
+    def add_ticker(self, ticker: str, base: float) -> int:
+        """Get the slot for a ticker, adding it if it's new"""
+
+    @abstractmethod
+    def load(self) -> MarketState:
+        """Copy of the whole market state"""
+
+    @abstractmethod
+    def advance(self, tick_id: int, session: int, noise_fn) -> None:
+        """Move to `tick_id` if the store is behind it.
+
+        noise_fn(n) returns the tick's noise for n tickers; it's deterministic,
+        so two workers racing to advance write identical values. A new
+        session resets the open prices.
+        """
+
+    @abstractmethod
+    def anchor(self, slot: int) -> float:
+        """Current anchor level of a ticker"""
+
+    @abstractmethod
+    def impact(self, slot: int, factor: float) -> float:
+        """Atomically multiply a ticker's anchor by `factor` (clipped). Returns the new anchor."""
+
+
+class MemoryPriceStore(PriceStore):
+    """Process-local arrays guarded by a thread lock"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+
+    def attach(self, tickers, base, seed):
+        with self._lock:
+            self.seed = seed
+            self.tickers = list(tickers)
+            self.base = np.asarray(base, dtype=float).copy()
+            self.anchor_levels = self.base.copy()
+            self.noise = np.ones(len(self.tickers))
+            self.open_prices = self.base.copy()
+            self.tick_id = -1
+            self.session = 0
+        return seed
+
+    def add_ticker(self, ticker, base):
+        with self._lock:
+            if ticker in self.tickers:
+                return self.tickers.index(ticker)
+            self.tickers.append(ticker)
+            self.base = np.append(self.base, base)
+            self.anchor_levels = np.append(self.anchor_levels, base)
+            self.noise = np.append(self.noise, 1.0)
+            self.open_prices = np.append(self.open_prices, base)
+            return len(self.tickers) - 1
+
+    def load(self):
+        with self._lock:
+            return MarketState(self.tick_id, self.session, list(self.tickers), self.base.copy(),
+                               self.anchor_levels.copy(), self.noise.copy(), self.open_prices.copy())
+
+    def advance(self, tick_id, session, noise_fn):
+        with self._lock:
+            if tick_id <= self.tick_id:
+                return
+            self.noise = noise_fn(len(self.tickers))
+            if session != self.session:
+                self.open_prices = self.anchor_levels * self.noise
+            self.tick_id = tick_id
+            self.session = session
+
+    def anchor(self, slot):
+        return float(self.anchor_levels[slot])
+
+    def impact(self, slot, factor):
+        with self._lock:
+            self.anchor_levels[slot] = clip_anchor(self.anchor_levels[slot] * factor, self.base[slot])
+            return float(self.anchor_levels[slot])
+
+
+class SharedMemoryPriceStore(PriceStore):
+    """Fixed-capacity arrays in a memory-mapped file.
+
+    Layout: an int64 header [tick_id, count, session, seed, initialized],
+    then `capacity` 16-byte ticker names, then base/anchor/noise/open as
+    float64[capacity]. Writers take an exclusive flock (plus a thread lock,
+    since flock doesn't separate threads sharing one file descriptor).
+    """
+
+    shared = True
+    HEADER = 5
+    NAME_SIZE = 16
+
+    def __init__(self, path: str, capacity: int = 4096):
+        import fcntl
+        self._fcntl = fcntl
+        self._thread_lock = threading.Lock()
+        self.capacity = capacity
+
+        header_bytes = self.HEADER * 8
+        names_bytes = capacity * self.NAME_SIZE
+        size = header_bytes + names_bytes + 4 * capacity * 8
+
+        self._file = open(path, "a+b")
+        with self._locked():
+            if os.path.getsize(path) < size:
+                self._file.truncate(size)
+
+        mm = np.memmap(path, dtype=np.uint8, mode="r+", shape=(size,))
+        self._mm = mm
+        self.header = mm[:header_bytes].view(np.int64)
+        self.names = mm[header_bytes:header_bytes + names_bytes].view(f"S{self.NAME_SIZE}")
+        arrays = mm[header_bytes + names_bytes:].view(np.float64).reshape(4, capacity)
+        self.base, self.anchor_levels, self.noise, self.open_prices = arrays
+
+    @contextmanager
+    def _locked(self, shared: bool = False):
+        with self._thread_lock:
+            self._fcntl.flock(self._file.fileno(), self._fcntl.LOCK_SH if shared else self._fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                self._fcntl.flock(self._file.fileno(), self._fcntl.LOCK_UN)
+
+    def _slots(self):
+        return {name.decode(): slot for slot, name in enumerate(self.names[:int(self.header[1])])}
+
+    def _add(self, ticker, base):
+        count = int(self.header[1])
+        if count >= self.capacity:
+            raise ValueError(f"Shared price store is full ({self.capacity} tickers)")
+        self.names[count] = ticker.encode()
+        self.base[count] = self.anchor_levels[count] = self.open_prices[count] = base
+        self.noise[count] = 1.0
+        self.header[1] = count + 1
+        return count
+
+    def attach(self, tickers, base, seed):
+        with self._locked():
+            if not self.header[4]:
+                self.header[:] = [-1, 0, 0, seed, 1]
+            known = self._slots()
+            for ticker, ticker_base in zip(tickers, base):
+                if ticker not in known:
+                    known[ticker] = self._add(ticker, float(ticker_base))
+            self._mm.flush()
+            return int(self.header[3])
+
+    def add_ticker(self, ticker, base):
+        with self._locked():
+            slot = self._slots().get(ticker)
+            return slot if slot is not None else self._add(ticker, base)
+
+    def load(self):
+        with self._locked(shared=True):
+            count = int(self.header[1])
+            tickers = [name.decode() for name in self.names[:count]]
+            return MarketState(int(self.header[0]), int(self.header[2]), tickers, self.base[:count].copy(),
+                               self.anchor_levels[:count].copy(), self.noise[:count].copy(), self.open_prices[:count].copy())
+
+    def advance(self, tick_id, session, noise_fn):
+        with self._locked():
+            if tick_id <= self.header[0]:
+                return
+            count = int(self.header[1])
+            self.noise[:count] = noise_fn(count)
+            if session != self.header[2]:
+                self.open_prices[:count] = self.anchor_levels[:count] * self.noise[:count]
+            self.header[0] = tick_id
+            self.header[2] = session
+
+    def anchor(self, slot):
+        return float(self.anchor_levels[slot])
+
+    def impact(self, slot, factor):
+        with self._locked():
+            self.anchor_levels[slot] = clip_anchor(self.anchor_levels[slot] * factor, self.base[slot])
+            return float(self.anchor_levels[slot])
+
+
+class DatabasePriceStore(PriceStore):
+    """Market state in the `price_state` / `market_clock` tables.
+
+    Impact is a single UPDATE ... RETURNING and ticks advance with a
+    compare-and-set on market_clock.tick_id, so any number of workers on
+    any number of hosts can share one market.
+    """
+
+    shared = True
+
+    def __init__(self, session_factory=None):
+        self.session_factory = session_factory or database.SessionLocal
+
+    @contextmanager
+    def _session(self):
+        db = self.session_factory()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    def _add(self, db, ticker, base):
+        row = db.query(models.PriceState).filter(models.PriceState.ticker == ticker).first()
+        while row is None:
+            slot = db.query(models.PriceState).count()
+            try:
+                db.add(models.PriceState(slot=slot, ticker=ticker, base=base, anchor=base, noise=1.0, open_price=base))
+                db.commit()
+                return slot
+            except IntegrityError:
+                # Another worker took this slot (or ticker) first
+                db.rollback()
+                row = db.query(models.PriceState).filter(models.PriceState.ticker == ticker).first()
+        return row.slot
+
+    def attach(self, tickers, base, seed):
+        with self._session() as db:
+            try:
+                db.add(models.MarketClock(id=1, seed=seed, tick_id=-1, session=0))
+                db.commit()
+            except IntegrityError:
+                db.rollback()
+            for ticker, ticker_base in zip(tickers, base):
+                self._add(db, ticker, float(ticker_base))
+            return db.query(models.MarketClock.seed).filter(models.MarketClock.id == 1).scalar()
+
+    def add_ticker(self, ticker, base):
+        with self._session() as db:
+            return self._add(db, ticker, base)
+
+    def load(self):
+        with self._session() as db:
+            tick_id, session = db.query(models.MarketClock.tick_id, models.MarketClock.session).filter(
+                models.MarketClock.id == 1
+            ).one()
+            rows = db.query(
+                models.PriceState.ticker, models.PriceState.base, models.PriceState.anchor,
+                models.PriceState.noise, models.PriceState.open_price
+            ).order_by(models.PriceState.slot).all()
+        tickers = [row[0] for row in rows]
+        columns = np.array([row[1:] for row in rows], dtype=float).reshape(-1, 4).T
+        return MarketState(tick_id, session, tickers, *columns)
+
+    def advance(self, tick_id, session, noise_fn):
+        with self._session() as db:
+            current_tick, current_session = db.query(models.MarketClock.tick_id, models.MarketClock.session).filter(
+                models.MarketClock.id == 1
+            ).one()
+            if tick_id <= current_tick:
+                return
+
+            # Compare-and-set: only the worker that moves the clock writes the tick
+            won = db.execute(
+                update(models.MarketClock)
+                .where(models.MarketClock.id == 1, models.MarketClock.tick_id == current_tick)
+                .values(tick_id=tick_id, session=session)
+            ).rowcount
+            if not won:
+                db.rollback()
+                return
+
+            slots = [slot for (slot,) in db.query(models.PriceState.slot).order_by(models.PriceState.slot)]
+            noise = noise_fn(len(slots))
+            db.execute(update(models.PriceState), [
+                {"slot": slot, "noise": float(n)} for slot, n in zip(slots, noise)
+            ])
+            if session != current_session:
+                db.execute(update(models.PriceState).values(
+                    open_price=models.PriceState.anchor * models.PriceState.noise
+                ))
+            db.commit()
+
+    def anchor(self, slot):
+        with self._session() as db:
+            return db.query(models.PriceState.anchor).filter(models.PriceState.slot == slot).scalar()
+
+    def impact(self, slot, factor):
+        new_anchor = models.PriceState.anchor * factor
+        floor, ceiling = models.PriceState.base * 0.5, models.PriceState.base * 2.0
+        with self._session() as db:
+            anchor = db.execute(
+                update(models.PriceState)
+                .where(models.PriceState.slot == slot)
+                .values(anchor=case((new_anchor < floor, floor), (new_anchor > ceiling, ceiling), else_=new_anchor))
+                .returning(models.PriceState.anchor)
+            ).scalar()
+            db.commit()
+            return anchor
+
+
+def create_store(kind: str = None) -> PriceStore:
+    """Build the store named by `kind` (or the PRICE_STORE env var)"""
+    kind = (kind or os.getenv("PRICE_STORE", "memory")).lower()
+    if kind == "memory":
+        return MemoryPriceStore()
+    if kind == "shm":
+        path = os.getenv("PRICE_STORE_PATH", os.path.join(tempfile.gettempdir(), "tradex_prices.mmap"))
+        return SharedMemoryPriceStore(path)
+    if kind == "db":
+        return DatabasePriceStore()
+    raise ValueError(f"Unknown PRICE_STORE {kind!r} (expected memory, shm or db)")
@@ -0,0 +1,194 @@
+"""
+Offline market replay: run a recorded stream of orders and price ticks
+through the trading rules at full speed, without HTTP or a database.
+
+    python replay.py orders.ndjson                          # one scenario
+    python replay.py a.ndjson b.ndjson --seeds 1 2 3 --workers 4 --output report.json
+    python replay.py --generate 1000000 --users 200 --output orders.ndjson
+
+A stream file has one JSON object per line:
+
+    {"user_id": 7, "ticker": "AAPL", "quantity": 10}    an order (negative quantity sells)
+    {"tick": true}                                      the market moves one tick
+
+Orders are filled like /trade: the same listed-ticker, funds and shares
+checks (batch_trades.run_orders) and the same market impact, each order
+trading on top of the previous one's impact (PriceEngine.simulate_impact,
+the step apply_market_impact takes). Ticks come from a seeded price
+engine, so a scenario replays the same price path every time. Users
+start with --balance cash and no positions the first time they appear.
+
+Every (file, seed) pair is an independent scenario, and scenarios run in
+parallel on a pool of --workers processes. The report has per-scenario
+throughput, final balances and positions, and the price path of each
+ticker the stream traded (one close per tick).
+"""
+import argparse
+import json
+import os
+import random
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from batch_trades import BatchState, run_orders
+from instruments import INSTRUMENTS_FILE, InstrumentRegistry
+from price_engine import PriceEngine
+from price_store import MemoryPriceStore
+
+Order = namedtuple("Order", "user_id ticker quantity")
+Scenario = namedtuple("Scenario", "path seed balance instruments_file")
+
+# Orders run through run_orders together between ticks, at most this many at a time
+CHUNK_ORDERS = 10000
+
+
+def read_stream(path: str):
+    """Yield lists of orders, and None for each tick, in file order"""
+    orders = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            event = json.loads(line)
+            if event.get("tick"):
+                if orders:
+                    yield orders
+                    orders = []
+                yield None
+                continue
+            orders.append(Order(int(event["user_id"]), event["ticker"], int(event["quantity"])))
+            if len(orders) >= CHUNK_ORDERS:
+                yield orders
+                orders = []
+    if orders:
+        yield orders
+
+
+class Replay:
+    """One scenario's market, balances and positions, all in memory"""
+
+    def __init__(self, instruments: InstrumentRegistry, seed: int, balance: float):
+        self.instruments = instruments
+        self.balance = balance
+        self.store = MemoryPriceStore()
+        self.engine = PriceEngine(instruments.price_ranges(), seed=seed, store=self.store)
+        self.state = BatchState({}, {})
+        self.filled = self.rejected = 0
+        self.closes = []     # the engine's price array after each tick
+        self.traded = set()
+
+    def run_chunk(self, orders):
+        for order in orders:
+            if order.user_id not in self.state.balances:
+                self.state.balances[order.user_id] = self.balance
+        self.state.anchors = {}
+        fills, results = run_orders(self.state, enumerate(orders), self.engine.simulate_impact, listed=self.instruments)
+        self.filled += len(fills)
+        self.rejected += len(results) - len(fills)
+
+        # The chained anchors are where applying each fill's impact in turn leaves the market
+        for ticker, anchor in self.state.anchors.items():
+            self.store.anchor_levels[self.engine.index[ticker]] = anchor
+        self.traded.update(self.state.anchors)
+
+    def tick(self):
+        self.engine.tick()
+        # The engine swaps in a new array each tick, so keeping a reference is enough
+        self.closes.append(self.engine.prices)
+
+    def price_paths(self) -> dict:
+        """{ticker: [close per tick..., price the last orders left]} for every ticker traded"""
+        final = np.round(self.store.anchor_levels * self.engine.noise, 2)
+        closes = np.vstack(self.closes + [final])
+        return {ticker: closes[:, self.engine.index[ticker]].tolist() for ticker in sorted(self.traded)}
+
+    def report(self) -> dict:
+        positions = {}
+        for (user_id, ticker), (quantity, cost_basis, shares_bought) in self.state.holdings.items():
+            if quantity:
+                positions.setdefault(str(user_id), {})[ticker] = {
+                    "quantity": quantity,
+                    "average_cost": round(cost_basis / shares_bought, 2) if shares_bought else 0.0,
+                }
+        return {
+            "filled": self.filled,
+            "rejected": self.rejected,
+            "ticks": len(self.closes),
+            "balances": {str(user_id): round(balance, 2) for user_id, balance in sorted(self.state.balances.items())},
+            "positions": positions,
+            "price_paths": self.price_paths(),
+        }
+
+
+def run_scenario(scenario: Scenario) -> dict:
+    """Replay one stream file with one seed (runs in a pool process)"""
+    replay = Replay(InstrumentRegistry.load(scenario.instruments_file), scenario.seed, scenario.balance)
+    started = time.perf_counter()
+    orders = 0
+    for chunk in read_stream(scenario.path):
+        if chunk is None:
+            replay.tick()
+        else:
+            replay.run_chunk(chunk)
+            orders += len(chunk)
+    elapsed = time.perf_counter() - started
+
+    report = {"file": scenario.path, "seed": scenario.seed, "orders": orders, "seconds": round(elapsed, 3),
+              "orders_per_second": round(orders / elapsed) if elapsed else None}
+    report.update(replay.report())
+    return report
+
+
+def generate(path: str, count: int, users: int, tick_every: int, instruments: InstrumentRegistry, seed: int = 0):
+    """Write a random stream: small buys and sells, with a tick every `tick_every` orders"""
+    rng = random.Random(seed)
+    with open(path, "w", encoding="utf-8") as f:
+        for i in range(count):
+            if tick_every and i and i % tick_every == 0:
+                f.write('{"tick": true}\n')
+            quantity = rng.choice([1, 1, -1]) * rng.randint(1, 20)
+            f.write(json.dumps({"user_id": rng.randint(1, users), "ticker": rng.choice(instruments.tickers), "quantity": quantity}) + "\n")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("files", nargs="*", help="order stream files, one scenario each (per seed)")
+    parser.add_argument("--seeds", type=int, nargs="+", default=[0], help="price engine seeds to run each file with")
+    parser.add_argument("--balance", type=float, default=10000.0, help="starting cash per user")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="processes to run scenarios on")
+    parser.add_argument("--instruments", default=INSTRUMENTS_FILE, help="instruments file (default INSTRUMENTS_FILE)")
+    parser.add_argument("--output", default=None, help="write the JSON report (or, with --generate, the stream) here")
+    parser.add_argument("--generate", type=int, default=None, help="write a random stream of this many orders instead")
+    parser.add_argument("--users", type=int, default=100, help="users in a generated stream")
+    parser.add_argument("--tick-every", type=int, default=1000, help="orders between ticks in a generated stream")
+    args = parser.parse_args()
+
+    if args.generate:
+        if not args.output:
+            parser.error("--generate needs --output")
+        generate(args.output, args.generate, args.users, args.tick_every, InstrumentRegistry.load(args.instruments), args.seeds[0])
+        raise SystemExit(0)
+    if not args.files:
+        parser.error("give at least one stream file")
+
+    scenarios = [Scenario(path, seed, args.balance, args.instruments) for path in args.files for seed in args.seeds]
+    started = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=min(args.workers, len(scenarios))) as pool:
+        results = list(pool.map(run_scenario, scenarios))
+    elapsed = time.perf_counter() - started
+
+    total = sum(result["orders"] for result in results)
+    text = json.dumps({
+        "scenarios": len(results),
+        "orders": total,
+        "seconds": round(elapsed, 3),
+        "orders_per_minute": round(total / elapsed * 60) if elapsed else None,
+        "results": results,
+    }, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
@@ -0,0 +1,105 @@
+"""
+Portfolio risk metrics from the recorded price bars (see price_history.py).
+
+All the math is NumPy over the window's return matrix (bars x tickers):
+the portfolio's return series is one matrix-vector product, and the
+market is an equal-weight index of the listed companies.
+
+    volatility    annualized standard deviation of portfolio returns (%)
+    beta          cov(portfolio, index) / var(index)
+    sharpe        annualized mean excess return / volatility
+    max drawdown  worst fall from a running peak of the equity curve (%)
+
+Holdings are weighted at the latest bar close, so a result only depends on
+the window and the holdings. It's cached on both and recomputed when a new
+bar finishes or the user trades, not on every dashboard refresh.
+"""
+import os
+import threading
+
+import numpy as np
+
+# Each bar counts as one trading day of the simulated market
+PERIODS_PER_YEAR = float(os.getenv("RISK_PERIODS_PER_YEAR", "252"))
+RISK_FREE_RATE = float(os.getenv("RISK_FREE_RATE", "0.0"))
+
+# Fewest returns worth computing statistics over
+MIN_RETURNS = 2
+
+
+def bar_returns(closes: np.ndarray) -> np.ndarray:
+    """Simple returns between consecutive bars; 0 where a ticker has no price yet"""
+    with np.errstate(invalid="ignore", divide="ignore"):
+        returns = closes[1:] / closes[:-1] - 1.0
+    return np.nan_to_num(returns, nan=0.0, posinf=0.0, neginf=0.0)
+
+
+def compute_metrics(returns: np.ndarray, weights: np.ndarray, index_weights: np.ndarray,
+                    periods_per_year: float = PERIODS_PER_YEAR, risk_free_rate: float = RISK_FREE_RATE) -> dict:
+    """Risk metrics for fixed `weights` over a (bars x tickers) return matrix"""
+    portfolio = returns @ weights
+    market = returns @ index_weights
+
+    std = portfolio.std(ddof=1)
+    volatility = std * np.sqrt(periods_per_year)
+
+    market_var = market.var(ddof=1)
+    beta = np.cov(portfolio, market, ddof=1)[0, 1] / market_var if market_var > 0 else 0.0
+
+    excess = portfolio.mean() - risk_free_rate / periods_per_year
+    sharpe = excess / std * np.sqrt(periods_per_year) if std > 0 else 0.0
+
+    equity = np.cumprod(1.0 + portfolio)
+    drawdown = equity / np.maximum.accumulate(equity) - 1.0
+
+    return {
+        "sharpe_ratio": float(sharpe),
+        "beta": float(beta),
+        "volatility": float(volatility * 100),
+        "max_drawdown": float(min(drawdown.min(), 0.0) * 100),
+    }
+
+
+class RiskCalculator:
+    """Risk metrics per set of holdings, cached until the next bar"""
+
+    def __init__(self, history, index_tickers: list):
+        self.history = history
+        self.index_tickers = list(index_tickers)
+        self._lock = threading.Lock()
+        self._bar = None
+
+    def _current_bar(self):
+        bar_time, tickers, closes = self.history.window()
+        with self._lock:
+            if self._bar is None or self._bar["time"] != bar_time:
+                # New bar: one returns matrix and index for everybody
+                index = np.isin(tickers, self.index_tickers).astype(float)
+                self._bar = {
+                    "time": bar_time,
+                    "returns": bar_returns(closes),
+                    "index_weights": index / index.sum() if index.sum() else index,
+                    "last_close": closes[-1] if len(closes) else np.zeros(0),
+                    "columns": {ticker: i for i, ticker in enumerate(tickers)},
+                    "cache": {},
+                }
+            return self._bar
+
+    def metrics(self, holdings: dict):
+        """Metrics for {ticker: quantity}, or None until there's enough history"""
+        bar = self._current_bar()
+        key = tuple(sorted(holdings.items()))
+        if key in bar["cache"]:
+            return bar["cache"][key]
+
+        result = None
+        weights = np.zeros(len(bar["columns"]))
+        for ticker, quantity in holdings.items():
+            column = bar["columns"].get(ticker)
+            if column is not None and not np.isnan(bar["last_close"][column]):
+                weights[column] = quantity * bar["last_close"][column]
+        if len(bar["returns"]) >= MIN_RETURNS and weights.sum() > 0:
+            result = compute_metrics(bar["returns"], weights / weights.sum(), bar["index_weights"])
+
+        bar["cache"][key] = result
+        return result
@@ -1,5 +1,5 @@
 from pydantic import BaseModel
-from typing import List, Optional
+from typing import List, Literal, Optional
 from datetime import datetime
 
 # --- User Schemas ---
@@ -25,6 +25,9 @@ class LoginResponse(BaseModel):
     user_id: int
     username: str
     message: str = "Login successful"
+    # Send as "Authorization: Bearer <access_token>" on later requests
+    access_token: str
+    token_type: str = "bearer"
 
 # --- Transaction Schemas ---
 class TransactionBase(BaseModel):
@@ -35,6 +38,54 @@ class TransactionCreate(TransactionBase):
     user_id: int
     # Logic: If quantity > 0 it's a BUY, if < 0 it's a SELL
 
+# --- Batch Trade Schemas ---
+class BatchTradeRequest(BaseModel):
+    orders: List[TransactionCreate]
+    # "atomic": all orders fill or none do; "best_effort": reject the ones that can't fill
+    mode: Literal["atomic", "best_effort"] = "atomic"
+    # best_effort only: commit every N orders instead of once at the end
+    chunk_size: Optional[int] = None
+
+class BatchTradeResult(BaseModel):
+    index: int
+    user_id: int
+    ticker: str
+    quantity: int
+    status: str  # "filled" or "rejected"
+    price: Optional[float] = None
+    new_balance: Optional[float] = None
+    detail: Optional[str] = None
+
+class BatchTradeResponse(BaseModel):
+    mode: str
+    filled: int
+    rejected: int
+    results: List[BatchTradeResult]
+
+# --- Limit / Stop Order Schemas ---
+class OrderCreate(TransactionCreate):
+    # "limit": fill once the price is at or better than `price`
+    # "stop": trade at market once the price reaches `price`
+    order_type: Literal["limit", "stop"]
+    price: float
+
+class OrderResponse(BaseModel):
+    id: int
+    user_id: int
+    ticker: str
+    quantity: int
+    type: str  # "BUY" or "SELL"
+    order_type: str  # "LIMIT" or "STOP"
+    price: float
+    status: str  # "OPEN", "FILLED", "CANCELLED" or "REJECTED"
+    created_at: datetime
+    filled_at: Optional[datetime] = None
+    fill_price: Optional[float] = None
+    detail: Optional[str] = None
+
+    class Config:
+        from_attributes = True
+
 class TransactionResponse(TransactionBase):
     id: int
     price_per_share: float
@@ -110,5 +161,29 @@ class SectorBreakdownItem(BaseModel):
 
 # --- Performance Data Point ---
 class PerformanceDataPoint(BaseModel):
-    day: int
-    value: float
\ No newline at end of file
+    day: int  # Whole days since the first point
+    value: float
+    timestamp: Optional[datetime] = None
+
+# --- Leaderboard ---
+class LeaderboardEntry(BaseModel):
+    rank: int
+    user_id: int
+    username: str
+    total_value: float
+    pnl: float  # Against the starting balance
+
+class LeaderboardStanding(BaseModel):
+    entry: LeaderboardEntry
+    total_accounts: int
+    neighbors: List[LeaderboardEntry]  # Includes the user's own entry
+
+# --- Dashboard Schema (Everything the Dashboard shows, in one response) ---
+class DashboardResponse(BaseModel):
+    summary: PortfolioSummary
+    portfolio: List[PortfolioItem]
+    risk_metrics: RiskMetrics
+    history: List[TradeHistoryItem]
+    allocation: List[PortfolioAllocationItem]
+    sectors: List[SectorBreakdownItem]
+    market_prices: List[MarketPrice]
\ No newline at end of file
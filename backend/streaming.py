@@ -0,0 +1,111 @@
+"""
+Push price and portfolio updates to connected dashboards.
+
+Routes run on FastAPI's threadpool, so they never touch subscribers
+directly: `publish_prices` / `publish_portfolio` only merge the change into
+a pending set under a lock. Once per tick the event loop drains that set
+and hands one coalesced update to every subscriber.
+
+Each subscriber keeps at most one pending price map and one pending
+portfolio map (bounded by the number of tickers). A client that reads
+slower than we tick just gets the latest values when it catches up, so
+the server never queues an unbounded backlog for it.
+"""
+import asyncio
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class Subscriber:
+    """A connected client and the updates it hasn't received yet"""
+
+    def __init__(self, user_id: int):
+        self.user_id = user_id
+        self.pending_prices = {}
+        self.pending_portfolio = {}
+        self.ready = asyncio.Event()
+
+    def offer(self, prices: dict, portfolio: dict):
+        """Merge an update into the pending one (newer values win, per ticker for positions)"""
+        if prices:
+            self.pending_prices.update(prices)
+        if portfolio:
+            pending = self.pending_portfolio.setdefault("positions", {})
+            pending.update(portfolio.get("positions", {}))
+            if "wallet_balance" in portfolio:
+                self.pending_portfolio["wallet_balance"] = portfolio["wallet_balance"]
+        if self.pending_prices or self.pending_portfolio:
+            self.ready.set()
+
+    async def next_messages(self):
+        """Wait for pending updates and return them as messages"""
+        await self.ready.wait()
+        self.ready.clear()
+
+        messages = []
+        if self.pending_prices:
+            messages.append({"type": "prices", "prices": self.pending_prices})
+            self.pending_prices = {}
+        if self.pending_portfolio:
+            messages.append({"type": "portfolio", **self.pending_portfolio})
+            self.pending_portfolio = {}
+        return messages
+
+
+class StreamHub:
+    """Collects changes from any thread and fans them out once per tick"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._prices = {}
+        self._portfolios = {}
+        self._subscribers = set()
+
+    def publish_prices(self, prices: dict):
+        """Record new prices ({ticker: price}); safe to call from any thread"""
+        with self._lock:
+            self._prices.update(prices)
+
+    def publish_portfolio(self, user_id: int, delta: dict):
+        """Record a change to one user's portfolio; safe to call from any thread"""
+        with self._lock:
+            pending = self._portfolios.setdefault(user_id, {"positions": {}})
+            pending["positions"].update(delta.get("positions", {}))
+            if "wallet_balance" in delta:
+                pending["wallet_balance"] = delta["wallet_balance"]
+
+    def subscribe(self, user_id: int) -> Subscriber:
+        subscriber = Subscriber(user_id)
+        self._subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber):
+        self._subscribers.discard(subscriber)
+
+    def flush(self):
+        """Deliver everything published since the last flush (event loop only)"""
+        with self._lock:
+            prices, self._prices = self._prices, {}
+            portfolios, self._portfolios = self._portfolios, {}
+
+        if not prices and not portfolios:
+            return
+
+        for subscriber in list(self._subscribers):
+            subscriber.offer(prices, portfolios.get(subscriber.user_id))
+
+    async def run(self, interval: float, on_tick=None):
+        """Tick forever: run `on_tick` (e.g. the volatility step), then flush. A failed tick is logged and skipped."""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                if on_tick is not None:
+                    on_tick()
+                self.flush()
+            except Exception:
+                logger.exception("Stream tick failed, continuing")
+
+
+hub = StreamHub()
@@ -8,7 +8,8 @@ import './App.css';
 // Protected Route Component
 const ProtectedRoute = ({ children }) => {
   const userId = localStorage.getItem('userId');
-  return userId ? children : <Navigate to="/login" replace />;
+  const token = localStorage.getItem('token');
+  return userId && token ? children : <Navigate to="/login" replace />;
 };
 
 function App() {
@@ -30,36 +30,66 @@ function Dashboard() {
 
   useEffect(() => {
     fetchAllData();
-    const interval = setInterval(fetchAllData, 30000);
-    return () => clearInterval(interval);
+
+    // Prices and trades are pushed over a WebSocket; only poll while it's down
+    let socket;
+    let reconnectTimer;
+    let closed = false;
+    const interval = setInterval(() => {
+      if (!socket || socket.readyState !== WebSocket.OPEN) fetchAllData();
+    }, 30000);
+
+    const connect = () => {
+      const token = encodeURIComponent(localStorage.getItem('token') || '');
+      socket = new WebSocket(`ws://localhost:8000/ws/${userId}?token=${token}`);
+      socket.onmessage = (event) => {
+        const message = JSON.parse(event.data);
+        if (message.type === 'prices') {
+          setMarketPrices((prev) => prev.map((stock) =>
+            message.prices[stock.ticker] !== undefined
+              ? { ...stock, current_price: message.prices[stock.ticker] }
+              : stock
+          ));
+        } else if (message.type === 'portfolio') {
+          fetchAllData();
+        }
+      };
+      socket.onclose = () => {
+        if (!closed) reconnectTimer = setTimeout(connect, 5000);
+      };
+    };
+    connect();
+
+    return () => {
+      closed = true;
+      clearInterval(interval);
+      clearTimeout(reconnectTimer);
+      socket.close();
+    };
   }, []);
 
   const fetchAllData = async () => {
     try {
-      const [summaryRes, portfolioRes, riskRes, historyRes, allocRes, sectorsRes, marketRes] = await Promise.all([
-        axios.get(`http://localhost:8000/portfolio/${userId}/summary`),
-        axios.get(`http://localhost:8000/portfolio/${userId}`),
-        axios.get(`http://localhost:8000/portfolio/${userId}/risk-metrics`),
-        axios.get(`http://localhost:8000/trades/${userId}/history?limit=5`),
-        axios.get(`http://localhost:8000/portfolio/${userId}/allocation`),
-        axios.get(`http://localhost:8000/portfolio/${userId}/sectors`),
-        axios.get(`http://localhost:8000/market/prices`)
-      ]);
-
-      setSummary(summaryRes.data);
-      setPortfolio(portfolioRes.data);
-      setRiskMetrics(riskRes.data);
-      setTradeHistory(historyRes.data);
-      setAllocation(allocRes.data);
-      setSectors(sectorsRes.data);
-      setMarketPrices(marketRes.data);
+      // One request returns everything the dashboard shows
+      const { data } = await axios.get(`http://localhost:8000/dashboard/${userId}?history_limit=5`);
+
+      setSummary(data.summary);
+      setPortfolio(data.portfolio);
+      setRiskMetrics(data.risk_metrics);
+      setTradeHistory(data.history);
+      setAllocation(data.allocation);
+      setSectors(data.sectors);
+      setMarketPrices(data.market_prices);
     } catch (error) {
       console.error('Error fetching data:', error);
+      // Expired or missing session token: sign in again
+      if (error.response?.status === 401) handleLogout();
     }
   };
 
   const handleLogout = () => {
     localStorage.removeItem('userId');
+    localStorage.removeItem('token');
     localStorage.removeItem('username');
     localStorage.removeItem('rememberMe');
     navigate('/login');
@@ -25,6 +25,7 @@ function Login() {
 
       if (response.data && response.data.user_id) {
         localStorage.setItem('userId', response.data.user_id);
+        localStorage.setItem('token', response.data.access_token);
         localStorage.setItem('username', response.data.username || email);
         if (rememberMe) {
           localStorage.setItem('rememberMe', 'true');